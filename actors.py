@@ -0,0 +1,119 @@
+"""Game actors: per-game mailboxes, so each game works through its commands one at a time
+
+Everything that touches a game - players' commands, its timer going off, votes from the select menus - gets queued in
+the mailbox for the game's channel, and a single task works through each mailbox in order. Commands in one game never
+interleave at an await, while different games still run side by side. A mailbox only holds so much: once it's full,
+players' commands get turned away instead of piling up, though the game's own timer callbacks always get in.
+"""
+import asyncio
+import collections
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+# Players' commands a game can have waiting before new ones get turned away
+MAILBOX_LIMIT = 20
+
+# Tell a channel it's too busy at most this often, so the notices don't add to the pile
+BUSY_NOTICE_INTERVAL = 10.0
+
+BUSY_MESSAGE = "This game is swamped right now! Please try that again in a moment."
+
+
+class Mailbox:
+    """Queue of jobs (coroutine functions) waiting to run for one game"""
+
+    def __init__(self, key, limit, on_empty=None, on_wait=None):
+        self.key = key
+        self.limit = limit
+        self.on_empty = on_empty
+        self.on_wait = on_wait
+        self.pending = collections.deque()
+        self.task = None
+
+    @property
+    def depth(self):
+        return len(self.pending)
+
+    def put(self, job, urgent=False):
+        """Queues a job to run once everything before it has, returning whether there was room for it
+
+        Urgent jobs always get in, however full the mailbox is.
+        """
+        if not urgent and len(self.pending) >= self.limit:
+            return False
+        self.pending.append((job, time.monotonic()))
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+        return True
+
+    async def _run(self):
+        try:
+            while self.pending:
+                job, queued_at = self.pending.popleft()
+                if self.on_wait is not None:
+                    self.on_wait(time.monotonic() - queued_at)
+                try:
+                    await job()
+                except Exception:  # pylint:disable=broad-except
+                    # One failed job shouldn't take the rest of the game's queue down with it
+                    log.exception("Job for game %s failed", self.key)
+        finally:
+            self.task = None
+            if not self.pending and self.on_empty is not None:
+                self.on_empty(self)
+
+
+class MailboxManager:
+    """Every busy game's mailbox (idle ones get dropped until they're needed again)"""
+
+    def __init__(self, limit=MAILBOX_LIMIT):
+        self.limit = limit
+        self.mailboxes = {}
+        self.rejected = collections.Counter()
+        self.busy_notices = {}
+        # Called with the number of seconds each job waited in its mailbox
+        self.on_wait = None
+
+    def __iter__(self):
+        return iter(self.mailboxes.values())
+
+    def put(self, key, job, urgent=False):
+        """Queues a job in a game's mailbox, returning whether there was room for it"""
+        mailbox = self.mailboxes.get(key)
+        if mailbox is None:
+            mailbox = self.mailboxes[key] = Mailbox(key, self.limit, self._drop, self._waited)
+        if mailbox.put(job, urgent):
+            return True
+        self.rejected[key] += 1
+        log.debug("Turned a command away from game %s with %d already waiting", key, mailbox.depth)
+        return False
+
+    def should_notify(self, key):
+        """Whether it's been long enough since a game's channel was last told it's too busy"""
+        now = time.monotonic()
+        if now - self.busy_notices.get(key, -BUSY_NOTICE_INTERVAL) < BUSY_NOTICE_INTERVAL:
+            return False
+        self.busy_notices[key] = now
+        return True
+
+    def _drop(self, mailbox):
+        if self.mailboxes.get(mailbox.key) is mailbox:
+            del self.mailboxes[mailbox.key]
+
+    def _waited(self, seconds):
+        if self.on_wait is not None:
+            self.on_wait(seconds)
+
+
+mailboxes = MailboxManager()
+
+
+def serialized(command):
+    """Whether a command has to wait its turn in its game's mailbox
+
+    Commands that don't touch the game (and anything that takes a long time on purpose, like =profile) can say
+    otherwise with extras={"serialized": False}.
+    """
+    return command.extras.get("serialized", True)
@@ -0,0 +1,307 @@
+"""SQLite archive of finished games, with running totals per player and per server
+
+Games get written here (by the journal's writer thread) once they've ended. Alongside the raw record of every game,
+day and vote, player_stats and server_stats keep running totals that are added to as each game is stored, so looking
+someone's stats up is a single primary key read no matter how many games have been played.
+"""
+import logging
+import sqlite3
+import threading
+
+log = logging.getLogger(__name__)
+
+ARCHIVE_FILE = "archive.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    guild_id INTEGER,
+    channel_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    host_id INTEGER NOT NULL,
+    host_name TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    ended_at REAL NOT NULL,
+    days INTEGER NOT NULL,
+    players INTEGER NOT NULL,
+    survivors INTEGER NOT NULL,
+    UNIQUE (channel_id, started_at)
+);
+CREATE INDEX IF NOT EXISTS games_by_guild ON games (guild_id, ended_at);
+
+CREATE TABLE IF NOT EXISTS participants (
+    game_id INTEGER NOT NULL REFERENCES games (id),
+    user_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    eliminated_day INTEGER,
+    eliminated_phase TEXT,
+    days_played INTEGER NOT NULL,
+    PRIMARY KEY (game_id, user_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS participants_by_user ON participants (user_id, game_id);
+
+CREATE TABLE IF NOT EXISTS days (
+    game_id INTEGER NOT NULL REFERENCES games (id),
+    day INTEGER NOT NULL,
+    started_at REAL NOT NULL,
+    voting_at REAL,
+    ended_at REAL NOT NULL,
+    eliminated INTEGER,
+    PRIMARY KEY (game_id, day)
+) WITHOUT ROWID;
+
+-- Every vote cast, in order; final is set on the ones still standing when voting ended
+CREATE TABLE IF NOT EXISTS votes (
+    game_id INTEGER NOT NULL REFERENCES games (id),
+    seq INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    voter_id INTEGER NOT NULL,
+    target_id INTEGER,
+    cast_at REAL NOT NULL,
+    final INTEGER NOT NULL,
+    PRIMARY KEY (game_id, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS votes_by_target ON votes (target_id) WHERE target_id IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS player_stats (
+    guild_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    games INTEGER NOT NULL DEFAULT 0,
+    hosted INTEGER NOT NULL DEFAULT 0,
+    survived INTEGER NOT NULL DEFAULT 0,
+    eliminated INTEGER NOT NULL DEFAULT 0,
+    days_played INTEGER NOT NULL DEFAULT 0,
+    votes_cast INTEGER NOT NULL DEFAULT 0,
+    abstains INTEGER NOT NULL DEFAULT 0,
+    votes_received INTEGER NOT NULL DEFAULT 0,
+    last_played REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, user_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS server_stats (
+    guild_id INTEGER PRIMARY KEY,
+    games INTEGER NOT NULL DEFAULT 0,
+    players INTEGER NOT NULL DEFAULT 0,
+    days INTEGER NOT NULL DEFAULT 0,
+    seconds REAL NOT NULL DEFAULT 0,
+    last_game REAL NOT NULL DEFAULT 0
+);
+"""
+
+PLAYER_STATS_FIELDS = (
+    "games",
+    "hosted",
+    "survived",
+    "eliminated",
+    "days_played",
+    "votes_cast",
+    "abstains",
+    "votes_received",
+)
+
+
+def summarize(state):
+    """Works out the days, votes and participants of a finished game from its journal state"""
+    history = state["history"]
+    started_at = next((entry[-1] for entry in history if entry[0] == "start"), None)
+    ended_at = history[-1][-1]
+    days = {}
+    # Votes as [day, voter, target, at, final]; each voter's latest vote since the ballot was last cleared is final
+    votes = []
+    standing = {}
+    eliminated = {}
+    for entry in history:
+        op = entry[0]
+        if op == "phase":
+            _, phase, day, at = entry
+            if phase == "DAY":
+                days.setdefault(day, {"started_at": at, "voting_at": None, "ended_at": None, "eliminated": None})
+            elif phase == "VOTE" and day in days and days[day]["voting_at"] is None:
+                days[day]["voting_at"] = at
+            elif phase == "NIGHT" and day in days:
+                days[day]["ended_at"] = at
+        elif op == "vote":
+            _, voter, target, day, at = entry
+            previous = standing.get(voter)
+            if previous is not None:
+                previous[4] = False
+            standing[voter] = vote = [day, voter, None if target == "abstain" else target, at, True]
+            votes.append(vote)
+        elif op == "clear_votes":
+            for vote in standing.values():
+                vote[4] = False
+            standing = {}
+        elif op == "kill":
+            _, user, day, phase, _ = entry
+            eliminated[user] = (day, phase)
+            if day in days and phase in ("VOTE", "TWILIGHT"):
+                days[day]["eliminated"] = user
+    for day in days.values():
+        if day["ended_at"] is None:
+            day["ended_at"] = ended_at
+    return started_at if started_at is not None else ended_at, ended_at, days, votes, eliminated
+
+
+class Archive:
+    """The archive database, safe to use from any thread"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.row_factory = sqlite3.Row
+            self._db.execute("PRAGMA journal_mode = WAL")
+            self._db.execute("PRAGMA synchronous = NORMAL")
+            self._db.executescript(SCHEMA)
+        return self._db
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def store(self, key, state):
+        """Adds a finished game (as kept by the journal) to the archive, along with everyone's running totals
+
+        Storing the same game twice does nothing the second time.
+        """
+        if not state["active"]:
+            return
+        guild_id, channel_id = key
+        started_at, ended_at, days, votes, eliminated = summarize(state)
+        players = {int(uid): name for uid, (name, _tag) in state["players"].items()}
+        last_day = state["day"]
+        with self._lock:
+            db = self._connect()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = db.execute(
+                    "INSERT OR IGNORE INTO games (guild_id, channel_id, name, host_id, host_name, started_at, "
+                    + "ended_at, days, players, survivors) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        guild_id,
+                        channel_id,
+                        state["name"],
+                        state["host"],
+                        state["host_name"],
+                        started_at,
+                        ended_at,
+                        last_day,
+                        len(players),
+                        len(players) - len(eliminated),
+                    ),
+                )
+                if cursor.rowcount == 0:
+                    db.execute("ROLLBACK")
+                    log.info("Game %s is already archived", key)
+                    return
+                game_id = cursor.lastrowid
+                self._insert_details(db, game_id, players, days, votes, eliminated, last_day)
+                self._add_totals(db, guild_id, state, players, days, votes, eliminated, last_day, ended_at)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        log.info("Archived game %s (%d players, %d days)", key, len(players), last_day)
+
+    @staticmethod
+    def _insert_details(db, game_id, players, days, votes, eliminated, last_day):
+        db.executemany(
+            "INSERT INTO participants VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (game_id, uid, name, *eliminated.get(uid, (None, None)), eliminated.get(uid, (last_day,))[0])
+                for uid, name in players.items()
+            ],
+        )
+        db.executemany(
+            "INSERT INTO days VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (game_id, day, d["started_at"], d["voting_at"], d["ended_at"], d["eliminated"])
+                for day, d in sorted(days.items())
+            ],
+        )
+        db.executemany(
+            "INSERT INTO votes VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(game_id, seq, *vote) for seq, vote in enumerate(votes)],
+        )
+
+    @staticmethod
+    def _add_totals(db, guild_id, state, players, days, votes, eliminated, last_day, ended_at):
+        totals = {uid: dict.fromkeys(PLAYER_STATS_FIELDS, 0) for uid in players}
+        totals.setdefault(state["host"], dict.fromkeys(PLAYER_STATS_FIELDS, 0))["hosted"] = 1
+        names = {state["host"]: state["host_name"], **players}
+        for uid in players:
+            totals[uid]["games"] = 1
+            totals[uid]["survived"] = int(uid not in eliminated)
+            totals[uid]["eliminated"] = int(uid in eliminated)
+            totals[uid]["days_played"] = eliminated.get(uid, (last_day,))[0]
+        for _day, voter, target, _at, final in votes:
+            if not final:
+                continue
+            if voter in totals:
+                totals[voter]["votes_cast"] += 1
+                totals[voter]["abstains"] += target is None
+            if target in totals:
+                totals[target]["votes_received"] += 1
+        columns = ", ".join(PLAYER_STATS_FIELDS)
+        updates = ", ".join(f"{field} = {field} + excluded.{field}" for field in PLAYER_STATS_FIELDS)
+        db.executemany(
+            f"INSERT INTO player_stats (guild_id, user_id, name, {columns}, last_played) "
+            + f"VALUES (?, ?, ?, {', '.join('?' * len(PLAYER_STATS_FIELDS))}, ?) "
+            + f"ON CONFLICT (guild_id, user_id) DO UPDATE SET name = excluded.name, {updates}, "
+            + "last_played = excluded.last_played",
+            [
+                (guild_id, uid, names[uid], *(counts[field] for field in PLAYER_STATS_FIELDS), ended_at)
+                for uid, counts in totals.items()
+            ],
+        )
+        seconds = sum(d["ended_at"] - d["started_at"] for d in days.values())
+        db.execute(
+            "INSERT INTO server_stats VALUES (?, 1, ?, ?, ?, ?) ON CONFLICT (guild_id) DO UPDATE SET "
+            + "games = games + 1, players = players + excluded.players, days = days + excluded.days, "
+            + "seconds = seconds + excluded.seconds, last_game = excluded.last_game",
+            (guild_id, len(players), last_day, seconds, ended_at),
+        )
+
+    def player_stats(self, guild_id, user_id):
+        """Someone's running totals in a server, or None if they've never played or hosted there"""
+        with self._lock:
+            return (
+                self._connect()
+                .execute("SELECT * FROM player_stats WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+                .fetchone()
+            )
+
+    def server_stats(self, guild_id):
+        with self._lock:
+            return self._connect().execute("SELECT * FROM server_stats WHERE guild_id = ?", (guild_id,)).fetchone()
+
+    def recent_games(self, guild_id, limit=10):
+        """A server's latest games, newest first"""
+        with self._lock:
+            return (
+                self._connect()
+                .execute("SELECT * FROM games WHERE guild_id IS ? ORDER BY ended_at DESC LIMIT ?", (guild_id, limit))
+                .fetchall()
+            )
+
+    def player_games(self, guild_id, user_id, limit=10):
+        """Someone's latest games in a server, newest first, with how they went for them"""
+        with self._lock:
+            return (
+                self._connect()
+                .execute(
+                    "SELECT games.*, participants.eliminated_day, participants.eliminated_phase, "
+                    + "participants.days_played "
+                    + "FROM participants JOIN games ON games.id = participants.game_id "
+                    + "WHERE participants.user_id = ? AND games.guild_id IS ? ORDER BY games.id DESC LIMIT ?",
+                    (user_id, guild_id, limit),
+                )
+                .fetchall()
+            )
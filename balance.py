@@ -0,0 +1,110 @@
+"""Monte Carlo simulation of how balanced a setup is
+
+Plays lots of random games at once with NumPy, following the same rules as mafia.Game: every day, each living player
+votes for someone (or abstains), and whoever gets a majority (half the living players plus one) is eliminated; every
+night, the mafia kill one townsperson. Town wins once the mafia are all gone, and the mafia win once they're at least
+as many as the town. Nobody knows anything, so each day the town settles on a random suspect (though some of them may
+abstain), and the mafia vote along with them unless the suspect is one of their own.
+
+    python balance.py 12 3 --games 1000000
+"""
+import argparse
+import collections
+import concurrent.futures
+
+import numpy as np
+
+# Games simulated per batch of arrays
+BATCH_SIZE = 1_000_000
+
+# Chance that a townsperson abstains instead of voting for someone
+DEFAULT_ABSTAIN_RATE = 0.1
+
+# After this many days a game is called a draw (which random play basically never gets to)
+MAX_DAYS = 100
+
+Balance = collections.namedtuple("Balance", "games town_wins mafia_wins draws town_rate mafia_rate mean_days")
+
+
+def simulate_batch(players, mafia, games, abstain_rate=DEFAULT_ABSTAIN_RATE, seed=None):
+    """Plays a batch of games, returning (town wins, mafia wins, draws, total days played over every finished game)
+
+    Nobody's identity matters to random play, so each game is just its count of living townspeople and mafia.
+    """
+    rng = np.random.default_rng(seed)
+    town = np.full(games, players - mafia, dtype=np.int64)
+    scum = np.full(games, mafia, dtype=np.int64)
+    days = np.zeros(games, dtype=np.int64)
+    playing = np.full(games, mafia < players - mafia)
+
+    for _ in range(MAX_DAYS):
+        rows = np.flatnonzero(playing)
+        if len(rows) == 0:
+            break
+        days[rows] += 1
+        t, m = town[rows], scum[rows]
+
+        # Day: the town piles onto a random suspect, and the mafia join in unless it's one of their own
+        suspect_is_mafia = rng.random(len(rows)) * (t + m) < m
+        town_voters = t - ~suspect_is_mafia
+        votes = rng.binomial(town_voters, 1 - abstain_rate) + np.where(suspect_is_mafia, 0, m)
+        lynched = votes >= (t + m) // 2 + 1
+        scum[rows] -= lynched & suspect_is_mafia
+        town[rows] -= lynched & ~suspect_is_mafia
+
+        # Night: if nobody's won yet, the mafia kill a townsperson
+        t, m = town[rows], scum[rows]
+        night = (m > 0) & (m < t)
+        town[rows] -= night
+
+        t = town[rows]
+        playing[rows] = (m > 0) & (m < t)
+
+    town_won = (scum == 0) & ~playing
+    mafia_won = (scum > 0) & ~playing
+    return int(town_won.sum()), int(mafia_won.sum()), int(playing.sum()), int(days[~playing].sum())
+
+
+def simulate(players, mafia, games=BATCH_SIZE, abstain_rate=DEFAULT_ABSTAIN_RATE, workers=1, seed=None):
+    """Plays lots of random games of a setup, returning a Balance of the results
+
+    With more than one worker, batches get spread over a process pool.
+    """
+    if not 0 < mafia < players:
+        raise ValueError("There has to be at least one mafia member and at least one townsperson!")
+    batches = [min(BATCH_SIZE, games - start) for start in range(0, games, BATCH_SIZE)]
+    seeds = np.random.SeedSequence(seed).spawn(len(batches))
+    args = [(players, mafia, size, abstain_rate, s) for size, s in zip(batches, seeds)]
+    if workers > 1 and len(batches) > 1:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(simulate_batch, *zip(*args)))
+    else:
+        results = [simulate_batch(*a) for a in args]
+
+    town_wins, mafia_wins, draws, days = (sum(column) for column in zip(*results))
+    finished = town_wins + mafia_wins
+    return Balance(
+        games,
+        town_wins,
+        mafia_wins,
+        draws,
+        town_wins / games,
+        mafia_wins / games,
+        days / finished if finished else 0.0,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("players", type=int)
+    parser.add_argument("mafia", type=int)
+    parser.add_argument("--games", type=int, default=1_000_000)
+    parser.add_argument("--abstain-rate", type=float, default=DEFAULT_ABSTAIN_RATE)
+    parser.add_argument("--workers", type=int, default=1, help="number of processes to spread the games over")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    result = simulate(args.players, args.mafia, args.games, args.abstain_rate, args.workers, args.seed)
+    print(
+        f"{args.players} players, {args.mafia} mafia, {result.games} games: town wins {result.town_rate:.1%}, "
+        + f"mafia wins {result.mafia_rate:.1%}, {result.draws} draws, {result.mean_days:.2f} days on average"
+    )
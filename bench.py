@@ -0,0 +1,271 @@
+"""Headless load test for the bot's command handlers
+
+Drives the bot's real commands for lots of simultaneous games using fake Discord objects that just record
+what gets sent, then reports throughput, per-command latency, event loop lag and memory per game.
+
+    python bench.py --games 1000 --players 12
+"""
+import argparse
+import asyncio
+import collections
+import gc
+import itertools
+import random
+import time
+import tracemalloc
+
+import tobaifam
+from outbox import outboxes
+
+_ids = itertools.count(10**17)
+
+
+class FakeGuild:
+    def __init__(self):
+        self.id = next(_ids)
+
+
+class FakeMember:
+    def __init__(self, name):
+        self.id = next(_ids)
+        self.name = name
+        self.display_name = name.title()
+        self.discriminator = "0"
+        self.mention = f"<@{self.id}>"
+        self.bot = False
+
+    def __str__(self):
+        return self.name
+
+    def __eq__(self, other):
+        return isinstance(other, FakeMember) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class FakeMessage:
+    def __init__(self, channel, content, author=None, mentions=()):
+        self.id = next(_ids)
+        self.channel = channel
+        self.guild = channel.guild
+        self.content = content
+        self.author = author
+        self.mentions = list(mentions)
+
+    async def delete(self):
+        await self.channel.api_call("delete")
+
+    async def edit(self, content=None, **_kwargs):
+        self.content = content
+        await self.channel.api_call("edit")
+
+    async def pin(self):
+        await self.channel.api_call("pin")
+
+    async def unpin(self):
+        await self.channel.api_call("unpin")
+
+
+class FakeChannel:
+    """Records everything the bot does to it instead of talking to Discord"""
+
+    def __init__(self, guild, latency=0.0):
+        self.id = next(_ids)
+        self.guild = guild
+        self.latency = latency
+        self.api_calls = collections.Counter()
+        self.sent = []
+
+    async def api_call(self, kind):
+        self.api_calls[kind] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def send(self, content=None, **_kwargs):
+        await self.api_call("send")
+        self.sent.append(content)
+        return FakeMessage(self, content)
+
+    async def delete_messages(self, messages):
+        await self.api_call("bulk_delete")
+        return len(messages)
+
+
+class FakeContext:
+    def __init__(self, channel, author, content="", mentions=()):
+        self.bot = tobaifam.bot
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.message = FakeMessage(channel, content, author, mentions)
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)
+        self.lag = []
+
+    async def run(self, name, channel, author, *args, mentions=(), **kwargs):
+        ctx = FakeContext(channel, author, f"{tobaifam.bot.command_prefix}{name}", mentions)
+        started = time.perf_counter()
+        await tobaifam.bot.get_command(name)(ctx, *args, **kwargs)
+        self.latencies[name].append(time.perf_counter() - started)
+
+    @property
+    def commands(self):
+        return sum(len(v) for v in self.latencies.values())
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+
+async def monitor_lag(stats, interval=0.01):
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        stats.lag.append(loop.time() - started - interval)
+
+
+async def wait_for_phase(game, phase, timeout):
+    deadline = time.monotonic() + timeout
+    while game.phase != phase and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+
+async def play_game(stats, n_players, days, rng, latency):
+    channel = FakeChannel(FakeGuild(), latency)
+    host = FakeMember(f"host{channel.id}")
+    players = [FakeMember(f"player{channel.id}x{i}") for i in range(n_players)]
+    members = {p.id: p for p in players}
+
+    await stats.run("host", channel, host)
+    for p in players:
+        await stats.run("join", channel, p)
+    await stats.run("start", channel, host)
+    game = tobaifam.games.get(channel)
+
+    for _ in range(days):
+        if len(game.players) < 3:
+            break
+        await stats.run("day", channel, host)
+        await stats.run("votingphase", channel, host)
+        for voter in [members[uid] for uid in game.players]:
+            if game.phase != game.Phase.VOTE:
+                break
+            if rng.random() < 0.1:
+                await stats.run("abstain", channel, voter)
+            else:
+                target = members[rng.choice(game.players)]
+                if rng.random() < 0.5:
+                    await stats.run("vote", channel, voter, arg=target.mention, mentions=[target])
+                else:
+                    await stats.run("vote", channel, voter, arg=target.name)
+        if game.phase == game.Phase.VOTE:
+            await stats.run("timer", channel, host, arg="0s")
+            await wait_for_phase(game, game.Phase.TWILIGHT, 5)
+        await stats.run("night", channel, host)
+        if len(game.players) > 3:
+            target = members[rng.choice(game.players)]
+            await stats.run("kill", channel, host, arg=target.mention, mentions=[target])
+        await stats.run("timer", channel, host, arg="1s")
+        await wait_for_phase(game, game.Phase.DAY, 5)
+    return channel
+
+
+async def measure_memory(n_games, n_players):
+    """Traced memory held per game once signups are done"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    channels = []
+    for _ in range(n_games):
+        channel = FakeChannel(FakeGuild())
+        host = FakeMember(f"host{channel.id}")
+        await tobaifam.bot.get_command("host")(FakeContext(channel, host))
+        for i in range(n_players):
+            await tobaifam.bot.get_command("join")(FakeContext(channel, FakeMember(f"player{channel.id}x{i}")))
+        channels.append(channel)
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    total = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    game_only = sum(
+        stat.size_diff
+        for stat in after.compare_to(before, "filename")
+        if stat.traceback[0].filename.endswith("mafia.py")
+    )
+    for channel in channels:
+        tobaifam.games.remove(channel)
+    return total / n_games, game_only / n_games
+
+
+async def drain_outboxes(timeout):
+    """Waits for every channel's outbox to send what's queued, returning how many messages were still left at timeout"""
+    deadline = time.monotonic() + timeout
+    while any(o.task is not None for o in outboxes) and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    return sum(o.depth for o in outboxes)
+
+
+async def main(args):
+    await tobaifam.bot.load_extension(tobaifam.EXTENSION)
+    rng = random.Random(args.seed)
+    stats = Stats()
+    lag_task = asyncio.create_task(monitor_lag(stats))
+
+    started = time.perf_counter()
+    channels = await asyncio.gather(
+        *(play_game(stats, args.players, args.days, rng, args.send_latency) for _ in range(args.games))
+    )
+    elapsed = time.perf_counter() - started
+    lag_task.cancel()
+
+    # Messages go out at no more than a few a second per channel, so plenty are still queued when the games finish
+    drain_started = time.perf_counter()
+    queued = await drain_outboxes(args.drain_timeout)
+    drain_elapsed = time.perf_counter() - drain_started
+    api_calls = collections.Counter()
+    for channel in channels:
+        api_calls.update(channel.api_calls)
+
+    print(f"{args.games} games x {args.players} players, {stats.commands} commands in {elapsed:.2f}s")
+    print(f"  throughput: {stats.commands / elapsed:.0f} commands/s")
+    print(f"  {'command':<12} {'count':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, values in sorted(stats.latencies.items()):
+        print(
+            f"  {name:<12} {len(values):>7}"
+            + "".join(f" {percentile(values, p) * 1000:>9.3f}" for p in (50, 90, 99, 100))
+        )
+    if stats.lag:
+        print(
+            f"  event loop lag: p50 {percentile(stats.lag, 50) * 1000:.2f}ms, "
+            + f"p99 {percentile(stats.lag, 99) * 1000:.2f}ms, max {max(stats.lag) * 1000:.2f}ms"
+        )
+    print(f"  API calls: {dict(api_calls)} (after {drain_elapsed:.1f}s sending queued messages)")
+    if queued:
+        print(f"  {queued} messages still queued after {args.drain_timeout:.0f}s, not counted above")
+
+    total, game_only = await measure_memory(args.memory_games, args.players)
+    print(f"  memory per game: {total / 1024:.1f} KiB total, {game_only / 1024:.1f} KiB in mafia.Game")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--games", type=int, default=200, help="number of simultaneous games")
+    parser.add_argument("--players", type=int, default=12, help="players per game")
+    parser.add_argument("--days", type=int, default=3, help="days to play in each game")
+    parser.add_argument("--send-latency", type=float, default=0.0, help="simulated seconds per Discord API call")
+    parser.add_argument(
+        "--drain-timeout", type=float, default=120.0, help="seconds to wait for queued messages before counting"
+    )
+    parser.add_argument("--memory-games", type=int, default=200, help="games to create when measuring memory")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,128 @@
+"""Messages that get edited in place to show something live, like the signup roster or the vote tally"""
+import asyncio
+import logging
+
+import discord
+
+from outbox import send, split_message
+
+log = logging.getLogger(__name__)
+
+# How long to wait for more changes before editing a board
+BOARD_DEBOUNCE = 1.0
+
+# Edits don't ping anyone anyway, so don't let the first version of a board either
+NO_MENTIONS = discord.AllowedMentions.none()
+
+
+class LiveBoard:
+    """Keeps one message per channel up to date by editing it in place
+
+    Updates are debounced, so a burst of changes (like lots of people joining at once) costs a single edit. A board
+    too long for one message is spread over as many pages as it needs; the first page can be pinned.
+    """
+
+    def __init__(self, render, delay=BOARD_DEBOUNCE, pin=False):
+        # Called with a channel, returning the text to show there (or None if there's nothing to show any more)
+        self.render = render
+        self.delay = delay
+        self.pin = pin
+        # channel id -> [[Message, content it was last given], ...] for each page
+        self.pages = {}
+        self.dirty = set()
+        self.tasks = {}
+        # Channels whose board is being rendered and shown right now
+        self.rendering = set()
+        self.edits = 0
+
+    def update(self, channel):
+        """Schedules the channel's board to be re-rendered"""
+        self.dirty.add(channel.id)
+        if channel.id not in self.tasks:
+            self.tasks[channel.id] = asyncio.create_task(self._run(channel))
+
+    def shown(self, channel):
+        """The text a channel's board is showing at the moment, or None if it isn't showing one"""
+        pages = self.pages.get(channel.id)
+        return "\n".join(content for _message, content in pages) if pages else None
+
+    async def stop(self, channel):
+        """Stops updating a channel's board, once any update that's under way has finished"""
+        self.dirty.discard(channel.id)
+        task = self.tasks.pop(channel.id, None)
+        if task is not None:
+            if channel.id in self.rendering:
+                # Cancelling it now would lose track of any page it's halfway through posting (the post still goes
+                # out), so the final version would get posted all over again; let it finish instead
+                await task
+            else:
+                task.cancel()
+
+    async def close(self, channel, final=None):
+        """Stops updating a channel's board, optionally showing one last version of it first"""
+        await self.stop(channel)
+        if final is not None:
+            await self._show(channel, split_message(final))
+        pages = self.pages.pop(channel.id, [])
+        if pages and self.pin:
+            try:
+                await pages[0][0].unpin()
+            except discord.HTTPException:
+                pass
+
+    async def _run(self, channel):
+        try:
+            # Once the board's been closed, this task isn't its task any more, and it leaves the board alone
+            while channel.id in self.dirty and self.tasks.get(channel.id) is asyncio.current_task():
+                await asyncio.sleep(self.delay)
+                self.dirty.discard(channel.id)
+                self.rendering.add(channel.id)
+                text = self.render(channel)
+                if text is not None:
+                    await self._show(channel, split_message(text))
+                self.rendering.discard(channel.id)
+        except Exception:  # pylint:disable=broad-except
+            log.exception("Couldn't update the board in channel %s", channel.id)
+        finally:
+            self.rendering.discard(channel.id)
+            if self.tasks.get(channel.id) is asyncio.current_task():
+                del self.tasks[channel.id]
+
+    async def _show(self, channel, contents):
+        pages = self.pages.setdefault(channel.id, [])
+        for i, content in enumerate(contents):
+            if i < len(pages):
+                if pages[i][1] == content:
+                    continue
+                try:
+                    await pages[i][0].edit(content=content)
+                    pages[i][1] = content
+                    self.edits += 1
+                    continue
+                except discord.NotFound:
+                    # Someone deleted this page, so post it (and everything after it, to keep them in order) again
+                    await self._delete(pages[i + 1 :])
+                    del pages[i:]
+                except discord.HTTPException as e:
+                    log.warning("Couldn't edit the board in channel %s: %s", channel.id, e)
+                    continue
+            message = await (await send(channel, content, allowed_mentions=NO_MENTIONS))
+            if message is None:
+                return
+            pages.append([message, content])
+            if i == 0 and self.pin:
+                try:
+                    await message.pin()
+                except discord.HTTPException as e:
+                    log.info("Couldn't pin the board in channel %s: %s", channel.id, e)
+        # The board got shorter, so get rid of the pages it doesn't need any more
+        await self._delete(pages[len(contents) :])
+        del pages[len(contents) :]
+
+    @staticmethod
+    async def _delete(pages):
+        for message, _ in pages:
+            try:
+                await message.delete()
+            except discord.HTTPException:
+                pass
@@ -0,0 +1,737 @@
+"""A stand-in for Discord's REST API and gateway, for end-to-end load tests on a single offline machine
+
+Serves just enough of Discord for the bot to log in, connect to the gateway, see its guilds and run games: sending,
+editing, deleting and pinning messages. Every REST call can be slowed down by a configurable latency, and each
+channel's message routes (plus the bot as a whole) are rate limited the way Discord does it, answering with 429s and
+the usual X-RateLimit headers. Fake users' messages are injected through a small control API under /_fake, and get
+delivered to the bot over the gateway just like real ones.
+
+The bot itself runs unmodified, pointed here with TOBAIFAM_DISCORD_URL:
+
+    python fakediscord.py serve --port 8399 --latency 0.05
+    TOBAIFAM_DISCORD_URL=http://127.0.0.1:8399 ACCESS_TOKEN=fake python tobaifam.py
+
+or, to start the bot and play lots of games against it in one go:
+
+    python fakediscord.py bench --games 20 --players 8 --rate-limit 3/5
+"""
+# pylint:disable=missing-function-docstring
+import argparse
+import asyncio
+import collections
+import datetime
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import secrets
+import signal
+import statistics
+import sys
+import tempfile
+import time
+
+import yarl
+from aiohttp import WSMsgType, web
+
+from shards import shard_for
+
+log = logging.getLogger("fakediscord")
+
+API_PREFIX = "/api/v10"
+
+# Milliseconds since the start of 2015, which is when Discord's snowflake ids count from
+DISCORD_EPOCH = 1420070400000
+
+# Gateway opcodes
+DISPATCH = 0
+HEARTBEAT = 1
+IDENTIFY = 2
+RESUME = 6
+INVALID_SESSION = 9
+HELLO = 10
+HEARTBEAT_ACK = 11
+
+HEARTBEAT_INTERVAL = 41250
+
+# Discord's own limits: 5 messages per 5 seconds per channel, and 50 requests a second in total
+DEFAULT_RATE_LIMIT = (5, 5.0)
+DEFAULT_GLOBAL_LIMIT = 50
+
+MENTION = re.compile(r"<@!?(\d+)>")
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tobaifam.py")
+
+_counter = itertools.count()
+
+
+def snowflake():
+    return ((int(time.time() * 1000) - DISCORD_EPOCH) << 22) | (next(_counter) & 0x3FFFFF)
+
+
+def timestamp():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def json_response(data, status=200, headers=None):
+    # discord.py only decodes a body as JSON if its content type is exactly this, with no charset after it
+    return web.Response(
+        body=json.dumps(data).encode(), status=status, headers={"Content-Type": "application/json", **(headers or {})}
+    )
+
+
+def json_error(status, message, code=0, headers=None):
+    return json_response({"message": message, "code": code}, status=status, headers=headers)
+
+
+def parse_rate_limit(text):
+    """Parses a rate limit like '5/5' (requests/seconds)"""
+    limit, _, period = text.partition("/")
+    return int(limit), float(period or 1)
+
+
+class RateLimit:
+    """A fixed window of requests, which is how Discord's buckets behave from the outside"""
+
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+        self.remaining = limit
+        self.reset = 0.0
+
+    def hit(self, now):
+        """Uses up a request if there's one left, returning whether there was"""
+        if now >= self.reset:
+            self.remaining = self.limit
+            self.reset = now + self.period
+        if self.remaining == 0:
+            return False
+        self.remaining -= 1
+        return True
+
+    def headers(self, bucket, now):
+        return {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": f"{time.time() + self.reset - now:.3f}",
+            "X-RateLimit-Reset-After": f"{self.reset - now:.3f}",
+            "X-RateLimit-Bucket": bucket,
+        }
+
+
+class Connection:
+    """One gateway session, which sends its events on (after the configured latency) in order"""
+
+    def __init__(self, ws, latency):
+        self.ws = ws
+        self.latency = latency
+        self.shard = (0, 1)
+        self.session_id = None
+        self.seq = 0
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._send_loop())
+
+    def send(self, op, d=None, t=None):
+        payload = {"op": op, "d": d}
+        if op == DISPATCH:
+            self.seq += 1
+            payload.update(t=t, s=self.seq)
+        self.queue.put_nowait((time.monotonic() + self.latency, json.dumps(payload)))
+
+    def handles(self, guild_id):
+        return shard_for(guild_id, self.shard[1]) == self.shard[0]
+
+    async def _send_loop(self):
+        while True:
+            due, text = await self.queue.get()
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                await self.ws.send_str(text)
+            except ConnectionError:
+                return
+
+
+class FakeDiscord:
+    """The fake API's state: one bot, some guilds full of text channels and members, and every message sent"""
+
+    def __init__(
+        self,
+        guilds=1,
+        channels=10,
+        members=50,
+        latency=0.0,
+        jitter=0.0,
+        rate_limit=DEFAULT_RATE_LIMIT,
+        global_limit=DEFAULT_GLOBAL_LIMIT,
+        ratelimit_headers=True,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.global_limit = RateLimit(global_limit, 1.0) if global_limit else None
+        self.ratelimit_headers = ratelimit_headers
+        self.url = None
+        self.bot_user = self.make_user("tobaifam", bot=True)
+        self.owner = self.make_user("operator")
+        self.application_id = snowflake()
+        self.guilds = {}
+        # channel id -> guild id
+        self.channels = {}
+        self.users = {self.bot_user["id"]: self.bot_user, self.owner["id"]: self.owner}
+        for g in range(guilds):
+            guild_id = snowflake()
+            guild_channels = [snowflake() for _ in range(channels)]
+            guild_members = [self.owner, self.bot_user] + [self.make_user(f"player{g}_{i}") for i in range(members)]
+            self.guilds[guild_id] = {"channels": guild_channels, "members": guild_members}
+            self.channels.update(dict.fromkeys(guild_channels, guild_id))
+            self.users.update((user["id"], user) for user in guild_members)
+        self.messages = {}
+        # channel id -> the bot's messages there, in order, and anyone waiting for a particular one
+        self.sent = collections.defaultdict(list)
+        self.waiters = collections.defaultdict(list)
+        self.connections = []
+        self.identified = asyncio.Event()
+        self.buckets = {}
+        self.requests = collections.Counter()
+        self.rate_limited = collections.Counter()
+
+    @staticmethod
+    def make_user(name, bot=False):
+        return {
+            "id": str(snowflake()),
+            "username": name,
+            "global_name": name.title(),
+            "discriminator": "0",
+            "avatar": None,
+            "bot": bot,
+        }
+
+    def member(self, user):
+        return {"user": user, "roles": [], "joined_at": timestamp(), "deaf": False, "mute": False, "flags": 0}
+
+    def guild_payload(self, guild_id):
+        guild = self.guilds[guild_id]
+        return {
+            "id": str(guild_id),
+            "name": f"Guild {guild_id}",
+            "icon": None,
+            "owner_id": self.owner["id"],
+            "unavailable": False,
+            "large": False,
+            "member_count": len(guild["members"]),
+            "roles": [
+                {
+                    "id": str(guild_id),
+                    "name": "@everyone",
+                    "permissions": str((1 << 50) - 1),
+                    "position": 0,
+                    "color": 0,
+                    "hoist": False,
+                    "managed": False,
+                    "mentionable": False,
+                }
+            ],
+            "channels": [
+                {
+                    "id": str(channel_id),
+                    "type": 0,
+                    "guild_id": str(guild_id),
+                    "name": f"game-{i}",
+                    "position": i,
+                    "permission_overwrites": [],
+                    "nsfw": False,
+                    "parent_id": None,
+                }
+                for i, channel_id in enumerate(guild["channels"])
+            ],
+            "members": [self.member(user) for user in guild["members"]],
+            "emojis": [],
+            "stickers": [],
+            "features": [],
+            "threads": [],
+            "presences": [],
+            "voice_states": [],
+            "joined_at": timestamp(),
+            "preferred_locale": "en-US",
+            "verification_level": 0,
+            "default_message_notifications": 0,
+            "explicit_content_filter": 0,
+            "mfa_level": 0,
+            "premium_tier": 0,
+            "nsfw_level": 0,
+            "system_channel_flags": 0,
+        }
+
+    #
+    # Messages
+    #
+    def create_message(self, channel_id, author, content, components=()):
+        """Stores a new message and tells the bot's gateway connection(s) about it"""
+        guild_id = self.channels[channel_id]
+        mentions = [self.users[uid] for uid in MENTION.findall(content or "") if uid in self.users]
+        message = {
+            "id": str(snowflake()),
+            "channel_id": str(channel_id),
+            "guild_id": str(guild_id),
+            "author": author,
+            "content": content or "",
+            "timestamp": timestamp(),
+            "edited_timestamp": None,
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [dict(user, member=self.member(user)) for user in mentions],
+            "mention_roles": [],
+            "attachments": [],
+            "embeds": [],
+            "components": list(components),
+            "pinned": False,
+            "type": 0,
+            "flags": 0,
+        }
+        self.messages[message["id"]] = message
+        self.dispatch(guild_id, "MESSAGE_CREATE", dict(message, member=self.member(author)))
+        if author["bot"]:
+            self.sent[channel_id].append(message)
+            self._wake(channel_id)
+        return message
+
+    def inject(self, channel_id, author_id, content):
+        """A fake user says something"""
+        return self.create_message(channel_id, self.users[str(author_id)], content)
+
+    async def wait_for(self, channel_id, text, start=0, timeout=30.0):
+        """Waits for the bot to say something containing text in a channel, looking from its start'th message on"""
+        while True:
+            sent = self.sent[channel_id]
+            for message in sent[start:]:
+                if text in message["content"]:
+                    return message
+            start = len(sent)
+            future = asyncio.get_running_loop().create_future()
+            self.waiters[channel_id].append(future)
+            await asyncio.wait_for(future, timeout)
+
+    def _wake(self, channel_id):
+        for future in self.waiters.pop(channel_id, ()):
+            if not future.done():
+                future.set_result(None)
+
+    #
+    # Gateway
+    #
+    def dispatch(self, guild_id, event, data):
+        for conn in self.connections:
+            if conn.handles(guild_id):
+                conn.send(DISPATCH, data, event)
+
+    async def gateway(self, request):
+        ws = web.WebSocketResponse(max_msg_size=0)
+        await ws.prepare(request)
+        conn = Connection(ws, self.latency)
+        conn.send(HELLO, {"heartbeat_interval": HEARTBEAT_INTERVAL})
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                payload = json.loads(msg.data)
+                if payload["op"] == HEARTBEAT:
+                    conn.send(HEARTBEAT_ACK)
+                elif payload["op"] == IDENTIFY:
+                    self.identify(conn, payload["d"])
+                elif payload["op"] == RESUME:
+                    # Nothing's kept around to resume from, so the bot will have to identify again
+                    conn.send(INVALID_SESSION, False)
+        finally:
+            if conn in self.connections:
+                self.connections.remove(conn)
+            conn.task.cancel()
+        return ws
+
+    def identify(self, conn, data):
+        conn.shard = tuple(data.get("shard") or (0, 1))
+        conn.session_id = secrets.token_hex(16)
+        self.connections.append(conn)
+        guild_ids = [guild_id for guild_id in self.guilds if conn.handles(guild_id)]
+        log.info("Shard %d/%d identified, sending %d guilds", *conn.shard, len(guild_ids))
+        conn.send(
+            DISPATCH,
+            {
+                "v": 10,
+                "user": self.bot_user,
+                "guilds": [{"id": str(guild_id), "unavailable": True} for guild_id in guild_ids],
+                "session_id": conn.session_id,
+                "resume_gateway_url": str(self.url.with_scheme("ws") / "gateway"),
+                "shard": list(conn.shard),
+                "application": {"id": str(self.application_id), "flags": 0},
+            },
+            "READY",
+        )
+        for guild_id in guild_ids:
+            conn.send(DISPATCH, self.guild_payload(guild_id), "GUILD_CREATE")
+        self.identified.set()
+
+    #
+    # REST API
+    #
+    @web.middleware
+    async def rest_middleware(self, request, handler):
+        if not request.path.startswith(API_PREFIX):
+            return await handler(request)
+        route = request.match_info.route.resource
+        route = route.canonical if route is not None else request.path
+        self.requests[request.method, route] += 1
+        if not request.headers.get("Authorization", "").startswith("Bot "):
+            return json_error(401, "401: Unauthorized")
+
+        await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        now = time.monotonic()
+        if self.global_limit is not None and not self.global_limit.hit(now):
+            return self._too_many_requests(request, route, self.global_limit, "global", now)
+        # Every route that's about a channel gets its own bucket per channel, just like on Discord
+        limit = None
+        if "channel_id" in request.match_info:
+            key = (request.method, route, request.match_info["channel_id"])
+            limit = self.buckets.get(key)
+            if limit is None:
+                limit = self.buckets[key] = RateLimit(*self.rate_limit)
+            if not limit.hit(now):
+                return self._too_many_requests(request, route, limit, "user", now)
+        response = await handler(request)
+        if limit is not None and self.ratelimit_headers:
+            response.headers.update(limit.headers(f"{request.method}:{route}", now))
+        return response
+
+    def _too_many_requests(self, request, route, limit, scope, now):
+        self.rate_limited[request.method, route] += 1
+        retry_after = max(limit.reset - now, 0.0)
+        headers = {"Retry-After": f"{retry_after:.3f}", "X-RateLimit-Scope": scope}
+        if scope == "global":
+            headers["X-RateLimit-Global"] = "true"
+        elif self.ratelimit_headers:
+            headers.update(limit.headers(f"{request.method}:{route}", now))
+        return json_response(
+            {"message": "You are being rate limited.", "retry_after": retry_after, "global": scope == "global"},
+            status=429,
+            headers=headers,
+        )
+
+    async def get_gateway(self, _request):
+        return json_response(
+            {
+                "url": str(self.url.with_scheme("ws") / "gateway"),
+                "shards": 1,
+                "session_start_limit": {"total": 1000, "remaining": 1000, "reset_after": 0, "max_concurrency": 1},
+            }
+        )
+
+    async def get_me(self, _request):
+        return json_response(self.bot_user)
+
+    async def get_application(self, _request):
+        return json_response(
+            {
+                "id": str(self.application_id),
+                "name": self.bot_user["username"],
+                "icon": None,
+                "description": "",
+                "bot_public": False,
+                "bot_require_code_grant": False,
+                "verify_key": "0" * 64,
+                "owner": self.owner,
+                "team": None,
+                "flags": 0,
+            }
+        )
+
+    def _channel(self, request):
+        channel_id = int(request.match_info["channel_id"])
+        if channel_id not in self.channels:
+            raise web.HTTPNotFound(text=json.dumps({"message": "Unknown Channel", "code": 10003}))
+        return channel_id
+
+    def _message(self, request):
+        self._channel(request)
+        message = self.messages.get(request.match_info["message_id"])
+        if message is None or message["channel_id"] != request.match_info["channel_id"]:
+            raise web.HTTPNotFound(text=json.dumps({"message": "Unknown Message", "code": 10008}))
+        return message
+
+    async def post_message(self, request):
+        channel_id = self._channel(request)
+        data = await request.json()
+        message = self.create_message(channel_id, self.bot_user, data.get("content"), data.get("components") or ())
+        return json_response(message)
+
+    async def patch_message(self, request):
+        message = self._message(request)
+        data = await request.json()
+        for field in ("content", "components"):
+            if field in data:
+                message[field] = data[field] or ("" if field == "content" else [])
+        message["edited_timestamp"] = timestamp()
+        self.dispatch(int(message["guild_id"]), "MESSAGE_UPDATE", message)
+        return json_response(message)
+
+    async def delete_message(self, request):
+        message = self.messages.pop(self._message(request)["id"])
+        self.dispatch(
+            int(message["guild_id"]),
+            "MESSAGE_DELETE",
+            {"id": message["id"], "channel_id": message["channel_id"], "guild_id": message["guild_id"]},
+        )
+        return web.Response(status=204)
+
+    async def bulk_delete(self, request):
+        channel_id = self._channel(request)
+        ids = [i for i in (await request.json())["messages"] if i in self.messages]
+        for message_id in ids:
+            del self.messages[message_id]
+        self.dispatch(
+            self.channels[channel_id],
+            "MESSAGE_DELETE_BULK",
+            {"ids": ids, "channel_id": str(channel_id), "guild_id": str(self.channels[channel_id])},
+        )
+        return web.Response(status=204)
+
+    async def pin(self, request):
+        self._message(request)["pinned"] = request.method == "PUT"
+        return web.Response(status=204)
+
+    async def get_member(self, request):
+        guild = self.guilds.get(int(request.match_info["guild_id"]))
+        user = self.users.get(request.match_info["user_id"])
+        if guild is None or user not in guild["members"]:
+            return json_error(404, "Unknown Member", 10007)
+        return json_response(self.member(user))
+
+    async def unknown_route(self, request):
+        log.warning("Not implemented: %s %s", request.method, request.path)
+        return json_error(404, "404: Not Found")
+
+    #
+    # Control API, for whatever's driving the fake users
+    #
+    async def control_info(self, _request):
+        return json_response(
+            {
+                "bot": self.bot_user["id"],
+                "owner": self.owner["id"],
+                "guilds": {
+                    str(guild_id): {
+                        "channels": [str(c) for c in guild["channels"]],
+                        "members": [u["id"] for u in guild["members"] if not u["bot"]],
+                    }
+                    for guild_id, guild in self.guilds.items()
+                },
+            }
+        )
+
+    async def control_say(self, request):
+        data = await request.json()
+        return json_response(self.inject(int(data["channel_id"]), data["author_id"], data["content"]))
+
+    async def control_stats(self, _request):
+        return json_response(self.stats())
+
+    def stats(self):
+        return {
+            "requests": {f"{method} {route}": n for (method, route), n in self.requests.most_common()},
+            "rate_limited": {f"{method} {route}": n for (method, route), n in self.rate_limited.most_common()},
+            "messages_sent": sum(map(len, self.sent.values())),
+            "connections": len(self.connections),
+        }
+
+    def app(self):
+        app = web.Application(middlewares=[self.rest_middleware])
+        app.router.add_get("/gateway", self.gateway)
+        api = [
+            web.get("/gateway", self.get_gateway),
+            web.get("/gateway/bot", self.get_gateway),
+            web.get("/users/@me", self.get_me),
+            web.get("/oauth2/applications/@me", self.get_application),
+            web.post("/channels/{channel_id}/messages", self.post_message),
+            web.post("/channels/{channel_id}/messages/bulk-delete", self.bulk_delete),
+            web.put("/channels/{channel_id}/messages/pins/{message_id}", self.pin),
+            web.delete("/channels/{channel_id}/messages/pins/{message_id}", self.pin),
+            web.put("/channels/{channel_id}/pins/{message_id}", self.pin),
+            web.delete("/channels/{channel_id}/pins/{message_id}", self.pin),
+            web.patch("/channels/{channel_id}/messages/{message_id}", self.patch_message),
+            web.delete("/channels/{channel_id}/messages/{message_id}", self.delete_message),
+            web.get("/guilds/{guild_id}/members/{user_id}", self.get_member),
+        ]
+        app.router.add_routes([web.route(r.method, API_PREFIX + r.path, r.handler) for r in api])
+        app.router.add_route("*", API_PREFIX + "/{tail:.*}", self.unknown_route)
+        app.router.add_get("/_fake/info", self.control_info)
+        app.router.add_post("/_fake/say", self.control_say)
+        app.router.add_get("/_fake/stats", self.control_stats)
+        return app
+
+    async def serve(self, host, port):
+        """Starts serving, returning the runner to clean up with"""
+        runner = web.AppRunner(self.app(), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]  # pylint:disable=protected-access
+        self.url = yarl.URL.build(scheme="http", host=host, port=port)
+        log.info("Fake Discord listening on %s", self.url)
+        return runner
+
+
+#
+# End-to-end benchmark
+#
+class GamePlayer:
+    """Plays one game in one channel through the fake API, timing how long the bot takes to answer each command"""
+
+    def __init__(self, fake, channel_id, users, latencies):
+        self.fake = fake
+        self.channel_id = channel_id
+        self.host, *self.players = users
+        self.latencies = latencies
+
+    async def say(self, user, content, expect=None):
+        start = len(self.fake.sent[self.channel_id])
+        started = time.monotonic()
+        self.fake.inject(self.channel_id, user["id"], content)
+        if expect is not None:
+            await self.fake.wait_for(self.channel_id, expect, start)
+            self.latencies[content.split()[0]].append(time.monotonic() - started)
+
+    async def play(self):
+        await self.say(self.host, "=host", expect="reated")
+        for player in self.players:
+            await self.say(player, "=join")
+        await self.say(self.host, "=start", expect="The game is starting")
+        await self.say(self.host, "=day", expect="DAY 1 BEGINS")
+        await self.say(self.host, "=votingphase", expect="to vote for another user")
+        target, *voters = self.players
+        majority = len(self.players) // 2 + 1
+        for i, voter in enumerate(voters[:majority]):
+            last = i == majority - 1
+            mention = f"<@{target['id']}>"
+            await self.say(
+                voter, f"=vote {mention}", expect="has been eliminated" if last else f"<@{voter['id']}> votes"
+            )
+        await self.say(self.host, "=end", expect="GAME OVER")
+
+
+async def wait_until_ready(fake, channel_id, user, timeout):
+    """Pings the bot until it answers, which means it's connected and has its commands loaded"""
+    deadline = time.monotonic() + timeout
+    await asyncio.wait_for(fake.identified.wait(), timeout)
+    while True:
+        start = len(fake.sent[channel_id])
+        fake.inject(channel_id, user["id"], "=ping")
+        try:
+            await fake.wait_for(channel_id, "pong", start, timeout=1.0)
+            return
+        except asyncio.TimeoutError:
+            if time.monotonic() > deadline:
+                raise
+
+
+async def bench(args):
+    fake = FakeDiscord(
+        channels=args.games,
+        members=args.games * (args.players + 1),
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit=args.rate_limit,
+        global_limit=args.global_limit,
+        ratelimit_headers=not args.no_ratelimit_headers,
+    )
+    runner = await fake.serve("127.0.0.1", 0)
+    ((guild_id, guild),) = fake.guilds.items()
+    users = [u for u in guild["members"] if not u["bot"] and u is not fake.owner]
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = dict(
+            os.environ,
+            ACCESS_TOKEN="fake",
+            TOBAIFAM_DISCORD_URL=str(fake.url),
+            TOBAIFAM_DATA_DIR=data_dir,
+            TOBAIFAM_METRICS_PORT="0",
+        )
+        bot = await asyncio.create_subprocess_exec(sys.executable, BOT_SCRIPT, env=env)
+        try:
+            await wait_until_ready(fake, guild["channels"][0], fake.owner, args.timeout)
+            print(f"Bot connected to {fake.url} (guild {guild_id}), playing {args.games} games")
+            latencies = collections.defaultdict(list)
+            games = [
+                GamePlayer(fake, channel_id, users[i * (args.players + 1) : (i + 1) * (args.players + 1)], latencies)
+                for i, channel_id in enumerate(guild["channels"])
+            ]
+            started = time.monotonic()
+            await asyncio.gather(*(game.play() for game in games))
+            elapsed = time.monotonic() - started
+        finally:
+            bot.send_signal(signal.SIGINT)
+            await bot.wait()
+            await runner.cleanup()
+
+    commands = sum(map(len, latencies.values()))
+    stats = fake.stats()
+    print(
+        f"{args.games} games in {elapsed:.2f}s ({args.games / elapsed * 60:.1f} games/min, "
+        + f"{stats['messages_sent']} bot messages, {stats['messages_sent'] / elapsed:.1f} messages/s)"
+    )
+    print(f"{'command':<14} {'count':>6} {'p50':>8} {'p95':>8} {'max':>8}")
+    for command, times in sorted(latencies.items()):
+        times.sort()
+        print(
+            f"{command:<14} {len(times):6d} {statistics.median(times) * 1000:7.0f}ms "
+            + f"{times[int(len(times) * 0.95)] * 1000:7.0f}ms {times[-1] * 1000:7.0f}ms"
+        )
+    print(f"{commands} timed commands; REST requests:")
+    for route, n in stats["requests"].items():
+        print(
+            f"  {route}: {n}"
+            + (f" ({stats['rate_limited'][route]} rate limited)" if route in stats["rate_limited"] else "")
+        )
+
+
+async def serve_forever(args):
+    fake = FakeDiscord(
+        guilds=args.guilds,
+        channels=args.channels,
+        members=args.members,
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit=args.rate_limit,
+        global_limit=args.global_limit,
+        ratelimit_headers=not args.no_ratelimit_headers,
+    )
+    runner = await fake.serve(args.host, args.port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=("serve", "bench"))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8399)
+    parser.add_argument("--guilds", type=int, default=1)
+    parser.add_argument("--channels", type=int, default=10, help="text channels per guild")
+    parser.add_argument("--members", type=int, default=50, help="fake users per guild")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every REST call and event")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many more seconds on REST calls")
+    parser.add_argument(
+        "--rate-limit", type=parse_rate_limit, default=DEFAULT_RATE_LIMIT, help="per-channel limit, like 5/5"
+    )
+    parser.add_argument("--global-limit", type=int, default=DEFAULT_GLOBAL_LIMIT, help="requests/second, 0 for none")
+    parser.add_argument(
+        "--no-ratelimit-headers", action="store_true", help="leave out X-RateLimit headers, so every limit is a 429"
+    )
+    parser.add_argument("--games", type=int, default=10, help="(bench) simultaneous games, one per channel")
+    parser.add_argument("--players", type=int, default=8, help="(bench) players per game")
+    parser.add_argument("--timeout", type=float, default=60.0, help="(bench) how long to wait for the bot to connect")
+    args = parser.parse_args()
+    asyncio.run(serve_forever(args) if args.command == "serve" else bench(args))
@@ -0,0 +1,990 @@
+"""The bot's commands, and the rendering of the events that come out of its games
+
+This is loaded as a discord.py extension, so =reload can swap in a new version of it without disconnecting or
+losing any games; the state it works on all lives in the runtime module.
+"""
+# pylint:disable=missing-function-docstring
+import asyncio
+import functools
+import logging
+import math
+import os
+import random
+import re
+import time
+
+import discord
+from discord.ext import commands
+
+import balance
+import mafia
+import messages
+from actors import BUSY_MESSAGE, mailboxes
+from guards import (
+    require_game_active,
+    require_game_host,
+    require_game_not_active,
+    require_game_phase,
+    require_host,
+    require_not_in_game,
+    require_operator,
+    require_player,
+    require_signup_host,
+    require_signup_player,
+    unmet_requirement,
+)
+from mafia import Abstain
+from messages import system_message, yell_at_user
+from outbox import send
+from overload import degraded
+from runtime import (
+    CMD_PREFIX,
+    DEFAULT_PROFILE_SECONDS,
+    archive,
+    bot,
+    games,
+    get_game,
+    profile_dir,
+    profiler,
+    roster_board,
+    tally_board,
+    timers,
+    vote_digest,
+    vote_menus,
+)
+
+VOTE_MODE_VAR = "TOBAIFAM_VOTE_MODE"
+
+# How players can vote: by typing =vote (with a message per vote, or the votes gathered up into one message every so
+# often), or by picking from a select menu (with a live tally instead). Hosts can pick per game; this is the default.
+VOTE_MODES = ("text", "batched", "menu")
+DEFAULT_VOTE_MODE = os.environ.get(VOTE_MODE_VAR, "text")
+
+# Games =history lists
+HISTORY_GAMES = 10
+
+# Games =balance simulates, which takes a fraction of a second for any sensible setup
+BALANCE_GAMES = 200_000
+
+# Discord's limits on options in a select menu, and select menus on a message
+MENU_OPTIONS = 25
+MENU_ROWS = 5
+VOTE_MENU_ID = "tobaifam:vote"
+
+# The most =profile is allowed to profile for
+MAX_PROFILE_SECONDS = 600.0
+
+log = logging.getLogger(__name__)
+
+
+# Host instructions with the command prefix already filled in, so sending one only has to add the host's name
+SIGNUP_HELP, START_PROMPT, DAY_HELP, VOTING_HELP, TWILIGHT_HELP, FIRST_NIGHT_HELP, NIGHT_HELP = (
+    template.format(prefix=CMD_PREFIX, host="{host}")
+    for template in (
+        messages.SIGNUP_HELP,
+        messages.START_PROMPT,
+        messages.DAY_HELP,
+        messages.VOTING_HELP,
+        messages.TWILIGHT_HELP,
+        messages.FIRST_NIGHT_HELP,
+        messages.NIGHT_HELP,
+    )
+)
+
+
+def roster_text(game, cancelled=False):
+    lines = [f"**{game.name}** - now playing ({game.alive_count}):"]
+    lines += [f"{i}. {name}" for i, name in enumerate(map(game.display_name, game.players), 1)]
+    if cancelled:
+        lines.append("*(This game was cancelled.)*")
+    elif game.active:
+        lines.append("*(Signups are closed.)*")
+    elif game.alive_count >= 3:
+        lines.append(START_PROMPT.format(host=f"**{game.host_name}**"))
+    else:
+        lines.append(f"Type `{CMD_PREFIX}join` to play!")
+    return "\n".join(lines)
+
+
+def render_roster(channel):
+    game = games.get(channel)
+    return roster_text(game) if game is not None and not game.active else None
+
+
+class ChannelContext:
+    """Stands in for a command context when game logic runs outside of a command (e.g. after a restart)"""
+
+    def __init__(self, channel, author):
+        self.bot = bot
+        self.channel = channel
+        self.guild = getattr(channel, "guild", None)
+        self.author = author
+        self.message = None
+
+    async def send(self, *args, **kwargs):
+        return await self.channel.send(*args, **kwargs)
+
+
+#
+# Commands
+#
+
+
+@commands.command(brief="Create a game as the manual host")
+@require_game_not_active()
+@require_not_in_game()
+async def host(ctx, *, game_name=None):
+    game = get_game(ctx)
+    if game is None:
+        default_name = False
+        if game_name is None:
+            default_name = True
+            game_name = ctx.author.display_name + "'s game"
+
+        # name, host, players, votes
+        game = games.create(ctx.channel, game_name, ctx.author.id, ctx.author.display_name)
+
+        if default_name:
+            await send(ctx, "Game created!!!! :slight_smile:")
+        else:
+            await send(ctx, f"Created {game.name}!!!! :slight_smile:")
+        await send(ctx, SIGNUP_HELP.format(host=game.host_name))
+        roster_board.update(ctx.channel)
+    else:
+        await yell_at_user(ctx, f"{game.host_name} is already recruiting players for a game.")
+
+
+@commands.command(brief="Sign up for a game")
+@require_game_not_active()
+@require_not_in_game("You've already joined this game!")
+async def join(ctx):
+    game = get_game(ctx)
+    if game is None:
+        await yell_at_user(ctx, "No one is seeking players for a game right now :-(")
+        await send(ctx, f"(If you want to start a new game as the host, type `{CMD_PREFIX}host` to create a new game.)")
+    elif not game.active:
+        game.add_player(ctx.author.id, ctx.author.display_name, str(ctx.author))
+        roster_board.update(ctx.channel)
+
+
+@commands.command(brief="Un-sign-up for a game")
+@require_game_not_active()
+@require_signup_player()
+async def unjoin(ctx):
+    game = get_game(ctx)
+    if game is None:
+        await yell_at_user(ctx, "There's no game to leave right now!")
+    else:
+        game.remove_player(ctx.author.id)
+        roster_board.update(ctx.channel)
+
+
+@commands.command(brief="Cancel game during signups")
+@require_game_not_active()
+@require_signup_host()  # TODO: allow anyone (not just host) to cancel a game after like some amount of time idk
+async def cancel(ctx):
+    game = games.remove(ctx.channel)
+    await roster_board.close(ctx.channel, roster_text(game, cancelled=True))
+    await send(ctx, "Game cancelled. :crying_cat_face:")
+
+
+@commands.command(brief="Start game when you are the host")
+@require_game_not_active()
+@require_signup_host()
+async def start(ctx):
+    game = get_game(ctx)
+    if game.alive_count < 3:
+        await yell_at_user(ctx, "You need at least three players for a Mafia game!")
+        return
+    events = game.start()
+    await roster_board.close(ctx.channel, roster_text(game))
+    await dispatch(ctx, events)
+
+
+def parse_time(arg):
+    """Parses a time expression into seconds (if no units supplied, we assume minutes)"""
+    if m := re.match(r"^([\d\.]+) *mi?n?u?t?e?s?$", arg):
+        return float(m.group(1)) * 60
+    if m := re.match(r"^([\d]+) *s?e?c?o?n?d?s?$", arg):
+        return float(m.group(1))
+    if m := re.match(r"^([\d]+)$", arg):
+        return float(m.group(1)) * 60
+    return None
+
+
+def duration_phrase(time_amt):
+    """Phrases an amount of time, e.g. '5 minutes and 48 seconds'"""
+    mins = int(time_amt // 60)
+    secs = int(time_amt) % 60
+
+    time_phrase = ""
+
+    if mins != 0:
+        if mins == 1:
+            time_phrase += "1 minute"
+        else:
+            time_phrase += f"{mins} minutes"
+
+    if mins != 0 and secs != 0:
+        time_phrase += " and "
+
+    if secs != 0:
+        if secs == 1:
+            time_phrase += "1 second"
+        else:
+            time_phrase += f"{secs} seconds"
+
+    return time_phrase
+
+
+def describe_time(time_amt):
+    """Phrases when something will happen, e.g. 'in 5 minutes and 48 seconds'"""
+    # Rounded up, so a timer that's just been set for 5 minutes doesn't already say 4 minutes and 59 seconds
+    time_phrase = duration_phrase(math.ceil(time_amt))
+    return f"in {time_phrase}" if time_phrase else "NOW"
+
+
+def paused_note(game):
+    return " (once the timer is unpaused)" if timers.get(game.key).paused else ""
+
+
+@commands.command(brief="Set, check, pause, resume or extend the timer for the current phase")
+@require_game_active()
+@require_host()
+async def timer(ctx, *, arg=None):
+    game = get_game(ctx)
+
+    # With no argument, just report how long is left
+    if arg is None:
+        remaining = timers.remaining(game.key)
+        if remaining is None:
+            await yell_at_user(ctx, "There's no timer running right now.")
+        else:
+            await system_message(
+                ctx, f"{game.phase.value} will end {describe_time(remaining)}{paused_note(game)}.", "hourglass"
+            )
+        return
+
+    arg = arg.strip().lower()
+    if arg == "stop":
+        if not cancel_timer(game):
+            await yell_at_user(ctx, "There's no timer running right now.")
+        return
+    if arg == "pause":
+        remaining = timers.pause(game.key)
+        if remaining is None:
+            await yell_at_user(ctx, "There's no running timer to pause.")
+        else:
+            await system_message(
+                ctx, f"Timer paused with {duration_phrase(math.ceil(remaining)) or 'no time'} left.", "pause_button"
+            )
+        return
+    if arg == "resume":
+        remaining = timers.resume(game.key)
+        if remaining is None:
+            await yell_at_user(ctx, "There's no paused timer to resume.")
+        else:
+            await system_message(ctx, f"{game.phase.value} will end {describe_time(remaining)}.", "hourglass")
+        return
+    if arg[0] in "+-":
+        time_amt = parse_time(arg[1:].strip())
+        if time_amt is None:
+            await yell_at_user(ctx, "Unknown time format. :( Please specify something like '+5m' or '-30s'.")
+            return
+        remaining = timers.extend(game.key, time_amt if arg[0] == "+" else -time_amt)
+        if remaining is None:
+            await yell_at_user(ctx, "There's no timer running right now.")
+        else:
+            await system_message(
+                ctx, f"{game.phase.value} will now end {describe_time(remaining)}{paused_note(game)}.", "hourglass"
+            )
+        return
+
+    # Cancel any existing timer
+    cancel_timer(game)
+
+    time_amt = parse_time(arg)
+    if time_amt is not None:
+        await system_message(ctx, f"{game.phase.value} will end {describe_time(time_amt)}.", "hourglass")
+        start_timer(ctx, game, time_amt)
+    else:
+        await yell_at_user(
+            ctx,
+            "Unknown time format. :( Please specify something like '5m' or '30s'.",
+        )
+
+
+@commands.command(brief="Cast a vote during a game's voting phase")
+@require_game_active()
+@require_player()
+@require_game_phase(mafia.Game.Phase.VOTE, yell_msg="Please wait until the end of the day to cast your vote!")
+async def vote(ctx, *, arg=None):
+    if arg is None:
+        await yell_at_user(ctx, "Who are you voting for???")
+    else:
+        game = get_game(ctx)
+        try:
+            voted_user = game.find_user(arg, ctx.message.mentions)
+        except ValueError as e:
+            await yell_at_user(ctx, e.args[0])
+        else:
+            await dispatch(ctx, game.vote(ctx.author.id, voted_user))
+
+
+@commands.command(brief="Abstain during a game's voting phase")
+@require_game_active()
+@require_player()
+@require_game_phase(mafia.Game.Phase.VOTE, yell_msg="Please wait until the end of the day to cast your vote!")
+async def abstain(ctx):
+    await dispatch(ctx, get_game(ctx).vote(ctx.author.id, Abstain))
+
+
+@commands.command(brief="Eliminate a player manually as the host")
+@require_game_active()
+@require_host()
+async def kill(ctx, *, arg=None):
+    if arg is None:
+        await yell_at_user(ctx, "Who do you want to eliminate?")
+    else:
+        game = get_game(ctx)
+        try:
+            eliminated_user = game.find_user(arg, ctx.message.mentions)
+        except ValueError as e:
+            await yell_at_user(ctx, e.args[0])
+        else:
+            await dispatch(ctx, game.kill(eliminated_user))
+
+
+@commands.command(brief="End the game for good as the host")
+@require_game_active()
+@require_host()
+async def end(ctx):
+    await dispatch(ctx, get_game(ctx).end())
+    games.remove(ctx.channel, finished=True)
+
+
+@commands.command(
+    brief="Show your (or someone else's) stats from finished games on this server", extras={"serialized": False}
+)
+async def stats(ctx, *, _arg=None):
+    if ctx.guild is None:
+        await yell_at_user(ctx, "Stats are kept per server, so ask me in one!")
+        return
+    user = ctx.message.mentions[0] if ctx.message.mentions else ctx.author
+    row = await asyncio.to_thread(archive.player_stats, ctx.guild.id, user.id)
+    if row is None:
+        await send(ctx, f"{user.display_name} hasn't finished any games here yet.")
+        return
+    await send(
+        ctx,
+        f"**{row['name']}** on this server: played **{row['games']}** "
+        + f"(survived {row['survived']}, eliminated in {row['eliminated']}), hosted **{row['hosted']}**, "
+        + f"{row['days_played']} days played, {row['votes_cast']} votes cast ({row['abstains']} abstains), "
+        + f"{row['votes_received']} votes received",
+    )
+
+
+@commands.command(
+    brief="Show this server's latest finished games (or someone's, if you mention them)", extras={"serialized": False}
+)
+async def history(ctx, *, _arg=None):
+    if ctx.guild is None:
+        await yell_at_user(ctx, "Game history is kept per server, so ask me in one!")
+        return
+    if ctx.message.mentions:
+        user = ctx.message.mentions[0]
+        rows = await asyncio.to_thread(archive.player_games, ctx.guild.id, user.id, HISTORY_GAMES)
+        header = f"**{user.display_name}'s latest games:**"
+    else:
+        totals = await asyncio.to_thread(archive.server_stats, ctx.guild.id)
+        rows = await asyncio.to_thread(archive.recent_games, ctx.guild.id, HISTORY_GAMES)
+        header = totals and (
+            f"**{totals['games']} games played here**, {totals['players'] / totals['games']:.1f} players and "
+            + f"{totals['days'] / totals['games']:.1f} days on average. Latest games:"
+        )
+    if not rows:
+        await send(ctx, "No finished games here yet.")
+        return
+    lines = [header]
+    for row in rows:
+        line = (
+            f"`{time.strftime('%Y-%m-%d', time.gmtime(row['ended_at']))}` **{row['name']}**: {row['players']} "
+            + f"players, {row['days']} days, {row['survivors']} survivors, "
+            + duration_phrase(row["ended_at"] - row["started_at"])
+        )
+        if "days_played" in row.keys():
+            if row["eliminated_day"] is None:
+                line += " - survived"
+            else:
+                line += f" - eliminated on day {row['eliminated_day']}"
+        lines.append(line)
+    await send(ctx, "\n".join(lines))
+
+
+@commands.command(brief="Test functionality", extras={"serialized": False})
+async def ping(ctx):
+    await send(ctx, ctx.author.mention + " pong")
+
+
+@commands.command(
+    brief="Profile the bot for a while (add 'here' for just this channel's game)", extras={"serialized": False}
+)
+@require_operator()
+async def profile(ctx, *, arg=None):
+    words = (arg or "").split()
+    channel_id = None
+    if "here" in words:
+        words.remove("here")
+        channel_id = ctx.channel.id
+    seconds = parse_time(" ".join(words)) if words else DEFAULT_PROFILE_SECONDS
+    if seconds is None or not 0 < seconds <= MAX_PROFILE_SECONDS:
+        await yell_at_user(ctx, f"Please give a time up to {duration_phrase(MAX_PROFILE_SECONDS)}, like '30s'.")
+        return
+    if profiler.running:
+        await yell_at_user(ctx, "There's already a profile running!")
+        return
+
+    await send(ctx, f"Profiling {'this channel' if channel_id else 'everything'} for {duration_phrase(seconds)}...")
+    result, paths = await profiler.run(seconds, channel_id, profile_dir())
+    summary = "\n".join(f"{share:6.1%}  {label}" for label, share in result.top())
+    await send(
+        ctx,
+        f"Done! {sum(result.stacks.values())} of {result.samples} samples counted. Busiest functions:\n"
+        + f"```\n{summary or '(nothing)'}\n```Profiles written to: "
+        + ", ".join(f"`{path}`" for path in paths),
+    )
+
+
+def start_timer(ctx, game, length):
+    return timers.start(
+        game.key,
+        length,
+        functools.partial(announce_time_left, ctx),
+        functools.partial(timer_expired, ctx, game.phase, game.day),
+        functools.partial(send, ctx, "*(stopped previous timer)*"),
+    )
+
+
+async def announce_time_left(ctx, remaining):
+    if timers.get(games.key_for(ctx.channel)) is None:
+        # Stopped while this was waiting its turn
+        return
+    if remaining < 30 and degraded.skip("countdown"):
+        return
+    if remaining >= 120:
+        await system_message(ctx, f"{remaining // 60} minutes left")
+    elif remaining == 60:
+        await system_message(ctx, "One minute left")
+    elif remaining == 30:
+        await system_message(ctx, "30 seconds left")
+    elif remaining == 15:
+        await system_message(ctx, "15 seconds left!")
+    elif remaining == 10:
+        await system_message(ctx, "10 seconds left!!")
+    elif remaining <= 5:
+        await system_message(ctx, str(int(remaining)))
+
+
+async def timer_expired(ctx, phase=None, day=None):
+    # Once timer finishes, move to the next phase of gameplay
+    game = get_game(ctx)
+    if game is None:
+        return
+    # ...unless the game got there some other way (or got a new timer) while this was waiting its turn
+    if timers.get(game.key) is not None or phase is not None and (game.phase, game.day) != (phase, day):
+        return
+    await dispatch(ctx, game.advance())
+
+
+def cancel_timer(game):
+    return timers.cancel(game.key)
+
+
+@commands.command(brief="Move to day phase in game")
+@require_game_active()
+@require_host()
+async def day(ctx, *, arg=None):
+    events = get_game(ctx).start_day(timed=arg is not None)
+    await dispatch(ctx, events)
+    if arg is not None and not isinstance(events[-1], mafia.Rejected):
+        await timer(ctx, arg=arg)
+
+
+@commands.command(brief="Move to night phase in game")
+@require_game_active()
+@require_host()
+async def night(ctx):
+    await dispatch(ctx, get_game(ctx).start_night())
+
+
+@commands.command(brief="Move to voting phase in game")
+@require_game_active()
+@require_host()
+async def votingphase(ctx):
+    await dispatch(ctx, get_game(ctx).call_vote())
+
+
+#
+# Voting modes
+#
+
+
+def vote_mode(game):
+    return game.vote_mode or DEFAULT_VOTE_MODE
+
+
+def render_vote_batch(channel, votes):
+    """One message for a batch of VoteCast events, ending with where the votes stand now"""
+    game = games.get(channel)
+    if game is None or game.phase != game.Phase.VOTE:
+        return None
+    lines = [
+        f"{mafia.mention(v.voter)} votes for {'Abstain' if v.target is Abstain else mafia.mention(v.target)}!"
+        for v in votes
+    ]
+    groups, _ = game.vote_groups()
+    standings = ", ".join(
+        f"{'Abstain' if target is Abstain else game.display_name(target)}: {len(voters)}" for target, voters in groups
+    )
+    lines.append(f"({standings}; {game.majority_count()} needed for majority)")
+    return "\n".join(lines)
+
+
+def tally_text(game):
+    groups, not_voted = game.vote_groups()
+    lines = [
+        f"**Votes so far** ({game.total_votes()} of {game.alive_count} in, "
+        + f"{game.majority_count()} needed for majority)"
+    ]
+    for target, voters in groups:
+        name = "Abstain" if target is Abstain else game.display_name(target)
+        lines.append(f"**{name} ({len(voters)})**: {', '.join(map(game.display_name, voters))}")
+    if not_voted:
+        lines.append(f"*Still to vote: {', '.join(map(game.display_name, not_voted))}*")
+    return "\n".join(lines)
+
+
+def render_tally(channel):
+    game = games.get(channel)
+    return tally_text(game) if game is not None and game.phase == game.Phase.VOTE else None
+
+
+def build_vote_menus(game):
+    """Select menus of every living player (and Abstain), as many Views as it takes to fit them all"""
+    options = [discord.SelectOption(label="Abstain", value="abstain")] + [
+        discord.SelectOption(label=game.display_name(uid)[:100], value=str(uid)) for uid in game.players
+    ]
+    views = []
+    per_view = MENU_OPTIONS * MENU_ROWS
+    for first in range(0, len(options), per_view):
+        # These only carry the components; votes come in through on_interaction, so nothing needs to listen to them
+        view = discord.ui.View(timeout=None)
+        view.stop()
+        for i in range(first, min(first + per_view, len(options)), MENU_OPTIONS):
+            chunk = options[i : i + MENU_OPTIONS]
+            placeholder = (
+                f"Vote for... ({chunk[0].label} to {chunk[-1].label})" if len(options) > MENU_OPTIONS else None
+            )
+            view.add_item(
+                discord.ui.Select(
+                    custom_id=f"{VOTE_MENU_ID}:{i}", placeholder=placeholder and placeholder[:150], options=chunk
+                )
+            )
+        views.append(view)
+    return views
+
+
+async def open_vote_menus(ctx, game):
+    posted = vote_menus[ctx.channel.id] = []
+    for view in build_vote_menus(game):
+        message = await (await send(ctx, "Pick who you're voting for:" if not posted else None, view=view))
+        if message is not None:
+            posted.append(message)
+    tally_board.update(ctx.channel)
+
+
+async def close_vote_menus(channel):
+    """Takes the menus off a channel's last round of voting, leaving the last tally it showed in place"""
+    if channel.id not in vote_menus:
+        return
+    for message in vote_menus.pop(channel.id):
+        try:
+            await message.edit(view=None)
+        except discord.HTTPException:
+            pass
+    # The game's already moved on by now, so there's no re-rendering the tally; the results that follow have the
+    # final say on any votes it hadn't caught up with
+    await tally_board.stop(channel)
+    shown = tally_board.shown(channel)
+    await tally_board.close(channel, f"{shown}\n**Voting is over.**" if shown else "**Voting is over.**")
+
+
+async def on_interaction(interaction):
+    if interaction.type is discord.InteractionType.component and interaction.data.get("custom_id", "").startswith(
+        VOTE_MENU_ID
+    ):
+        # Acknowledge it right away; the tally shows the vote once it's been counted
+        await interaction.response.defer()
+        if not mailboxes.put(games.key_for(interaction.channel), functools.partial(vote_from_menu, interaction)):
+            await interaction.followup.send(f":warning: `{BUSY_MESSAGE}`", ephemeral=True)
+
+
+async def vote_from_menu(interaction):
+    ctx = ChannelContext(interaction.channel, interaction.user)
+    game = get_game(ctx)
+    value = interaction.data["values"][0]
+    target = Abstain if value == "abstain" else int(value)
+    failure = unmet_requirement(
+        vote.callback.requirements, game, game.role_of(interaction.user.id) if game is not None else None
+    )
+    if failure is None and target is not Abstain and not game.is_alive(target):
+        failure = "That person isn't playing the game right now!"
+    if failure is not None:
+        await interaction.followup.send(f":warning: `{failure}`", ephemeral=True)
+        return
+    await dispatch(ctx, game.vote(interaction.user.id, target))
+
+
+@commands.command(brief="Choose how players vote: 'text' (=vote), 'batched' (=vote, announced every second) or 'menu'")
+@require_game_host()
+async def votemode(ctx, *, arg=None):
+    game = get_game(ctx)
+    if arg is None:
+        await send(ctx, f"Voting mode is **{vote_mode(game)}**. (Choose from: {', '.join(VOTE_MODES)})")
+    elif arg.strip().lower() not in VOTE_MODES:
+        await yell_at_user(ctx, f"Unknown voting mode. :( Please choose from: {', '.join(VOTE_MODES)}")
+    else:
+        game.set_vote_mode(arg.strip().lower())
+        await system_message(ctx, f"Voting mode will be {game.vote_mode} from the next voting phase.", "ballot_box")
+
+
+@commands.command(
+    name="balance",
+    brief="Simulate how often town and mafia win with [players] players, of which <mafia> are mafia",
+    extras={"serialized": False},
+)
+@require_game_host()
+async def balance_check(ctx, *args):
+    game = get_game(ctx)
+    try:
+        numbers = [int(a) for a in args]
+    except ValueError:
+        numbers = []
+    if len(numbers) == 1:
+        numbers.insert(0, game.alive_count)
+    if len(numbers) != 2:
+        await yell_at_user(
+            ctx, f"Please say how many mafia there are, like '{CMD_PREFIX}balance 3' or '{CMD_PREFIX}balance 12 3'."
+        )
+        return
+    players, n_mafia = numbers
+    try:
+        result = await asyncio.to_thread(balance.simulate, players, n_mafia, BALANCE_GAMES)
+    except ValueError as e:
+        await yell_at_user(ctx, e.args[0])
+        return
+    await send(
+        ctx,
+        f"With **{players}** players, **{n_mafia}** of them mafia, and everyone voting at random: town wins "
+        + f"**{result.town_rate:.1%}** of the time and mafia **{result.mafia_rate:.1%}**, "
+        + f"after {result.mean_days:.1f} days on average. ({result.games:,} games simulated)",
+    )
+
+
+#
+# Rendering the events that come out of a game
+#
+renderers = {}
+
+
+def renders(event_type):
+    def _decorator(func):
+        renderers[event_type] = func
+        return func
+
+    return _decorator
+
+
+async def dispatch(ctx, events):
+    for event in events:
+        await renderers[type(event)](ctx, event)
+
+
+@renders(mafia.TimerStopped)
+async def render_timer_stopped(ctx, _event):
+    cancel_timer(get_game(ctx))
+
+
+@renders(mafia.Rejected)
+async def render_rejected(ctx, event):
+    await yell_at_user(ctx, event.message.format(prefix=CMD_PREFIX))
+
+
+@renders(mafia.GameStarted)
+async def render_game_started(ctx, event):
+    await send(ctx, " ".join(map(mafia.mention, event.players)) + " : The game is starting!\n")
+
+    # Count down (unless the bot's too busy for the drama)
+    if not degraded.skip("countdown"):
+        for i in range(3, 0, -1):
+            await asyncio.sleep(0.5)
+            await send(ctx, f"{i}...")
+        await asyncio.sleep(0.5)
+
+    # Print game-starting stuff
+    await system_message(ctx, get_game(ctx).name)
+    if not degraded.skip("flavor"):
+        await asyncio.sleep(0.2)
+        await send(ctx, random.choice(messages.START_MSGS))
+
+
+@renders(mafia.DayStarted)
+async def render_day_started(ctx, event):
+    await system_message(ctx, f"DAY {event.day} BEGINS", "sunny")
+    await send(ctx, f"**Alive ({len(event.alive)}):** {', '.join(map(mafia.mention, event.alive))}")
+    if not event.timed:
+        await send_day_help(ctx)
+
+
+@renders(mafia.DayContinued)
+async def render_day_continued(ctx, event):
+    vote_digest.discard(ctx.channel)
+    await close_vote_menus(ctx.channel)
+    await system_message(ctx, f"DAY {event.day}***, um, ***CONTINUES", "sunny")
+    if not event.timed:
+        await send_day_help(ctx)
+
+
+async def send_day_help(ctx):
+    await send(ctx, DAY_HELP.format(host=get_game(ctx).host_name))
+
+
+@renders(mafia.VotingStarted)
+async def render_voting_started(ctx, _event):
+    game = get_game(ctx)
+    await system_message(ctx, messages.NORMAL_VOTING_TEXT, "pencil2", messages.VOTING_TONES)
+    await send(ctx, VOTING_HELP.format(host=game.host_name))
+    if vote_mode(game) == "menu":
+        await open_vote_menus(ctx, game)
+
+
+@renders(mafia.VotingReopened)
+async def render_voting_reopened(ctx, _event):
+    await system_message(ctx, "NEVER MIND, CONTINUE VOTING")
+    game = get_game(ctx)
+    if vote_mode(game) == "menu":
+        await open_vote_menus(ctx, game)
+
+
+@renders(mafia.VoteCast)
+async def render_vote_cast(ctx, event):
+    mode = vote_mode(get_game(ctx))
+    if mode == "menu":
+        tally_board.update(ctx.channel)
+        return
+    # When the bot's struggling, text mode votes get gathered up like batched ones
+    if mode == "batched" or degraded.skip("vote announcements"):
+        vote_digest.add(ctx.channel, event)
+        return
+
+    if event.target is Abstain:
+        name = "Abstain"
+        mention = "Abstain"
+    else:
+        name = get_game(ctx).display_name(event.target)
+        mention = mafia.mention(event.target)
+
+    await send(
+        ctx,
+        f"{mafia.mention(event.voter)} votes for {mention}! "
+        + f"({event.count} votes for {name}, {event.majority} needed for majority)",
+    )
+
+
+@renders(mafia.MajorityReached)
+async def render_majority_reached(ctx, event):
+    if event.target is Abstain:
+        await system_message(
+            ctx,
+            "The town votes to abstain!",
+            "neutral_face",
+            messages.VOTE_ABSTAIN_RESPONSES,
+        )
+    else:
+        await system_message(
+            ctx,
+            "Majority reached!",
+            "open_mouth",
+            messages.VOTE_MAJORITY_RESPONSES,
+        )
+
+
+@renders(mafia.NoDecision)
+async def render_no_decision(ctx, _event):
+    await system_message(
+        ctx,
+        "Everyone voted, but no majority was reached!",
+        "slight_frown",
+        messages.VOTE_NO_DECISION_RESPONSES,
+    )
+
+
+@renders(mafia.VoteResults)
+async def render_vote_results(ctx, event):
+    # The results cover every vote, so any that haven't been announced yet don't need to be
+    vote_digest.discard(ctx.channel)
+    await close_vote_menus(ctx.channel)
+    voting_results_msg = (
+        f"With **{event.alive}** players alive, a majority decision requires **{event.majority}** votes.\n"
+    )
+    game = get_game(ctx)
+    for target, voters in event.tally:
+        name = "Abstain" if target is Abstain else game.display_name(target)
+        voting_results_msg += f"**{name} ({len(voters)})**: {', '.join(map(game.display_name, voters))}\n"
+
+    await system_message(ctx, "RESULTS", "ballot_box", messages.VOTING_END_TONES)
+    await send(ctx, voting_results_msg)
+
+
+@renders(mafia.Eliminated)
+async def render_eliminated(ctx, event):
+    death_emoji = random.choice(messages.DEATH_EMOJIS)
+    await send(ctx, f":{death_emoji}: {mafia.mention(event.user)} has been eliminated. :{death_emoji}:")
+
+
+@renders(mafia.NoElimination)
+async def render_no_elimination(ctx, _event):
+    await send(ctx, "No one is eliminated.")
+
+
+@renders(mafia.TwilightStarted)
+async def render_twilight_started(ctx, _event):
+    await send(ctx, TWILIGHT_HELP.format(host=get_game(ctx).host_name))
+
+
+@renders(mafia.NightStarted)
+async def render_night_started(ctx, event):
+    await system_message(ctx, f"NIGHT {event.day} BEGINS", "first_quarter_moon_with_face")
+    help_text = FIRST_NIGHT_HELP if event.day == 0 else NIGHT_HELP
+    await send(ctx, help_text.format(host=get_game(ctx).host_name))
+
+
+@renders(mafia.NightResumed)
+async def render_night_resumed(ctx, event):
+    await system_message(ctx, f"...***uh, ***GOING BACK TO NIGHT {event.day}", "first_quarter_moon_with_face")
+
+
+@renders(mafia.GameEnded)
+async def render_game_ended(ctx, event):
+    vote_digest.discard(ctx.channel)
+    await close_vote_menus(ctx.channel)
+    game = get_game(ctx)
+    await system_message(ctx, f"GAME OVER after {event.day} days", "checkered_flag")
+    await send(
+        ctx,
+        f"**Survivors ({len(event.alive)}):** {', '.join(map(game.display_name, event.alive)) or 'nobody'}\n"
+        + f"**Eliminated ({len(event.dead)}):** {', '.join(map(game.display_name, event.dead)) or 'nobody'}\n"
+        + f"Thanks for playing! Type `{CMD_PREFIX}stats` or `{CMD_PREFIX}history` to look back on your games.",
+    )
+
+
+#
+# Crash recovery
+#
+
+
+async def restore_game(key, state):
+    channel = bot.get_channel(key[1])
+    if channel is None or channel.guild is None:
+        log.warning("Dropping saved game %s: can't see its channel any more", key)
+        return
+
+    game = games.create(channel, state["name"], state["host"], state["host_name"])
+    for uid, (name, tag) in state["players"].items():
+        game.add_player(int(uid), name, tag)
+    # Votes aren't cleared until the next vote starts, so they can still be from or for someone who's since been
+    # eliminated: put them back while everyone's still alive
+    for voter, target in state["votes"].items():
+        game.cast_vote(int(voter), Abstain if target == "abstain" else target)
+    for uid in state["dead"]:
+        game.eliminate(uid)
+    game.active = state["active"]
+    if state.get("vote_mode") is not None:
+        game.set_vote_mode(state["vote_mode"])
+    if not game.active:
+        roster_board.update(channel)
+    game.day = state["day"]
+    if state["phase"] is not None:
+        game.phase = game.Phase[state["phase"]]
+
+    saved_timer = state["timer"]
+    if saved_timer is not None:
+        ctx = ChannelContext(channel, channel.guild.get_member(game.host) or bot.user)
+        if "paused" in saved_timer:
+            start_timer(ctx, game, saved_timer["paused"])
+            timers.pause(game.key)
+        else:
+            start_timer(ctx, game, max(saved_timer["deadline"] - time.time(), 0.0))
+
+
+async def drop_game(key):
+    """Quietly stops running a game, say because another node has taken it over"""
+    t = timers.get(key)
+    if t is not None:
+        t.on_cancel = None
+        timers.cancel(key)
+    channel = bot.get_channel(key[1])
+    if channel is None:
+        games.games.pop(key, None)
+        return
+    games.remove(channel)
+    await roster_board.close(channel)
+    await tally_board.close(channel)
+    vote_digest.discard(channel)
+    vote_menus.pop(channel.id, None)
+
+
+async def restore_games(saved):
+    """Rebuilds the games that were running when the bot last stopped, returning the keys of any it couldn't"""
+    results = await asyncio.gather(*(restore_game(key, state) for key, state in saved.items()), return_exceptions=True)
+    failed = []
+    for key, result in zip(saved, results):
+        if isinstance(result, Exception):
+            log.error("Couldn't restore game %s", key, exc_info=result)
+            # Don't leave it half rebuilt
+            await drop_game(key)
+            failed.append(key)
+    log.info("Restored %d of %d saved games", len(games), len(saved))
+    return failed
+
+
+#
+# Loading and unloading the extension
+#
+
+
+def rebind(callback):
+    """Points a timer callback made by an older version of this module at the same function in this one"""
+    if isinstance(callback, functools.partial) and getattr(callback.func, "__module__", None) == __name__:
+        return functools.partial(globals()[callback.func.__name__], *callback.args, **callback.keywords)
+    return callback
+
+
+async def setup(client):
+    for command in list(globals().values()):
+        if isinstance(command, commands.Command):
+            client.add_command(command)
+    client.add_listener(on_interaction)
+    roster_board.render = render_roster
+    tally_board.render = render_tally
+    vote_digest.render = render_vote_batch
+    # Timers that were already running carry on, but with this version's announcements
+    for t in timers.timers.values():
+        t.on_announce, t.on_expire, t.on_cancel = map(rebind, (t.on_announce, t.on_expire, t.on_cancel))
+
+
+async def teardown(client):
+    for command in list(globals().values()):
+        if isinstance(command, commands.Command):
+            client.remove_command(command.name)
+    client.remove_listener(on_interaction)
@@ -0,0 +1,146 @@
+"""Checks commands make on who's using them, stacked on top of a command as decorators"""
+# pylint:disable=missing-function-docstring
+import functools
+
+import mafia
+from messages import yell_at_user
+from runtime import get_game
+
+#
+# Assertion helpers - each takes the channel's game (or None) and the caller's role in it
+# TODO: relocate to game abstraction
+#
+Role = mafia.Game.Role
+
+
+def is_host(game, role):
+    return game is not None and game.active and role is Role.HOST
+
+
+def is_player(game, role):
+    return game is not None and game.active and role is Role.PLAYER
+
+
+def is_signup_host(game, role):
+    return game is not None and not game.active and role is Role.HOST
+
+
+def is_signup_player(game, role):
+    return game is not None and not game.active and role is Role.PLAYER
+
+
+def is_not_in_game(game, role):
+    return game is None or role not in (Role.HOST, Role.PLAYER)
+
+
+def is_game_host(game, role):
+    return game is not None and role is Role.HOST
+
+
+def is_game_not_active(game, _role):
+    return game is None or not game.active
+
+
+def is_game_active(game, _role):
+    return game is not None and game.active
+
+
+#
+# Decorator-style command assertions - must be placed AFTER the @commands.command decorator
+# All of these assume the first arg to the command is the ctx.
+#
+# More general assertions should sit higher on the list than more specific assertions. However many are stacked on
+# a command, they all go into a single guard, which looks up the game and the caller's role once and then yells the
+# first requirement that isn't met.
+#
+# TODO: possibly relocate to game abstraction?
+#
+# Example:
+# >>> @commands.command(brief="Example command")
+# >>> @require_game_active()
+# >>> @require_host()
+# >>> def example(ctx):
+# ...     pass
+#
+def require(check, yell_msg):
+    def _decorator(func):
+        if getattr(func, "guard", None) is func:
+            # Already guarded by the decorators below this one, which this requirement gets checked before
+            func.requirements.insert(0, (check, yell_msg))
+            return func
+        requirements = [(check, yell_msg)]
+
+        @functools.wraps(func)
+        async def _wrapper(ctx, *args, **kwargs):
+            game = get_game(ctx)
+            failure = unmet_requirement(requirements, game, game.role_of(ctx.author.id) if game is not None else None)
+            if failure is not None:
+                await yell_at_user(ctx, failure)
+                return None
+            return await func(ctx, *args, **kwargs)
+
+        _wrapper.guard = _wrapper
+        _wrapper.requirements = requirements
+        return _wrapper
+
+    return _decorator
+
+
+def unmet_requirement(requirements, game, role):
+    """The yell message of the first requirement a user doesn't meet, or None if they're good to go"""
+    role = role or Role.NONE
+    for check, yell_msg in requirements:
+        if not check(game, role):
+            return yell_msg
+    return None
+
+
+def require_host(yell_msg="You must be host to use this command."):
+    return require(is_host, yell_msg)
+
+
+def require_game_host(yell_msg="You must be host to use this command."):
+    return require(is_game_host, yell_msg)
+
+
+def require_signup_host(yell_msg="You must be the host of the current signing-up game to use this command."):
+    return require(is_signup_host, yell_msg)
+
+
+def require_player(yell_msg="You must be a player to use this command."):
+    return require(is_player, yell_msg)
+
+
+def require_signup_player(yell_msg="You must be signed up for a game to use this command."):
+    return require(is_signup_player, yell_msg)
+
+
+def require_not_in_game(yell_msg="You're already part of the game!"):
+    return require(is_not_in_game, yell_msg)
+
+
+def require_game_not_active(yell_msg="There's already a game in progress!"):
+    return require(is_game_not_active, yell_msg)
+
+
+def require_game_active(yell_msg="There's no game in progress!"):
+    return require(is_game_active, yell_msg)
+
+
+def require_game_phase(phase, yell_msg="Now's not the time to do that!"):
+    return require(lambda game, _role: game is not None and game.phase == phase, yell_msg)
+
+
+def require_operator(yell_msg="Only the bot's operators can use this command."):
+    def _decorator(func):
+        @functools.wraps(func)
+        async def _wrapper(*args, **kwargs):
+            ctx = args[0]
+            if not await ctx.bot.is_owner(ctx.author):
+                await yell_at_user(ctx, yell_msg)
+            else:
+                return await func(*args, **kwargs)
+
+        return _wrapper
+
+    return _decorator
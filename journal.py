@@ -0,0 +1,251 @@
+"""Append-only log of every game's state changes, so games survive the bot restarting"""
+import copy
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+LOG_FILE = "games.log"
+SNAPSHOT_FILE = "snapshot.json"
+
+# How long the writer waits to gather more records into a single fsync
+GROUP_COMMIT_INTERVAL = 0.05
+
+# Compact the log into a snapshot after this many records, or this many seconds if anything changed
+SNAPSHOT_RECORDS = 10000
+SNAPSHOT_INTERVAL = 300.0
+
+_STOP = object()
+
+
+def new_game_state(name, host, host_name):
+    return {
+        "name": name,
+        "host": host,
+        "host_name": host_name,
+        "active": False,
+        "phase": None,
+        "day": 0,
+        "players": {},
+        "dead": [],
+        "votes": {},
+        "timer": None,
+        "vote_mode": None,
+        # What happened when, for the archive once the game's over: lists starting with the op
+        "history": [],
+    }
+
+
+def apply(state, record):
+    """Applies one log record to a {game key: game state} dict, returning the game's final state if it just ended"""
+    key = tuple(record["game"])
+    op = record["op"]
+    if op == "host":
+        state[key] = new_game_state(record["name"], record["host"], record["host_name"])
+        return None
+    if op == "cancel":
+        state.pop(key, None)
+        return None
+    if op == "restore":
+        # A game picked up part way through (from another node), state and all
+        state[key] = copy.deepcopy(record["state"])
+        return None
+    game = state.get(key)
+    if game is None:
+        return None
+    if op == "end":
+        game = state.pop(key)
+        game["history"].append(["end", record["at"]])
+        return game
+    if op == "join":
+        # Players are {id: [display name, tag]} in join order, the dead included (JSON keys have to be strings)
+        game["players"][str(record["user"])] = [record["name"], record["tag"]]
+    elif op == "unjoin":
+        game["players"].pop(str(record["user"]), None)
+    elif op == "kill":
+        game["dead"].append(record["user"])
+        game["history"].append(["kill", record["user"], game["day"], game["phase"], record["at"]])
+    elif op == "start":
+        game["active"] = True
+        game["history"].append(["start", record["at"]])
+    elif op == "phase":
+        game["phase"] = record["phase"]
+        game["day"] = record["day"]
+        game["history"].append(["phase", record["phase"], record["day"], record["at"]])
+    elif op == "vote":
+        game["votes"][str(record["voter"])] = record["target"]
+        game["history"].append(["vote", record["voter"], record["target"], game["day"], record["at"]])
+    elif op == "clear_votes":
+        game["votes"] = {}
+        game["history"].append(["clear_votes", game["day"], record["at"]])
+    elif op == "timer":
+        game["timer"] = record["timer"]
+    elif op == "vote_mode":
+        game["vote_mode"] = record["mode"]
+    return None
+
+
+def encode_state(state):
+    return [{"game": list(key), **game} for key, game in state.items()]
+
+
+def decode_state(games):
+    state = {}
+    for game in games:
+        key = tuple(game.pop("game"))
+        # Snapshots from before the history was kept
+        game.setdefault("history", [])
+        state[key] = game
+    return state
+
+
+class Journal:
+    """Writes game records to disk on a background thread, fsyncing them in groups
+
+    Recording a change from the event loop only costs a queue put. The writer thread keeps its own copy of every
+    game's state, which it periodically writes out as a snapshot so the log never has to be replayed from the
+    beginning of time.
+
+    When a game ends, on_end gets called (on the writer thread, once the record of it ending is safely on disk) with
+    the game's key and final state, history and all.
+    """
+
+    def __init__(self, directory, commit_interval=GROUP_COMMIT_INTERVAL, on_end=None):
+        self.directory = directory
+        self.log_path = os.path.join(directory, LOG_FILE)
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        self.commit_interval = commit_interval
+        self.queue = queue.SimpleQueue()
+        self.state = {}
+        self.seq = 0
+        self.snapshot_seq = 0
+        self.thread = None
+        self.on_end = on_end
+        self._ended = []
+        self._file = None
+
+    def recover(self):
+        """Reads the latest snapshot and replays the log after it, returning every game's state"""
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+            self.state = decode_state(snapshot["games"])
+            self.seq = self.snapshot_seq = snapshot["seq"]
+        replayed = 0
+        if os.path.exists(self.log_path):
+            good_end = 0
+            with open(self.log_path, "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn write from a crash; nothing after it made it to disk either
+                        log.warning("Ignoring corrupt record at the end of %s", self.log_path)
+                        break
+                    good_end += len(line)
+                    if record["seq"] <= self.seq:
+                        continue
+                    ended = apply(self.state, record)
+                    if ended is not None:
+                        # It might not have made it to on_end before the crash; on_end has to cope with repeats
+                        self._ended.append((tuple(record["game"]), ended))
+                    self.seq = record["seq"]
+                    replayed += 1
+            # Chop off anything torn so new records don't end up stuck behind it
+            os.truncate(self.log_path, good_end)
+        log.info("Recovered %d games (%d log records after snapshot)", len(self.state), replayed)
+        return copy.deepcopy(self.state)
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._file = open(self.log_path, "a", encoding="utf-8")  # pylint:disable=consider-using-with
+        self.thread = threading.Thread(target=self._writer, name="journal", daemon=True)
+        self.thread.start()
+
+    def record(self, key, op, **fields):
+        """Queues a record of a change to a game"""
+        self.queue.put((key, op, fields, time.time()))
+
+    def close(self):
+        if self.thread is not None:
+            self.queue.put(_STOP)
+            self.thread.join()
+            self.thread = None
+
+    def _writer(self):
+        self._finish_ended()
+        last_snapshot = time.monotonic()
+        stopping = False
+        while not stopping:
+            try:
+                batch = [self.queue.get(timeout=SNAPSHOT_INTERVAL)]
+            except queue.Empty:
+                batch = []
+            # Give anything else that's about to be recorded a chance to share the fsync
+            deadline = time.monotonic() + self.commit_interval
+            while batch and batch[-1] is not _STOP:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if batch and batch[-1] is _STOP:
+                batch.pop()
+                stopping = True
+            if batch:
+                self._commit(batch)
+            if self.seq - self.snapshot_seq >= SNAPSHOT_RECORDS or (
+                self.seq != self.snapshot_seq and (stopping or time.monotonic() - last_snapshot >= SNAPSHOT_INTERVAL)
+            ):
+                self._snapshot()
+                last_snapshot = time.monotonic()
+        self._file.close()
+
+    def _commit(self, batch):
+        lines = []
+        for key, op, fields, at in batch:
+            self.seq += 1
+            record = {"seq": self.seq, "at": at, "game": list(key), "op": op, **fields}
+            ended = apply(self.state, record)
+            if ended is not None:
+                self._ended.append((key, ended))
+            lines.append(json.dumps(record, separators=(",", ":")) + "\n")
+        try:
+            self._file.write("".join(lines))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except OSError:
+            log.exception("Couldn't write %d records to the game log", len(lines))
+        self._finish_ended()
+
+    def _finish_ended(self):
+        ended, self._ended = self._ended, []
+        if self.on_end is None:
+            return
+        for key, game in ended:
+            try:
+                self.on_end(key, game)
+            except Exception:  # pylint:disable=broad-except
+                log.exception("Couldn't finish off ended game %s", key)
+
+    def _snapshot(self):
+        tmp_path = self.snapshot_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"seq": self.seq, "games": encode_state(self.state)}, f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            # Everything in the log is covered by the snapshot now, so start it afresh
+            self._file.close()
+            self._file = open(self.log_path, "w", encoding="utf-8")  # pylint:disable=consider-using-with
+            self.snapshot_seq = self.seq
+        except OSError:
+            log.exception("Couldn't write game snapshot")
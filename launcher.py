@@ -0,0 +1,215 @@
+"""Runs the bot as several worker processes, each handling a share of the gateway shards
+
+Discord sends each guild's events to shard (guild_id >> 22) % shard_count, so splitting the shards between workers
+also splits the guilds (and every game in them) without the workers having to talk to each other. Each worker keeps
+its own journal and status file under data/worker-N; the supervisor restarts any worker that dies and periodically
+logs totals across all of them.
+
+    python launcher.py --workers 4
+    python launcher.py status
+
+Keep --workers and --shards the same across restarts, or workers will come back up owning different guilds than the
+ones in their journals.
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+import shards
+
+log = logging.getLogger("launcher")
+
+DISCORD_API_TOKEN_VAR = "ACCESS_TOKEN"
+DATA_DIR_VAR = "TOBAIFAM_DATA_DIR"
+DISCORD_URL_VAR = "TOBAIFAM_DISCORD_URL"
+DISCORD_URL = "https://discord.com"
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tobaifam.py")
+
+# Discord only lets each identify bucket start one shard every 5 seconds
+IDENTIFY_INTERVAL = 5.0
+
+# Restart backoff for a crashing worker, which resets once it's stayed up for a while
+MIN_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+STABLE_AFTER = 120.0
+
+# How long workers get to save their games and exit before they're killed
+SHUTDOWN_TIMEOUT = 30.0
+
+
+def recommended_shards(token):
+    """The number of shards Discord recommends for the bot"""
+    url = os.environ.get(DISCORD_URL_VAR, DISCORD_URL).rstrip("/") + "/api/v10/gateway/bot"
+    request = urllib.request.Request(url, headers={"Authorization": f"Bot {token}"})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.load(response)["shards"]
+
+
+def worker_dir(data_dir, index):
+    return os.path.join(data_dir, f"worker-{index}")
+
+
+class Worker:
+    """One bot process and its share of the shards"""
+
+    def __init__(self, index, shard_ids, shard_count, data_dir):
+        self.index = index
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.data_dir = worker_dir(data_dir, index)
+        self.process = None
+        self.started = None
+        self.restarts = 0
+        self.backoff = MIN_BACKOFF
+        self.restart_at = None
+
+    def spawn(self):
+        env = dict(
+            os.environ,
+            **{
+                shards.SHARD_COUNT_VAR: str(self.shard_count),
+                shards.SHARD_IDS_VAR: shards.format_ids(self.shard_ids),
+                shards.WORKER_VAR: str(self.index),
+                DATA_DIR_VAR: self.data_dir,
+            },
+        )
+        # In its own session, so a Ctrl-C at the terminal only reaches the supervisor (which passes it on)
+        self.process = subprocess.Popen(  # pylint:disable=consider-using-with
+            [sys.executable, BOT_SCRIPT], env=env, start_new_session=True
+        )
+        self.started = time.monotonic()
+        self.restart_at = None
+        log.info("Started worker %d (pid %d) with shards %s", self.index, self.process.pid, self.shard_ids)
+
+    def check(self, now):
+        """Notices if the worker has exited, and restarts it once its backoff is up"""
+        if self.restart_at is not None:
+            if now >= self.restart_at:
+                self.restarts += 1
+                self.spawn()
+            return
+        code = self.process.poll()
+        if code is None:
+            return
+        if now - self.started >= STABLE_AFTER:
+            self.backoff = MIN_BACKOFF
+        log.warning("Worker %d exited with code %d, restarting in %.0fs", self.index, code, self.backoff)
+        self.restart_at = now + self.backoff
+        self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            # discord.py shuts down cleanly on SIGINT, which gives the journal a chance to write a snapshot
+            self.process.send_signal(signal.SIGINT)
+
+    def wait(self, deadline):
+        if self.process is None:
+            return
+        try:
+            self.process.wait(max(deadline - time.monotonic(), 0))
+        except subprocess.TimeoutExpired:
+            log.warning("Worker %d didn't stop in time, killing it", self.index)
+            self.process.kill()
+            self.process.wait()
+
+
+class Supervisor:
+    """Starts the workers, keeps them running, and reports on them"""
+
+    def __init__(self, workers, shard_count, data_dir, status_interval):
+        self.workers = [
+            Worker(i, shard_ids, shard_count, data_dir)
+            for i, shard_ids in enumerate(shards.assign_shards(shard_count, workers))
+        ]
+        self.data_dir = data_dir
+        self.status_interval = status_interval
+        self.stopping = False
+
+    def run(self):
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGTERM, self._stop)
+        try:
+            for worker in self.workers:
+                if self.stopping:
+                    break
+                worker.spawn()
+                # Stagger the workers so they aren't all identifying at once
+                self._sleep(IDENTIFY_INTERVAL * len(worker.shard_ids))
+            next_status = time.monotonic() + self.status_interval
+            while not self.stopping:
+                now = time.monotonic()
+                for worker in self.workers:
+                    worker.check(now)
+                if now >= next_status:
+                    log.info("Status: %s", json.dumps(self.status()))
+                    next_status = now + self.status_interval
+                self._sleep(1.0)
+        finally:
+            self.shutdown()
+
+    def status(self):
+        return shards.aggregate([shards.read_status(w.data_dir) for w in self.workers])
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.stop()
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        for worker in self.workers:
+            worker.wait(deadline)
+
+    def _stop(self, _signum, _frame):
+        self.stopping = True
+
+    def _sleep(self, seconds):
+        deadline = time.monotonic() + seconds
+        while not self.stopping and time.monotonic() < deadline:
+            time.sleep(min(deadline - time.monotonic(), 0.5))
+
+
+def print_status(data_dir):
+    """Prints each worker's last report and the totals across them"""
+    dirs = sorted((d for d in os.listdir(data_dir) if d.startswith("worker-")), key=lambda d: int(d.split("-", 1)[1]))
+    statuses = [shards.read_status(os.path.join(data_dir, d)) for d in dirs]
+    for d, status in zip(dirs, statuses):
+        if status is None:
+            print(f"{d}: no status")
+        else:
+            age = time.time() - status["updated"]
+            print(
+                f"{d}: pid {status['pid']}, shards {status['shards']}, {status['guilds']} guilds, "
+                + f"{status['games']} games, latency {status['latency'] * 1000:.0f}ms, updated {age:.0f}s ago"
+            )
+    print(json.dumps(shards.aggregate(statuses), indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", nargs="?", choices=("run", "status"), default="run")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--shards", type=int, help="total shard count (default: Discord's recommendation)")
+    parser.add_argument("--data-dir", default=os.environ.get(DATA_DIR_VAR, "data"))
+    parser.add_argument("--status-interval", type=float, default=60.0, help="seconds between status log lines")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        print_status(args.data_dir)
+        sys.exit(0)
+
+    shard_count = args.shards
+    if shard_count is None:
+        access_token = os.environ.get(DISCORD_API_TOKEN_VAR, None)
+        if access_token is None:
+            raise EnvironmentError(f"{DISCORD_API_TOKEN_VAR} environment variable not set!")
+        shard_count = recommended_shards(access_token)
+    # Every worker needs at least one shard
+    shard_count = max(shard_count, args.workers)
+    log.info("Running %d shards across %d workers", shard_count, args.workers)
+    Supervisor(args.workers, shard_count, args.data_dir, args.status_interval).run()
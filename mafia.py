@@ -1,28 +1,137 @@
-"""Contains abstracted game logic"""
+"""Contains abstracted game logic
+
+Game is a synchronous state machine: its commands (start, start_day, vote, ...) update the game and return a list of
+events describing what happened, which the bot then renders. Nothing in here knows about Discord or awaits anything.
+"""
+from array import array
+from collections import namedtuple
 from enum import Enum
 import re
+import sys
+import time
 
 Abstain = object()
 
+# Special values in Game.ballot
+NO_VOTE = -1
+ABSTAIN_VOTE = -2
+
+#
+# Events produced by the game state machine
+#
+TimerStopped = namedtuple("TimerStopped", [])
+GameStarted = namedtuple("GameStarted", ["players"])
+DayStarted = namedtuple("DayStarted", ["day", "alive", "timed"])
+DayContinued = namedtuple("DayContinued", ["day", "timed"])
+VotingStarted = namedtuple("VotingStarted", [])
+VotingReopened = namedtuple("VotingReopened", [])
+VoteCast = namedtuple("VoteCast", ["voter", "target", "count", "majority"])
+MajorityReached = namedtuple("MajorityReached", ["target"])
+NoDecision = namedtuple("NoDecision", [])
+# tally is a list of (target, [voters]) in player order, with Abstain last
+VoteResults = namedtuple("VoteResults", ["alive", "majority", "tally"])
+Eliminated = namedtuple("Eliminated", ["user"])
+NoElimination = namedtuple("NoElimination", [])
+TwilightStarted = namedtuple("TwilightStarted", [])
+NightStarted = namedtuple("NightStarted", ["day"])
+NightResumed = namedtuple("NightResumed", ["day"])
+GameEnded = namedtuple("GameEnded", ["day", "alive", "dead"])
+# message may contain {prefix}, to be filled in with the bot's command prefix
+Rejected = namedtuple("Rejected", ["message"])
+
+#
+# Commands accepted by Game.handle, for driving games in bulk
+#
+Start = namedtuple("Start", [])
+StartDay = namedtuple("StartDay", ["timed"], defaults=[False])
+CallVote = namedtuple("CallVote", [])
+Vote = namedtuple("Vote", ["voter", "target"])
+ResolveVotes = namedtuple("ResolveVotes", [])
+StartNight = namedtuple("StartNight", [])
+Kill = namedtuple("Kill", ["user"])
+Advance = namedtuple("Advance", [])
+End = namedtuple("End", [])
+
+# Longest substrings stored in the player name index; longer queries are narrowed down with these
+NGRAM_LENGTH = 3
+
+
+def ngrams(text):
+    """Every substring of a string up to NGRAM_LENGTH characters long"""
+    return {text[i : i + n] for n in range(1, NGRAM_LENGTH + 1) for i in range(len(text) - n + 1)}
+
+
+def mention(user_id):
+    """Discord's markup for pinging a user"""
+    return f"<@{user_id}>"
 
-class Alarm(Exception):
-    """Raised when a timer runs out"""
+
+def bits(mask):
+    """The positions of the set bits in an int, lowest first"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
 
 
 class Game:
-    """Represents a game state"""
+    """Represents a game state
+
+    Every player gets a slot, with their ID, display name and name#discriminator tag in parallel lists, and their
+    vote (and the votes against them) in int arrays, so a game never holds on to any Discord objects. The roster and
+    graveyard map the IDs of the living and the dead to their slots in join order, and the living are also kept as a
+    bitmask of slots for name searches. Slots given up by people leaving during signups get reused.
+    """
 
-    def __init__(self, name, host):
+    __slots__ = (
+        "key",
+        "active",
+        "name",
+        "host",
+        "host_name",
+        "day",
+        "vote_mode",
+        "ids",
+        "names",
+        "tags",
+        "roster",
+        "graveyard",
+        "free_slots",
+        "alive",
+        "name_index",
+        "ballot",
+        "tally",
+        "abstains",
+        "vote_count",
+        "on_phase_change",
+        "on_change",
+        "_phase",
+    )
+
+    def __init__(self, name, host, host_name, key=None):
+        self.key = key
         self.active = False
         self.name = name
         self.host = host
-        self.players = []
-        self.dead = []
-        self.votes = {}
-        self.phase = None
+        self.host_name = host_name
         self.day = 0
-        self.timer = 0
-        self.stop_timer = False
+        # How the bot runs the voting phase (None for its default); the game itself doesn't care
+        self.vote_mode = None
+        self.ids = array("Q")
+        self.names = []
+        self.tags = []
+        self.roster = {}
+        self.graveyard = {}
+        self.free_slots = []
+        self.alive = 0
+        self.name_index = {}
+        self.ballot = array("i")
+        self.tally = array("i")
+        self.abstains = 0
+        self.vote_count = 0
+        self.on_phase_change = None
+        self.on_change = None
+        self._phase = None
 
     class Phase(Enum):
         """Represents the current phase of the day"""
@@ -32,36 +141,413 @@ class Game:
         TWILIGHT = "Twilight phase"
         NIGHT = "Night"
 
-    def find_user(self, string):
-        """Tries to find the user with a given name"""
+    class Role(Enum):
+        """Someone's part in a game"""
+
+        HOST = "host"
+        PLAYER = "player"
+        DEAD = "dead"
+        NONE = "none"
+
+    @property
+    def phase(self):
+        return self._phase
+
+    @phase.setter
+    def phase(self, phase):
+        old, self._phase = self._phase, phase
+        self._changed("phase", phase=phase.name if phase is not None else None, day=self.day)
+        if old != phase and self.on_phase_change is not None:
+            self.on_phase_change(self, old)
+
+    def _changed(self, op, **fields):
+        if self.on_change is not None:
+            self.on_change(self, op, **fields)
+
+    def handle(self, command):
+        """Runs a command namedtuple, returning its events"""
+        return getattr(self, COMMAND_METHODS[type(command)])(*command)
+
+    def handle_all(self, commands):
+        """Runs a batch of commands, returning all of their events in order"""
+        events = []
+        for command in commands:
+            events += self.handle(command)
+        return events
+
+    def start(self):
+        """Ends signups and starts the game at night zero"""
+        self.active = True
+        self.day = 0
+        self._changed("start")
+        self.phase = self.Phase.TWILIGHT
+        return [GameStarted(self.players)] + self.start_night()
+
+    def start_day(self, timed=False):
+        """Ends the night, or takes the game back to the day from the voting phase"""
+        if self.phase == self.Phase.NIGHT:
+            self.day += 1
+            self.phase = self.Phase.DAY
+            return [TimerStopped(), DayStarted(self.day, self.players, timed)]
+        if self.phase == self.Phase.TWILIGHT:
+            return [Rejected("Please wait for the night to start before trying to end the night")]
+        # can use this to extend day after calling a vote
+        self.phase = self.Phase.DAY
+        return [TimerStopped(), DayContinued(self.day, timed)]
+
+    def call_vote(self):
+        """Ends the day and moves on to voting (or goes back to voting, if it was ended early)"""
+        if self.phase == self.Phase.DAY:
+            return self.start_voting()
+        if self.phase == self.Phase.VOTE:
+            return [Rejected("It's already the voting phase, what are you doing?")]
+        if self.phase == self.Phase.TWILIGHT:
+            return [VotingReopened()] + self.start_voting(reopen=True)
+        return [Rejected("Voting already ended for the day!")]
+
+    def start_voting(self, reopen=False):
+        """Moves to the voting phase, with a fresh ballot unless we're reopening the last one"""
+        self.phase = self.Phase.VOTE
+        if reopen:
+            return [TimerStopped()]
+        self.clear_votes()
+        return [TimerStopped(), VotingStarted()]
+
+    def vote(self, voter, target):
+        """Casts a vote, resolving the voting phase if that settles it"""
+        count = self.cast_vote(voter, target)
+        majority = self.majority_count()
+        events = [VoteCast(voter, target, count, majority)]
+        if count >= majority:
+            events.append(MajorityReached(target))
+            events += self.resolve_votes()
+        elif self.total_votes() == self.alive_count:
+            events.append(NoDecision())
+            events += self.resolve_votes()
+        return events
+
+    def resolve_votes(self):
+        """Ends the voting phase, eliminating whoever got a majority"""
+        if self.phase != self.Phase.VOTE:
+            return []
+        self.phase = self.Phase.TWILIGHT
+        majority = self.majority_count()
+        tally, _ = self.vote_groups()
+        eliminated = next((u for u, v in tally if u is not Abstain and len(v) >= majority), None)
+
+        events = [TimerStopped(), VoteResults(self.alive_count, majority, tally)]
+        if eliminated is not None:
+            events += self.kill(eliminated)
+        else:
+            events.append(NoElimination())
+        events.append(TwilightStarted())
+        return events
+
+    def start_night(self):
+        """Moves from the twilight phase into the night (or undoes starting the day)"""
+        if self.phase == self.Phase.DAY:
+            # undo starting the day
+            self.day -= 1
+            self.phase = self.Phase.NIGHT
+            return [TimerStopped(), NightResumed(self.day)]
+        if self.phase == self.Phase.VOTE:
+            return [
+                Rejected(
+                    "Voting is not over yet! Type `{prefix}timer 0` to end voting and resolve the elimination first."
+                )
+            ]
+        if self.phase == self.Phase.TWILIGHT:
+            self.phase = self.Phase.NIGHT
+            return [TimerStopped(), NightStarted(self.day)]
+        return [Rejected("Hey! It's already nighttime, you weirdo!")]
+
+    def kill(self, user):
+        """Eliminates a player"""
+        self.eliminate(user)
+        return [Eliminated(user)]
+
+    def advance(self):
+        """Moves on to whatever phase comes next, e.g. when the timer runs out"""
+        if self.phase == self.Phase.DAY:
+            return self.start_voting()
+        if self.phase == self.Phase.VOTE:
+            return self.resolve_votes()
+        if self.phase == self.Phase.TWILIGHT:
+            return self.start_night()
+        if self.phase == self.Phase.NIGHT:
+            return self.start_day()
+        return []
+
+    def end(self):
+        """Ends the game for good, whatever phase it's in"""
+        if self.phase is None:
+            return [Rejected("This game's already over!")]
+        self.phase = None
+        return [TimerStopped(), GameEnded(self.day, self.players, self.dead_players)]
+
+    @property
+    def players(self):
+        """IDs of everyone alive (or signed up), in join order"""
+        return list(self.roster)
+
+    @property
+    def dead_players(self):
+        """IDs of everyone who's been eliminated, in join order"""
+        return list(self.graveyard)
+
+    @property
+    def alive_count(self):
+        return len(self.roster)
+
+    def is_alive(self, user_id):
+        """Whether a user is playing (or signed up) and hasn't been eliminated"""
+        return user_id in self.roster
+
+    def role_of(self, user_id):
+        """Whether a user is hosting, playing (or signed up), dead or not in the game at all"""
+        if user_id == self.host:
+            return self.Role.HOST
+        if user_id in self.roster:
+            return self.Role.PLAYER
+        if user_id in self.graveyard:
+            return self.Role.DEAD
+        return self.Role.NONE
+
+    def display_name(self, user_id):
+        """A player's (or the host's) display name as of when they joined"""
+        if user_id == self.host:
+            return self.host_name
+        slot = self.roster.get(user_id)
+        if slot is None:
+            slot = self.graveyard[user_id]
+        return self.names[slot]
+
+    def add_player(self, user_id, name, tag):
+        """Signs a user up for the game, given their ID, display name and name#discriminator"""
+        if user_id in self.roster or user_id in self.graveyard:
+            raise ValueError(f"{name} is already in the game!")
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.ids[slot] = user_id
+            self.names[slot] = name
+            self.tags[slot] = tag
+            self.ballot[slot] = NO_VOTE
+            self.tally[slot] = 0
+        else:
+            slot = len(self.ids)
+            self.ids.append(user_id)
+            self.names.append(name)
+            self.tags.append(tag)
+            self.ballot.append(NO_VOTE)
+            self.tally.append(0)
+        self.roster[user_id] = slot
+        self.alive |= 1 << slot
+        for gram in self._grams(slot):
+            gram = sys.intern(gram)
+            self.name_index[gram] = self.name_index.get(gram, 0) | 1 << slot
+        self._changed("join", user=user_id, name=name, tag=tag)
+
+    def remove_player(self, user_id):
+        """Takes a user back out of the game during signups"""
+        slot = self.roster.pop(user_id)
+        self.alive &= ~(1 << slot)
+        for gram in self._grams(slot):
+            remaining = self.name_index[gram] & ~(1 << slot)
+            if remaining:
+                self.name_index[gram] = remaining
+            else:
+                del self.name_index[gram]
+        self.free_slots.append(slot)
+        self._changed("unjoin", user=user_id)
+
+    def eliminate(self, user_id):
+        """Moves a player from the living to the dead"""
+        slot = self.roster.pop(user_id)
+        self.graveyard[user_id] = slot
+        self.alive &= ~(1 << slot)
+        self._changed("kill", user=user_id)
+
+    def _grams(self, slot):
+        """Every n-gram of a slot's names, as indexed for searching"""
+        return ngrams(self.tags[slot].lower()) | ngrams(self.names[slot].lower())
+
+    def _search_names(self, string):
+        """Slots of every living player whose name or display name contains a (lowercase) string"""
+        if len(string) <= NGRAM_LENGTH:
+            return self.name_index.get(string, 0) & self.alive
+        # Narrow down to players who have every n-gram of the string, then check them properly
+        candidates = self.alive
+        for i in range(len(string) - NGRAM_LENGTH + 1):
+            candidates &= self.name_index.get(string[i : i + NGRAM_LENGTH], 0)
+            if not candidates:
+                return 0
+        matches = 0
+        for slot in bits(candidates):
+            if string in self.tags[slot].lower() or string in self.names[slot].lower():
+                matches |= 1 << slot
+        return matches
+
+    def find_user(self, string, mentions=()):
+        """Tries to find the ID of the player with a given name (or mention, if Discord already parsed it for us)"""
         string = string.strip()
         # First try for an exact match
-        if m := re.match(r"^\<\@(\d+)\>$", string):
-            uid = int(m.group(1))
-            matching_players = [p for p in self.players if p.id == uid]
-            if len(matching_players) == 0:
+        if string.startswith("<@") and string.endswith(">"):
+            if len(mentions) == 1:
+                uid = mentions[0].id
+            elif m := re.match(r"^\<\@!?(\d+)\>$", string):
+                uid = int(m.group(1))
+            else:
+                raise ValueError(f"Can't find user whose name contains '{string}'")
+            if not self.is_alive(uid):
                 raise ValueError("That person isn't playing the game right now! Please don't ping them :(")
-            if len(matching_players) > 1:
-                raise ValueError("I'm sorry, but Discord appears to be possessed by a ghost.")
-            return matching_players[0]
+            return uid
         # Best-effort fuzzy match
-        users_starting_with_name = [
-            p
-            for p in self.players
-            if (f"{p.name.lower()}#{p.discriminator}").find(string.lower()) > -1
-            or p.display_name.lower().find(string.lower()) > -1
-        ]
-        if len(users_starting_with_name) == 0:
+        matches = list(bits(self._search_names(string.lower())))
+        if len(matches) == 0:
             raise ValueError(f"Can't find user whose name contains '{string}'")
-        if len(users_starting_with_name) > 1:
-            guesses = [f"{p.name}#{p.discriminator}" for p in users_starting_with_name]
+        if len(matches) > 1:
+            guesses = [self.tags[slot] for slot in matches]
             raise ValueError(f"I don't know who you mean by '{string}' (could be {', '.join(guesses)})")
-        return users_starting_with_name[0]
+        return self.ids[matches[0]]
+
+    def cast_vote(self, voter, target):
+        """Records (or changes) a player's vote, returning the new number of votes for the target"""
+        voter_slot = self.roster[voter]
+        previous = self.ballot[voter_slot]
+        if previous == NO_VOTE:
+            self.vote_count += 1
+        elif previous == ABSTAIN_VOTE:
+            self.abstains -= 1
+        else:
+            self.tally[previous] -= 1
+        if target is Abstain:
+            self.ballot[voter_slot] = ABSTAIN_VOTE
+            self.abstains += 1
+            count = self.abstains
+        else:
+            target_slot = self.roster[target]
+            self.ballot[voter_slot] = target_slot
+            self.tally[target_slot] += 1
+            count = self.tally[target_slot]
+        self._changed("vote", voter=voter, target="abstain" if target is Abstain else target)
+        return count
+
+    def clear_votes(self):
+        """Throws away all of the current votes"""
+        self.ballot = array("i", [NO_VOTE]) * len(self.ids)
+        self.tally = array("i", [0]) * len(self.ids)
+        self.abstains = 0
+        self.vote_count = 0
+        self._changed("clear_votes")
+
+    def set_vote_mode(self, mode):
+        self.vote_mode = mode
+        self._changed("vote_mode", mode=mode)
 
-    def votes_for(self, user):
-        """The number of tallied votes for a given user"""
-        return len([v for v in self.votes.values() if v == user])
+    def vote_groups(self):
+        """Who's voted for whom so far, as (target, [voter IDs]) pairs in join order with Abstain last, plus the IDs of
+        everyone who hasn't voted
+
+        This goes through the whole roster, since the list of who's still to vote needs everyone anyway; a list of
+        voters kept per target came out slower than this at any size a game actually gets to.
+        """
+        voters = {}
+        not_voted = []
+        for uid, slot in self.roster.items():
+            target = self.ballot[slot]
+            if target == NO_VOTE:
+                not_voted.append(uid)
+            else:
+                voters.setdefault(target, []).append(uid)
+        groups = [(uid, voters[slot]) for uid, slot in self.roster.items() if slot in voters]
+        if ABSTAIN_VOTE in voters:
+            groups.append((Abstain, voters[ABSTAIN_VOTE]))
+        return groups, not_voted
+
+    def majority_count(self):
+        """The number of votes needed to reach a majority decision"""
+        return self.alive_count // 2 + 1
 
     def total_votes(self):
         """The number of tallied votes"""
-        return len(self.votes)
+        return self.vote_count
+
+
+COMMAND_METHODS = {
+    Start: "start",
+    StartDay: "start_day",
+    CallVote: "call_vote",
+    Vote: "vote",
+    ResolveVotes: "resolve_votes",
+    StartNight: "start_night",
+    Kill: "kill",
+    Advance: "advance",
+    End: "end",
+}
+
+
+class GameManager:
+    """Holds every game the bot is running, keyed by the guild and channel it's played in"""
+
+    def __init__(self):
+        self.games = {}
+        # IDs of the channels whose games are in their voting phase
+        self.voting = set()
+        # Called with (game key, op, **fields) whenever any game changes
+        self.on_change = None
+        # When each game's current phase began (by time.monotonic())
+        self.phase_started = {}
+        # Called with (game, old phase, seconds spent in it) whenever a game moves on to a new phase
+        self.on_phase_change = None
+
+    def __len__(self):
+        return len(self.games)
+
+    def __iter__(self):
+        return iter(self.games.values())
+
+    @staticmethod
+    def key_for(channel):
+        """The registry key for a given channel"""
+        guild = getattr(channel, "guild", None)
+        return (guild.id if guild is not None else None, channel.id)
+
+    def get(self, channel):
+        """The game being played in a channel, or None if there isn't one"""
+        return self.games.get(self.key_for(channel))
+
+    def create(self, channel, name, host, host_name):
+        """Creates a new game in a channel, hosted by the user with the given ID"""
+        key = self.key_for(channel)
+        if key in self.games:
+            raise ValueError("There's already a game in this channel!")
+        game = Game(name, host, host_name, key)
+        game.on_phase_change = self._phase_changed
+        game.on_change = self._game_changed
+        self.games[key] = game
+        self._game_changed(game, "host", name=name, host=host, host_name=host_name)
+        return game
+
+    def remove(self, channel, finished=False):
+        """Forgets about the game in a channel, which was either cancelled or played to the end"""
+        self.voting.discard(channel.id)
+        self.phase_started.pop(self.key_for(channel), None)
+        game = self.games.pop(self.key_for(channel), None)
+        if game is not None:
+            self._game_changed(game, "end" if finished else "cancel")
+        return game
+
+    def _game_changed(self, game, op, **fields):
+        if self.on_change is not None:
+            self.on_change(game.key, op, **fields)
+
+    def _phase_changed(self, game, old_phase):
+        if game.phase == Game.Phase.VOTE:
+            self.voting.add(game.key[1])
+        else:
+            self.voting.discard(game.key[1])
+        now = time.monotonic()
+        started = self.phase_started.get(game.key)
+        self.phase_started[game.key] = now
+        if self.on_phase_change is not None and old_phase is not None and started is not None:
+            self.on_phase_change(game, old_phase, now - started)
@@ -2,6 +2,9 @@
 # pylint:disable=line-too-long
 import random
 
+from outbox import send
+from overload import degraded
+
 NORMAL_ALARM_TEXT = "DING DING DING"
 NORMAL_VOTING_TEXT = "Time to vote!"
 
@@ -118,16 +121,48 @@ DEATH_EMOJIS = [
 ]
 
 
+# Instructions for the host, filled in with {prefix} once at startup and {host} each time they're sent
+SIGNUP_HELP = (
+    "Players, type `{prefix}join` to sign up for this game.\n"
+    + "(:information_source: **{host}** as the host, type `{prefix}cancel`to cancel the signups.)"
+)
+START_PROMPT = "({host}, as the host, you can start the game by typing `{prefix}start`.)"
+DAY_HELP = (
+    "(:information_source: **{host}**, you can type:\n"
+    + "- `{prefix}timer X` to move to voting phase in X amount of time (X could be `5m`, `30s`, etc)\n"
+    + "- `{prefix}votingphase` to immediately end the day and move to voting phase.)\n"
+)
+VOTING_HELP = (
+    "Type something like `{prefix}vote {host}`to vote for another user. "
+    + "(You can also ping whoever you're voting for after the `{prefix}vote` command.)\n"
+    + "You can also type `{prefix}abstain` to cast a vote for no one.\n"
+    + "Voting phase ends when everyone has cast a vote, or when a majority is reached.\n"
+    + "(:information_source: **{host}**, you can type `{prefix}timer [time limit]` "
+    + "to place a time limit on voting, or `{prefix}day` to extend the day phase more.)"
+)
+TWILIGHT_HELP = "(:information_source: **{host}**, say your piece, then type `{prefix}night`to move to night phase.)"
+FIRST_NIGHT_HELP = (
+    "(:information_source: **{host}**, do whatever you need to, then type "
+    + "`{prefix}day` to start the first day. You can also specify a time limit, like "
+    + "`{prefix}day 5min`.)\n"
+)
+NIGHT_HELP = (
+    "(:information_source: **{host}**, you can type:\n"
+    + "- `{prefix}timer X` to end the night in a certain amount of time\n"
+    + "- `{prefix}day` to immediately end the night and move to the next day phase.)\n"
+)
+
+
 async def system_message(ctx, msg, emoji="", altmsgs=None):
     """Normal system message"""
     if emoji:
         emoji = f":{emoji}: "
-    if altmsgs is None or random.randint(0, 2):
-        await ctx.send(f"***-- {emoji}{msg} --***")
+    if altmsgs is None or degraded.skip("flavor") or random.randint(0, 2):
+        await send(ctx, f"***-- {emoji}{msg} --***")
     else:
-        await ctx.send(f"***-- {emoji}{random.choice(altmsgs)} --***")
+        await send(ctx, f"***-- {emoji}{random.choice(altmsgs)} --***")
 
 
 async def yell_at_user(ctx, msg):
     """Error message"""
-    await ctx.send(f"{ctx.author.mention} :warning: `{msg}`")
+    await send(ctx, f"{ctx.author.mention} :warning: `{msg}`")
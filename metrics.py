@@ -0,0 +1,183 @@
+"""In-process metrics, served over HTTP in Prometheus' text format"""
+import asyncio
+import bisect
+import collections
+import logging
+import re
+
+import aiohttp
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+# Bucket upper bounds (in seconds) for latency histograms
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# ...and for how long game phases last
+PHASE_BUCKETS = (10, 30, 60, 120, 300, 600, 900, 1800, 3600, 7200)
+
+# How often to check how late the event loop is running
+LAG_INTERVAL = 0.5
+
+# Picks the channel out of a Discord API URL
+CHANNEL_PATH = re.compile(r"/channels/(\d+)")
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=""):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """A named family of samples, one per combination of label values
+
+    Instead of being updated as things happen, a metric can be given a collect function, which gets called at scrape
+    time and returns a {label values: value} dict. That's handy for things some other object already keeps count of.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=(), collect=None):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.collect = collect
+        self.values = {}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        values = self.collect() if self.collect is not None else self.values
+        for label_values, value in values.items():
+            lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, *label_values):
+        self.values[label_values] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        state = self.values.get(label_values)
+        if state is None:
+            # Per-bucket counts (not cumulative until rendered), then the sum and count
+            state = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for label_values, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + ("+Inf",), counts):
+                cumulative += n
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, label_values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, label_values)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, label_values)} {count}")
+        return lines
+
+
+class Registry:
+    """Every metric the bot exports"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.add(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.add(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.add(Histogram(*args, **kwargs))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            try:
+                lines += metric.render()
+            except Exception:  # pylint:disable=broad-except
+                # One broken collector shouldn't take the whole endpoint down with it
+                log.exception("Couldn't collect metric %s", metric.name)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class RateLimitTracker:
+    """Counts the 429s Discord sends back, by channel, by watching every HTTP request discord.py makes
+
+    discord.py waits out and retries rate limited requests itself, so they never reach the code that made them; this
+    is the only place they show up. Pass the trace config to the Client as http_trace.
+    """
+
+    def __init__(self):
+        # Channel ID (or None for requests that aren't about a channel) -> 429s
+        self.hits = collections.Counter()
+        self.trace = aiohttp.TraceConfig()
+        self.trace.on_request_end.append(self._request_end)
+
+    def total(self):
+        return sum(self.hits.values())
+
+    async def _request_end(self, _session, _context, params):
+        if params.response.status == 429:
+            match = CHANNEL_PATH.search(params.url.path)
+            self.hits[int(match.group(1)) if match else None] += 1
+
+
+async def serve(host, port, reg=registry):
+    """Starts answering /metrics requests, returning the runner to clean up with"""
+
+    async def handle(_request):
+        return web.Response(text=reg.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    log.info("Serving metrics on http://%s:%d/metrics", host, port)
+    return runner
+
+
+async def monitor_loop_lag(histogram, interval=LAG_INTERVAL, on_lag=None):
+    """Records how much later than asked for the event loop wakes up a sleeping task, also passing it to on_lag"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(loop.time() - started - interval, 0.0)
+        histogram.observe(lag)
+        if on_lag is not None:
+            on_lag(lag)
@@ -0,0 +1,224 @@
+"""Per-channel outbound message queues, so bursts of messages go out as a few merged sends"""
+import asyncio
+import collections
+import logging
+import time
+
+import discord
+
+log = logging.getLogger(__name__)
+
+# Discord won't accept messages longer than this
+MESSAGE_LIMIT = 2000
+
+# How long to wait for more messages to merge into a send
+COALESCE_WINDOW = 0.25
+
+# Our own pace for each channel, to stay inside Discord's usual message bucket (5 messages every 5 seconds) instead of
+# running into it: discord.py waits out any 429s it gets inside the send itself, so we never get to see them
+RATE_LIMIT_COUNT = 5
+RATE_LIMIT_PERIOD = 5.0
+
+# Give up on a message after this many attempts that came back rate limited anyway (when discord.py gives up on one)
+MAX_ATTEMPTS = 5
+
+
+def split_message(text, limit=MESSAGE_LIMIT):
+    """Splits a message into pieces that fit under Discord's length limit, preferring to break at newlines"""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    chunks.append(text)
+    return chunks
+
+
+class Outbox:
+    """Queue of messages waiting to be sent to one channel"""
+
+    def __init__(self, channel, window=COALESCE_WINDOW, on_flush=None):
+        self.channel = channel
+        self.window = window
+        # Called with how long each send's first message waited between being queued and going out
+        self.on_flush = on_flush
+        self.pending = collections.deque()
+        self.sent_at = collections.deque(maxlen=RATE_LIMIT_COUNT)
+        self.task = None
+        # Stats
+        self.queued = 0
+        self.sends = 0
+        self.rate_limited = 0
+        self.failed = 0
+
+    @property
+    def depth(self):
+        return len(self.pending)
+
+    def put(self, content=None, **kwargs):
+        """Queues a message, returning a future for the Message it eventually gets sent as"""
+        future = asyncio.get_running_loop().create_future()
+        now = time.monotonic()
+        if kwargs or content is None:
+            # Embeds, views etc. always get a send to themselves
+            self.pending.append((content, kwargs, future, now))
+        else:
+            chunks = split_message(str(content))
+            for chunk in chunks[:-1]:
+                self.pending.append((chunk, None, None, now))
+            self.pending.append((chunks[-1], None, future, now))
+        self.queued += 1
+        if self.task is None:
+            self.task = asyncio.create_task(self._drain())
+        return future
+
+    async def _drain(self):
+        try:
+            while self.pending:
+                await asyncio.sleep(self.window)
+                await self._pace()
+                content, kwargs, futures, queued_at = self._take_batch()
+                try:
+                    message = await self._deliver(content, kwargs or {})
+                except Exception as e:  # pylint:disable=broad-except
+                    # A dropped connection, say; whoever's waiting on the message hears about it, and the rest carry on
+                    self.failed += 1
+                    log.warning("Couldn't send message to channel %s: %r", self.channel.id, e)
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(e)
+                            # Most sends are never waited on, and this one's been logged already
+                            future.exception()
+                    continue
+                if self.on_flush is not None:
+                    self.on_flush(time.monotonic() - queued_at)
+                for future in futures:
+                    if not future.done():
+                        future.set_result(message)
+        finally:
+            self.task = None
+
+    def _take_batch(self):
+        content, kwargs, future, queued_at = self.pending.popleft()
+        futures = [future] if future is not None else []
+        if kwargs is not None:
+            return content, kwargs, futures, queued_at
+        parts = [content]
+        length = len(content)
+        while self.pending and self.pending[0][1] is None and length + 1 + len(self.pending[0][0]) <= MESSAGE_LIMIT:
+            content, _, future, _ = self.pending.popleft()
+            parts.append(content)
+            length += 1 + len(content)
+            if future is not None:
+                futures.append(future)
+        return "\n".join(parts), None, futures, queued_at
+
+    async def _pace(self):
+        # Hold off until there's room in the channel's bucket
+        if len(self.sent_at) == RATE_LIMIT_COUNT:
+            wait = self.sent_at[0] + RATE_LIMIT_PERIOD - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+    async def _deliver(self, content, kwargs):
+        for _ in range(MAX_ATTEMPTS):
+            self.sent_at.append(time.monotonic())
+            try:
+                message = await self.channel.send(content, **kwargs)
+                self.sends += 1
+                return message
+            except discord.RateLimited as e:
+                self.rate_limited += 1
+                await asyncio.sleep(e.retry_after)
+            except discord.HTTPException as e:
+                if e.status != 429:
+                    self.failed += 1
+                    log.warning("Couldn't send message to channel %s: %s", self.channel.id, e)
+                    return None
+                self.rate_limited += 1
+                headers = getattr(e.response, "headers", {})
+                await asyncio.sleep(float(headers.get("Retry-After", RATE_LIMIT_PERIOD)))
+        self.failed += 1
+        log.warning("Gave up sending message to channel %s after %d attempts", self.channel.id, MAX_ATTEMPTS)
+        return None
+
+
+class Digest:
+    """Collects lines for each channel and posts them as one message every so often
+
+    Handy for things that happen in bursts but don't need announcing the instant they happen. The render function
+    gets the channel and the lines collected since the last post, and returns the message to send (or None).
+    """
+
+    def __init__(self, render, interval):
+        self.render = render
+        self.interval = interval
+        self.lines = {}
+        self.tasks = {}
+
+    def add(self, channel, line):
+        self.lines.setdefault(channel.id, []).append(line)
+        if channel.id not in self.tasks:
+            self.tasks[channel.id] = asyncio.create_task(self._run(channel))
+
+    def discard(self, channel):
+        """Drops whatever a channel has collected without posting it"""
+        self.lines.pop(channel.id, None)
+        task = self.tasks.pop(channel.id, None)
+        if task is not None:
+            task.cancel()
+
+    async def _run(self, channel):
+        try:
+            while channel.id in self.lines:
+                await asyncio.sleep(self.interval)
+                lines = self.lines.pop(channel.id, None)
+                content = self.render(channel, lines) if lines else None
+                if content is not None:
+                    await send(channel, content)
+        except Exception:  # pylint:disable=broad-except
+            log.exception("Couldn't post digest in channel %s", channel.id)
+        finally:
+            if self.tasks.get(channel.id) is asyncio.current_task():
+                del self.tasks[channel.id]
+
+
+class OutboxManager:
+    """Every channel's outbox"""
+
+    def __init__(self, window=COALESCE_WINDOW):
+        self.window = window
+        self.outboxes = {}
+        # Called with how long each send waited in its outbox
+        self.on_flush = None
+
+    def __iter__(self):
+        return iter(self.outboxes.values())
+
+    def get(self, channel):
+        outbox = self.outboxes.get(channel.id)
+        if outbox is None:
+            outbox = self.outboxes[channel.id] = Outbox(channel, self.window, self._flushed)
+        return outbox
+
+    def stats(self):
+        """Totals across every channel"""
+        return {
+            "depth": sum(o.depth for o in self.outboxes.values()),
+            "sends": sum(o.sends for o in self.outboxes.values()),
+            "rate_limited": sum(o.rate_limited for o in self.outboxes.values()),
+        }
+
+    def _flushed(self, seconds):
+        if self.on_flush is not None:
+            self.on_flush(seconds)
+
+
+outboxes = OutboxManager()
+
+
+async def send(ctx, content=None, **kwargs):
+    """Queues a message for a context's channel (or a channel itself) without waiting for it to go out"""
+    return outboxes.get(getattr(ctx, "channel", ctx)).put(content, **kwargs)
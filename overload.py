@@ -0,0 +1,70 @@
+"""Degraded mode, for when the event loop can't keep up
+
+The loop lag monitor feeds every measurement in here. Once the (smoothed) lag passes a threshold the bot goes into
+degraded mode, where it leaves out its cosmetic output - countdowns, flavor text, per-second timer announcements,
+dramatic pauses - and merges vote announcements, so what it does send is what players need to follow the game. It
+comes back out on its own once the lag has stayed low for a while.
+"""
+import collections
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+# Smoothed loop lag (in seconds) that puts the bot into degraded mode...
+DEGRADE_LAG = 0.25
+
+# ...and that it has to stay under for a while before the bot comes back out
+RECOVER_LAG = 0.05
+RECOVER_AFTER = 15.0
+
+# Weight of each new measurement in the smoothed lag
+SMOOTHING = 0.3
+
+
+class DegradedMode:
+    """Whether the bot's currently too busy for anything cosmetic"""
+
+    def __init__(self, degrade_lag=DEGRADE_LAG, recover_lag=RECOVER_LAG, recover_after=RECOVER_AFTER):
+        self.degrade_lag = degrade_lag
+        self.recover_lag = recover_lag
+        self.recover_after = recover_after
+        self.active = False
+        self.lag = 0.0
+        self.changed_at = None
+        self.calm_since = None
+        self.changes = 0
+        # Cosmetic output left out, by kind
+        self.skipped = collections.Counter()
+
+    def observe(self, lag, now=None):
+        """Takes a loop lag measurement, going into or out of degraded mode if it's time to"""
+        now = time.monotonic() if now is None else now
+        self.lag += SMOOTHING * (lag - self.lag)
+        if not self.active:
+            if self.lag >= self.degrade_lag:
+                log.warning("Event loop is %.0fms behind, going into degraded mode", self.lag * 1000)
+                self._set(True, now)
+            return
+        if self.lag >= self.recover_lag:
+            self.calm_since = None
+        elif self.calm_since is None:
+            self.calm_since = now
+        elif now - self.calm_since >= self.recover_after:
+            log.warning("Event loop has caught up, leaving degraded mode after %.0fs", now - self.changed_at)
+            self._set(False, now)
+
+    def skip(self, kind):
+        """Whether to leave out some cosmetic output right now (counting it if so)"""
+        if self.active:
+            self.skipped[kind] += 1
+        return self.active
+
+    def _set(self, active, now):
+        self.active = active
+        self.changed_at = now
+        self.calm_since = None
+        self.changes += 1
+
+
+degraded = DegradedMode()
@@ -0,0 +1,155 @@
+"""On-demand sampling profiler for the running bot
+
+While a profile is running, a background thread looks at what the event loop thread is doing every few milliseconds
+and counts each distinct call stack it sees; tracemalloc tracks allocations over the same period. Both are written
+out in the "collapsed stack" format (one `frame;frame;frame count` line per stack), which flamegraph.pl, speedscope
+and friends all read. When no profile is running, nothing here runs at all.
+"""
+import asyncio
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+log = logging.getLogger(__name__)
+
+# Seconds between stack samples
+SAMPLE_INTERVAL = 0.005
+
+# Frames of traceback tracemalloc keeps per allocation
+TRACEMALLOC_FRAMES = 25
+
+
+def frame_label(code):
+    name = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    # Semicolons separate frames in the collapsed format
+    return name.replace(";", ":")
+
+
+def trace_label(frame):
+    """The same, for a frame of a tracemalloc traceback (which only knows the line, not the function)"""
+    return f"{os.path.basename(frame.filename)}:{frame.lineno}".replace(";", ":")
+
+
+def channel_id_of(frame):
+    """The channel a frame is working on, if it's got a command context, message or outbox in hand"""
+    local_vars = frame.f_locals
+    for name in ("ctx", "msg", "self"):
+        channel = getattr(local_vars.get(name), "channel", None)
+        if channel is not None:
+            return getattr(channel, "id", None)
+    return None
+
+
+class Profile:
+    """The results of one profiling run"""
+
+    def __init__(self, started, channel_id=None):
+        self.started = started
+        self.channel_id = channel_id
+        self.duration = 0.0
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.snapshot = None
+
+    def top(self, n=5):
+        """The functions that were most often at the top of the stack, with their share of the samples"""
+        leaves = collections.Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        return [(label, count / total) for label, count in leaves.most_common(n)]
+
+    def write(self, directory):
+        """Writes the CPU and memory profiles to files, returning their paths"""
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started)))
+        if self.channel_id is not None:
+            base += f"-{self.channel_id}"
+        paths = [base + ".cpu.collapsed"]
+        with open(paths[0], "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        if self.snapshot is not None:
+            paths.append(base + ".memory.collapsed")
+            with open(paths[1], "w", encoding="utf-8") as f:
+                for stat in self.snapshot.statistics("traceback"):
+                    stack = ";".join(trace_label(frame) for frame in stat.traceback)
+                    f.write(f"{stack} {stat.size}\n")
+            # The raw snapshot too, for anything the collapsed stacks can't answer
+            paths.append(base + ".tracemalloc")
+            self.snapshot.dump(paths[2])
+        return paths
+
+
+class Profiler:
+    """Runs one profile at a time against the thread that called start()"""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.profile = None
+        self._stop = None
+        self._thread = None
+        self._started_tracemalloc = False
+
+    @property
+    def running(self):
+        return self.profile is not None
+
+    def start(self, channel_id=None, memory=True):
+        """Starts sampling the current thread, optionally only counting stacks working on one channel's game"""
+        if self.running:
+            raise RuntimeError("A profile is already running")
+        self.profile = Profile(time.time(), channel_id)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._sample, args=(threading.get_ident(), self.profile, self._stop), name="profiler", daemon=True
+        )
+        self._started_tracemalloc = memory and not tracemalloc.is_tracing()
+        if self._started_tracemalloc:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        self._thread.start()
+
+    def stop(self):
+        """Stops sampling and returns the finished Profile"""
+        profile = self.profile
+        self._stop.set()
+        self._thread.join()
+        if self._started_tracemalloc:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            profile.snapshot = snapshot.filter_traces(
+                [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+            )
+        profile.duration = time.time() - profile.started
+        self.profile = self._stop = self._thread = None
+        return profile
+
+    async def run(self, seconds, channel_id=None, directory="profiles"):
+        """Profiles the event loop for a while, then writes out the results; returns the Profile and file paths"""
+        self.start(channel_id)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile = self.stop()
+        paths = await asyncio.to_thread(profile.write, directory)
+        log.info("Wrote %d-sample profile to %s", profile.samples, ", ".join(paths))
+        return profile, paths
+
+    def _sample(self, thread_id, profile, stop):
+        channel_id = profile.channel_id
+        while not stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)  # pylint:disable=protected-access
+            stack = []
+            matched = channel_id is None
+            while frame is not None:
+                if not matched:
+                    matched = channel_id_of(frame) == channel_id
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            profile.samples += 1
+            if matched and stack:
+                profile.stacks[";".join(reversed(stack))] += 1
@@ -0,0 +1,112 @@
+"""Everything about the running bot that has to outlive a reload of its commands
+
+The commands and event rendering live in the gameplay extension, which can be swapped out while the bot's running.
+Anything it needs to hold on to across a reload - the bot and its gateway connection, the games, their timers, the
+journal and the live messages being kept up to date - lives here instead, since this module is only ever loaded once.
+"""
+import functools
+import os
+import socket
+
+import discord
+import yarl
+from discord.ext import commands
+from discord.gateway import DiscordWebSocket
+
+import mafia
+import metrics
+import shards
+from actors import mailboxes
+from archive import ARCHIVE_FILE, Archive
+from boards import LiveBoard
+from journal import Journal
+from outbox import Digest
+from profiler import Profiler
+from statestore import FileBackend, GameStore
+from timers import TimerScheduler
+from votefilter import VoteFilter
+
+CMD_PREFIX = "="
+
+DATA_DIR_VAR = "TOBAIFAM_DATA_DIR"
+
+# Where games are shared with the other nodes (if there are any), and this node's name there; nodes should keep the
+# same name across restarts, so they can pick their games straight back up
+STATE_DIR_VAR = "TOBAIFAM_STATE_DIR"
+NODE_VAR = "TOBAIFAM_NODE"
+
+# Base URL of a stand-in for Discord (like fakediscord.py) to connect to instead of the real thing
+DISCORD_URL_VAR = "TOBAIFAM_DISCORD_URL"
+
+# How long to wait for more votes before editing the live tally
+TALLY_DEBOUNCE = 0.5
+
+# How often batched votes get announced
+VOTE_BATCH_INTERVAL = 1.0
+
+# How long =profile (or a SIGUSR2) profiles for if not told otherwise
+DEFAULT_PROFILE_SECONDS = 30.0
+
+if DISCORD_URL_VAR in os.environ:
+    discord_url = yarl.URL(os.environ[DISCORD_URL_VAR])
+    discord.http.Route.BASE = str(discord_url / "api/v10")
+    # Sharded bots ask the REST API where the gateway is, but unsharded ones go straight to the default
+    DiscordWebSocket.DEFAULT_GATEWAY = (
+        discord_url.with_scheme("wss" if discord_url.scheme == "https" else "ws") / "gateway"
+    )
+
+# Every 429 Discord sends us, even the ones discord.py quietly retries
+rate_limits = metrics.RateLimitTracker()
+
+# Declare our bot and API intents (votes can come in through the vote menus, but every command is still a message)
+di = discord.Intents.default()
+di.message_content = True
+if shards.SHARD_COUNT_VAR in os.environ:
+    # Running as one of several workers under launcher.py, each handling its own share of the shards
+    bot = commands.AutoShardedBot(
+        command_prefix=CMD_PREFIX,
+        intents=di,
+        shard_count=int(os.environ[shards.SHARD_COUNT_VAR]),
+        shard_ids=shards.parse_ids(os.environ[shards.SHARD_IDS_VAR]),
+        http_trace=rate_limits.trace,
+    )
+else:
+    bot = commands.Bot(command_prefix=CMD_PREFIX, intents=di, http_trace=rate_limits.trace)
+
+#
+# Global state - every game the bot is running (keyed by guild and channel), their timers, the journal that lets them
+# survive a restart, the archive of games that have finished, and the store that shares them with other nodes
+#
+games = mafia.GameManager()
+timers = TimerScheduler()
+# Timers go off in their game's mailbox, after whatever commands got there first
+timers.submit = functools.partial(mailboxes.put, urgent=True)
+data_dir = os.environ.get(DATA_DIR_VAR, "data")
+archive = Archive(os.path.join(data_dir, ARCHIVE_FILE))
+journal = Journal(data_dir, on_end=archive.store)
+profiler = Profiler()
+store = None
+if STATE_DIR_VAR in os.environ:
+    store = GameStore(
+        FileBackend(os.environ[STATE_DIR_VAR]), os.environ.get(NODE_VAR) or f"{socket.gethostname()}:{os.getpid()}"
+    )
+vote_filter = VoteFilter(
+    (f"{CMD_PREFIX}vote", f"{CMD_PREFIX}abstain"),
+    f"You may only type `{CMD_PREFIX}vote [someone]` or `{CMD_PREFIX}abstain` at this time.",
+)
+
+# Live messages: each channel's signup roster and vote tally, and its batched vote announcements. What they show is
+# up to the gameplay extension, which hands them its render functions whenever it's loaded.
+roster_board = LiveBoard(None, pin=True)
+tally_board = LiveBoard(None, delay=TALLY_DEBOUNCE)
+vote_digest = Digest(None, VOTE_BATCH_INTERVAL)
+# channel id -> the messages holding its vote menus
+vote_menus = {}
+
+
+def get_game(ctx):
+    return games.get(ctx.channel)
+
+
+def profile_dir():
+    return os.path.join(journal.directory, "profiles")
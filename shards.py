@@ -0,0 +1,71 @@
+"""Splitting the bot's gateway shards between worker processes, and sharing each worker's status"""
+import json
+import os
+import time
+
+# Set by the launcher for each worker it runs
+SHARD_COUNT_VAR = "TOBAIFAM_SHARD_COUNT"
+SHARD_IDS_VAR = "TOBAIFAM_SHARD_IDS"
+WORKER_VAR = "TOBAIFAM_WORKER"
+
+# Each worker rewrites this file (in its data directory) this often
+STATUS_FILE = "status.json"
+STATUS_INTERVAL = 10.0
+
+# A status file that hasn't been touched in this long belongs to a worker that's stuck or gone
+STATUS_STALE_AFTER = 3 * STATUS_INTERVAL
+
+
+def shard_for(guild_id, shard_count):
+    """The shard Discord sends a guild's events to"""
+    return (guild_id >> 22) % shard_count
+
+
+def assign_shards(shard_count, workers):
+    """Deals shards out to workers round-robin, so each worker's shards are spread over every identify bucket"""
+    return [list(range(i, shard_count, workers)) for i in range(workers)]
+
+
+def format_ids(shard_ids):
+    return ",".join(map(str, shard_ids))
+
+
+def parse_ids(text):
+    return [int(s) for s in text.split(",") if s.strip()]
+
+
+def write_status(directory, status):
+    """Atomically replaces a worker's status file"""
+    path = os.path.join(directory, STATUS_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"updated": time.time(), **status}, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def read_status(directory):
+    """A worker's last reported status, or None if it hasn't written one (or it's unreadable)"""
+    try:
+        with open(os.path.join(directory, STATUS_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def aggregate(statuses):
+    """Adds up the status reports from every worker"""
+    now = time.time()
+    counters = ("guilds", "games", "timers", "sends", "rate_limited")
+    total = {"workers": len(statuses), "up": 0, "stale": 0, **dict.fromkeys(counters, 0), "phases": {}}
+    for status in statuses:
+        if status is None:
+            continue
+        if now - status["updated"] > STATUS_STALE_AFTER:
+            total["stale"] += 1
+            continue
+        total["up"] += 1
+        for field in counters:
+            total[field] += status[field]
+        for phase, count in status["phases"].items():
+            total["phases"][phase] = total["phases"].get(phase, 0) + count
+    return total
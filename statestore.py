@@ -0,0 +1,327 @@
+"""Game state shared between bot nodes, so a node can take over another's games if it goes down
+
+Each game's state is kept in a backend under a version number that goes up with every write, and a write only goes
+through if the writer had seen the latest version, so two nodes can never both think they're running a game. The
+node running a game keeps it cached locally, applies changes to it as they happen (in the same records the journal
+writes), and writes the changed games back in batches every so often. Every write also renews the node's lease on the
+game; once a lease runs out (say, because the node died), any node that can see the game's channel can take it over
+exactly where it left off, mid-phase, timer and all.
+
+There are two backends: MemoryBackend, which only shares games within one process (a stand-in for tests), and
+FileBackend, which shares them through a directory any number of processes (or machines, on a shared filesystem)
+can get at.
+"""
+import asyncio
+import copy
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+from journal import apply
+
+log = logging.getLogger(__name__)
+
+# How long a node's claim on a game lasts without it writing the game back
+LEASE_SECONDS = 30.0
+
+# How often changed games (and leases that are getting on) get written back
+FLUSH_INTERVAL = 0.5
+
+# Fields the store adds to each game's state as written to the backend
+OWNER_FIELDS = ("owner", "lease_until")
+
+
+class StateConflict(Exception):
+    """Someone else has written a game's state since it was last read"""
+
+
+class MemoryBackend:
+    """Keeps every game's state in this process, for tests (or running one node with no failover at all)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._games = {}
+
+    def load(self, key):
+        """A game's (version, state), or (0, None) if there's no such game"""
+        with self._lock:
+            version, state = self._games.get(key, (0, None))
+            return version, copy.deepcopy(state)
+
+    def scan(self):
+        """Every game's (version, state), by key"""
+        with self._lock:
+            return copy.deepcopy(self._games)
+
+    def save(self, writes):
+        """Writes a batch of (key, expected version, state or None to delete) at once
+
+        Returns each write's new version, or a StateConflict for any whose game had moved on from the version expected.
+        """
+        results = []
+        with self._lock:
+            for key, version, state in writes:
+                current = self._games.get(key, (0, None))[0]
+                if current != version:
+                    results.append(StateConflict(key, current))
+                elif state is None:
+                    self._games.pop(key, None)
+                    results.append(0)
+                else:
+                    self._games[key] = (version + 1, copy.deepcopy(state))
+                    results.append(version + 1)
+        return results
+
+
+class FileBackend:
+    """Keeps each game's state in a JSON file of its own, with a lock file guarding every read-check-write"""
+
+    LOCK_FILE = "store.lock"
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock_path = os.path.join(directory, self.LOCK_FILE)
+
+    def path(self, key):
+        guild_id, channel_id = key
+        return os.path.join(self.directory, f"{guild_id}-{channel_id}.json")
+
+    def _read(self, path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return 0, None
+        return data["version"], data["state"]
+
+    def _locked(self, exclusive):
+        f = open(self._lock_path, "a", encoding="utf-8")  # pylint:disable=consider-using-with
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        return f
+
+    def load(self, key):
+        with self._locked(False):
+            return self._read(self.path(key))
+
+    def scan(self):
+        games = {}
+        with self._locked(False):
+            for name in os.listdir(self.directory):
+                if not name.endswith(".json"):
+                    continue
+                guild_id, channel_id = name[: -len(".json")].split("-")
+                key = (None if guild_id == "None" else int(guild_id), int(channel_id))
+                games[key] = self._read(os.path.join(self.directory, name))
+        return games
+
+    def save(self, writes):
+        results = []
+        # The whole batch goes in under one lock, which is most of the point of batching
+        with self._locked(True):
+            for key, version, state in writes:
+                path = self.path(key)
+                current = self._read(path)[0]
+                if current != version:
+                    results.append(StateConflict(key, current))
+                elif state is None:
+                    if version:
+                        os.remove(path)
+                    results.append(0)
+                else:
+                    tmp_path = path + ".tmp"
+                    with open(tmp_path, "w", encoding="utf-8") as f:
+                        json.dump({"version": version + 1, "state": state}, f, separators=(",", ":"))
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(tmp_path, path)
+                    results.append(version + 1)
+        return results
+
+
+class GameStore:
+    """One node's view of the shared game state: the games it's running, cached, and written back in batches
+
+    record() takes the same (key, op, **fields) changes as Journal.record, so it can hang off GameManager.on_change
+    in just the same way. If a write-back finds another node has taken one of our games over, the game's dropped
+    from the cache and on_lost gets called with its key, so the node can stop running it.
+    """
+
+    def __init__(self, backend, node, lease=LEASE_SECONDS, flush_interval=FLUSH_INTERVAL):
+        self.backend = backend
+        self.node = node
+        self.lease = lease
+        self.flush_interval = flush_interval
+        # key -> game state, and the version it was last written (or read) at; None if it's never been written
+        self.states = {}
+        self.versions = {}
+        self.dirty = set()
+        self.renewed = {}
+        self.on_lost = None
+        # Stats
+        self.flushes = 0
+        self.writes = 0
+        self.conflicts = 0
+        self._task = None
+
+    def __len__(self):
+        return len(self.states)
+
+    def record(self, key, op, **fields):
+        """Applies a change to one of our games, to be written back with the next flush"""
+        if key not in self.states and op not in ("host", "restore"):
+            # Not ours (any more)
+            return
+        apply(self.states, {"game": list(key), "op": op, "at": time.time(), **fields})
+        self.versions.setdefault(key, None)
+        self.dirty.add(key)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """Writes back everything that's changed, then gives up our leases so other nodes can take over right away"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self._task = None
+        await self.flush(release=True)
+
+    async def orphans(self):
+        """Keys of the games nobody's running: their nodes have let their leases run out (or they were ours once)"""
+        games = await asyncio.to_thread(self.backend.scan)
+        return [
+            key
+            for key, (_version, state) in games.items()
+            if key not in self.states and not self._claimed_elsewhere(state)
+        ]
+
+    async def take_over(self, key, force=False):
+        """Claims a game from whichever node had it, returning its state, or None if it's gone or still claimed
+
+        Unless forced, a game whose node still holds a lease on it stays put.
+        """
+        version, state = await asyncio.to_thread(self.backend.load, key)
+        if state is None or not force and self._claimed_elsewhere(state):
+            return None
+        return await self._claim(key, version, state)
+
+    async def claim(self, key, saved):
+        """Picks a game this node had before it restarted back up, returning the state to carry on from
+
+        That's the shared state if there is any (which is never behind our own), or the saved state if the game
+        hadn't made it to the store yet; None means another node has taken the game over in the meantime.
+        """
+        version, state = await asyncio.to_thread(self.backend.load, key)
+        if state is None:
+            self.record(key, "restore", state=saved)
+            return saved
+        if self._claimed_elsewhere(state):
+            return None
+        return await self._claim(key, version, state)
+
+    async def release(self, key, state=None):
+        """Gives up our claim on a game right away, leaving it as it was (or as given) for another node to take over"""
+        if state is None:
+            state = self.states.get(key)
+        version = self.versions.get(key)
+        self._forget(key)
+        if state is None or version is None:
+            return
+        (result,) = await asyncio.to_thread(self.backend.save, [(key, version, self._stamped(state, 0.0))])
+        if isinstance(result, StateConflict):
+            log.info("Game %s had already been taken over when we let it go", key)
+
+    def _claimed_elsewhere(self, state):
+        return state["owner"] != self.node and state["lease_until"] >= time.time()
+
+    async def _claim(self, key, version, state):
+        previous_owner = state["owner"]
+        for field in OWNER_FIELDS:
+            del state[field]
+        (result,) = await asyncio.to_thread(self.backend.save, [(key, version, self._stamped(state))])
+        if isinstance(result, StateConflict):
+            log.info("Lost the race to take over game %s", key)
+            return None
+        self.states[key] = state
+        self.versions[key] = result
+        self.renewed[key] = time.monotonic()
+        if previous_owner != self.node:
+            log.info("Took over game %s from %s", key, previous_owner)
+        return copy.deepcopy(state)
+
+    async def flush(self, release=False):
+        """Writes back every game that's changed, and renews the leases that need it"""
+        now = time.monotonic()
+        keys = set(self.dirty)
+        keys.update(k for k, at in self.renewed.items() if release or now - at >= self.lease / 2)
+        if not keys:
+            return
+        self.dirty.clear()
+        until = 0.0 if release else time.time() + self.lease
+        writes = [
+            (key, self.versions.get(key), self._stamped(self.states[key], until) if key in self.states else None)
+            for key in keys
+        ]
+        try:
+            results = await asyncio.to_thread(self._write, writes)
+        except BaseException:
+            # Try them all again next time
+            self.dirty.update(k for k in keys if k in self.states or k in self.versions)
+            raise
+        self.flushes += 1
+        for (key, _version, state), result in zip(writes, results):
+            if isinstance(result, StateConflict):
+                self.conflicts += 1
+                log.warning("Game %s was taken over by another node", key)
+                self._forget(key)
+                if self.on_lost is not None:
+                    self.on_lost(key)
+            elif state is None:
+                if key in self.states:
+                    # Hosted again while the old game was being deleted
+                    self.versions[key] = result
+                else:
+                    self._forget(key)
+            else:
+                self.writes += 1
+                # The game may have ended while this was being written, but its deletion still needs the new version
+                if key in self.versions:
+                    self.versions[key] = result
+                if key in self.states:
+                    self.renewed[key] = now
+
+    def _stamped(self, state, until=None):
+        # A copy of the state to write, safe to hand to another thread
+        if until is None:
+            until = time.time() + self.lease
+        return dict(copy.deepcopy(state), owner=self.node, lease_until=until)
+
+    def _write(self, writes):
+        # Games we've never written start from whatever's there already, as long as no other node has a claim on it
+        resolved = []
+        for key, version, state in writes:
+            if version is None:
+                version, existing = self.backend.load(key)
+                if existing is not None and self._claimed_elsewhere(existing):
+                    # No version is ever -1, so this is bound to come back as a conflict
+                    version = -1
+            resolved.append((key, version, state))
+        return self.backend.save(resolved)
+
+    def _forget(self, key):
+        self.states.pop(key, None)
+        self.versions.pop(key, None)
+        self.renewed.pop(key, None)
+        self.dirty.discard(key)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:  # pylint:disable=broad-except
+                log.exception("Couldn't write back game state")
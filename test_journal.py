@@ -0,0 +1,85 @@
+"""Tests for recovering games from the journal"""
+import tempfile
+import time
+import unittest
+
+import mafia
+from journal import Journal
+from mafia import Abstain, CallVote, Start, StartDay, StartNight, Vote
+
+HOST = 100
+PLAYERS = [1, 2, 3, 4, 5]
+
+
+class FakeGuild:
+    id = 10
+
+
+class FakeChannel:
+    guild = FakeGuild()
+    id = 20
+
+
+class JournalTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()  # pylint:disable=consider-using-with
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def play(self, journal):
+        """Plays part of a game with every change journalled, returning the game"""
+        games = mafia.GameManager()
+        games.on_change = journal.record
+        game = games.create(FakeChannel, "Test game", HOST, "Host")
+        for uid in PLAYERS:
+            game.add_player(uid, f"Player {uid}", f"player{uid}")
+        game.handle_all([Start(), StartDay(), CallVote(), Vote(1, 3), Vote(2, 3), Vote(4, 3)])
+        game.handle_all([StartNight(), StartDay(), CallVote(), Vote(1, Abstain)])
+        return game
+
+    def assert_recovered(self, state, game):
+        self.assertEqual(list(state), [game.key])
+        saved = state[game.key]
+        self.assertEqual((saved["name"], saved["host"], saved["host_name"]), ("Test game", HOST, "Host"))
+        self.assertTrue(saved["active"])
+        self.assertEqual((saved["phase"], saved["day"]), ("VOTE", 2))
+        self.assertEqual([int(uid) for uid in saved["players"]], PLAYERS)
+        self.assertEqual(saved["players"]["4"], ["Player 4", "player4"])
+        self.assertEqual(saved["dead"], [3])
+        self.assertEqual(saved["votes"], {"1": "abstain"})
+
+    def test_round_trip_through_snapshot(self):
+        journal = Journal(self.directory, commit_interval=0)
+        journal.recover()
+        journal.start()
+        game = self.play(journal)
+        journal.close()
+        self.assert_recovered(Journal(self.directory).recover(), game)
+
+    def test_round_trip_through_log_after_crash(self):
+        journal = Journal(self.directory, commit_interval=0)
+        journal.recover()
+        journal.start()
+        self.addCleanup(journal.close)
+        game = self.play(journal)
+        # Wait for the records to be on disk, but don't let the journal shut down cleanly (and snapshot)
+        deadline = time.monotonic() + 5
+        while not journal.queue.empty() or journal.seq < 20:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        self.assert_recovered(Journal(self.directory).recover(), game)
+
+    def test_cancelled_game_is_gone(self):
+        journal = Journal(self.directory, commit_interval=0)
+        journal.recover()
+        journal.start()
+        games = mafia.GameManager()
+        games.on_change = journal.record
+        games.create(FakeChannel, "Test game", HOST, "Host")
+        games.remove(FakeChannel)
+        journal.close()
+        self.assertEqual(Journal(self.directory).recover(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,222 @@
+"""Tests for the game state machine"""
+import unittest
+
+import mafia
+from mafia import (
+    Abstain,
+    Advance,
+    CallVote,
+    DayContinued,
+    DayStarted,
+    Eliminated,
+    End,
+    GameEnded,
+    GameStarted,
+    Kill,
+    MajorityReached,
+    NightResumed,
+    NightStarted,
+    NoDecision,
+    NoElimination,
+    Rejected,
+    Start,
+    StartDay,
+    StartNight,
+    TimerStopped,
+    TwilightStarted,
+    Vote,
+    VoteCast,
+    VoteResults,
+    VotingReopened,
+    VotingStarted,
+)
+
+HOST = 100
+PLAYERS = [1, 2, 3, 4, 5]
+
+
+def new_game(players=PLAYERS):
+    game = mafia.Game("Test game", HOST, "Host")
+    for uid in players:
+        game.add_player(uid, f"Player {uid}", f"player{uid}")
+    return game
+
+
+def kinds(events):
+    return [type(event) for event in events]
+
+
+class GameTests(unittest.TestCase):
+    def setUp(self):
+        self.game = new_game()
+
+    def voting(self):
+        """Gets the game to the voting phase of day 1"""
+        self.game.start()
+        self.game.start_day()
+        self.game.call_vote()
+
+    def test_start(self):
+        events = self.game.start()
+        self.assertEqual(kinds(events), [GameStarted, TimerStopped, NightStarted])
+        self.assertEqual(events[0].players, PLAYERS)
+        self.assertTrue(self.game.active)
+        self.assertEqual(self.game.phase, self.game.Phase.NIGHT)
+        self.assertEqual(self.game.day, 0)
+
+    def test_majority_eliminates(self):
+        self.voting()
+        self.game.vote(1, 3)
+        self.game.vote(2, 3)
+        events = self.game.vote(4, 3)
+        self.assertEqual(
+            kinds(events),
+            [VoteCast, MajorityReached, TimerStopped, VoteResults, Eliminated, TwilightStarted],
+        )
+        self.assertEqual(events[0], VoteCast(4, 3, 3, 3))
+        results = events[3]
+        self.assertEqual((results.alive, results.majority), (5, 3))
+        self.assertEqual(results.tally, [(3, [1, 2, 4])])
+        self.assertEqual(events[4], Eliminated(3))
+        self.assertEqual(self.game.phase, self.game.Phase.TWILIGHT)
+        self.assertEqual(self.game.players, [1, 2, 4, 5])
+        self.assertEqual(self.game.dead_players, [3])
+
+    def test_changed_vote_moves_the_tally(self):
+        self.voting()
+        self.game.vote(1, 3)
+        self.game.vote(2, 3)
+        self.assertEqual(self.game.vote(2, 4)[0].count, 1)
+        self.assertEqual(self.game.total_votes(), 2)
+        groups, not_voted = self.game.vote_groups()
+        self.assertEqual(groups, [(3, [1]), (4, [2])])
+        self.assertEqual(not_voted, [3, 4, 5])
+
+    def test_everyone_voted_without_a_majority(self):
+        self.voting()
+        for voter, target in [(1, 2), (2, 3), (3, 4), (4, 5)]:
+            self.assertEqual(kinds(self.game.vote(voter, target)), [VoteCast])
+        events = self.game.vote(5, 1)
+        self.assertEqual(
+            kinds(events), [VoteCast, NoDecision, TimerStopped, VoteResults, NoElimination, TwilightStarted]
+        )
+        self.assertEqual(self.game.phase, self.game.Phase.TWILIGHT)
+        self.assertEqual(self.game.dead_players, [])
+
+    def test_abstain_majority(self):
+        self.voting()
+        self.game.vote(1, Abstain)
+        self.game.vote(2, Abstain)
+        self.game.vote(3, 4)
+        events = self.game.vote(4, Abstain)
+        self.assertEqual(events[1], MajorityReached(Abstain))
+        self.assertIn(NoElimination(), events)
+        self.assertEqual(events[3].tally, [(4, [3]), (Abstain, [1, 2, 4])])
+        self.assertEqual(self.game.dead_players, [])
+
+    def test_reopen_vote_from_twilight(self):
+        self.voting()
+        for voter, target in [(1, 2), (2, 3), (3, 4), (4, 5), (5, 1)]:
+            self.game.vote(voter, target)
+        events = self.game.call_vote()
+        self.assertEqual(kinds(events), [VotingReopened, TimerStopped])
+        self.assertEqual(self.game.phase, self.game.Phase.VOTE)
+        # The votes from before carry on where they were
+        self.assertEqual(self.game.total_votes(), 5)
+        self.game.vote(1, 3)
+        events = self.game.vote(4, 3)
+        self.assertIn(Eliminated(3), events)
+
+    def test_new_vote_starts_with_a_fresh_ballot(self):
+        self.voting()
+        self.game.vote(1, 3)
+        self.game.resolve_votes()
+        self.game.start_night()
+        self.game.start_day()
+        self.assertEqual(kinds(self.game.call_vote()), [TimerStopped, VotingStarted])
+        self.assertEqual(self.game.total_votes(), 0)
+
+    def test_day_back_to_night(self):
+        self.game.start()
+        self.game.start_day()
+        self.assertEqual(self.game.day, 1)
+        events = self.game.start_night()
+        self.assertEqual(events, [TimerStopped(), NightResumed(0)])
+        self.assertEqual(self.game.phase, self.game.Phase.NIGHT)
+        self.assertEqual(self.game.day, 0)
+
+    def test_vote_back_to_day(self):
+        self.voting()
+        self.assertEqual(self.game.start_day(timed=True), [TimerStopped(), DayContinued(1, True)])
+        self.assertEqual(self.game.phase, self.game.Phase.DAY)
+
+    def test_advance_from_each_phase(self):
+        game = self.game
+        game.start()
+        self.assertEqual(game.advance(), [TimerStopped(), DayStarted(1, PLAYERS, False)])
+        self.assertEqual(game.phase, game.Phase.DAY)
+        self.assertEqual(game.advance(), [TimerStopped(), VotingStarted()])
+        self.assertEqual(game.phase, game.Phase.VOTE)
+        self.assertEqual(kinds(game.advance()), [TimerStopped, VoteResults, NoElimination, TwilightStarted])
+        self.assertEqual(game.phase, game.Phase.TWILIGHT)
+        self.assertEqual(game.advance(), [TimerStopped(), NightStarted(1)])
+        self.assertEqual(game.phase, game.Phase.NIGHT)
+        game.end()
+        self.assertEqual(game.advance(), [])
+
+    def test_rejected_transitions(self):
+        self.game.start()
+        self.assertEqual(kinds(self.game.call_vote()), [Rejected])
+        self.assertEqual(kinds(self.game.start_night()), [Rejected])
+        self.game.start_day()
+        self.game.call_vote()
+        self.assertEqual(kinds(self.game.call_vote()), [Rejected])
+        self.assertEqual(kinds(self.game.start_night()), [Rejected])
+        self.assertEqual(self.game.phase, self.game.Phase.VOTE)
+
+    def test_end(self):
+        self.voting()
+        self.game.vote(1, 3)
+        self.game.vote(2, 3)
+        self.game.vote(4, 3)
+        self.assertEqual(self.game.end(), [TimerStopped(), GameEnded(1, [1, 2, 4, 5], [3])])
+        self.assertIsNone(self.game.phase)
+        self.assertEqual(kinds(self.game.end()), [Rejected])
+
+    def test_handle_all(self):
+        events = self.game.handle_all(
+            [
+                Start(),
+                Advance(),
+                CallVote(),
+                Vote(1, 3),
+                Vote(2, 3),
+                Vote(4, 3),
+                StartNight(),
+                StartDay(timed=True),
+                Kill(5),
+                End(),
+            ]
+        )
+        self.assertEqual(
+            kinds(events),
+            [GameStarted, TimerStopped, NightStarted]
+            + [TimerStopped, DayStarted]
+            + [TimerStopped, VotingStarted]
+            + [VoteCast, VoteCast, VoteCast, MajorityReached, TimerStopped, VoteResults, Eliminated, TwilightStarted]
+            + [TimerStopped, NightStarted]
+            + [TimerStopped, DayStarted]
+            + [Eliminated]
+            + [TimerStopped, GameEnded],
+        )
+        self.assertEqual(events[-1], GameEnded(2, [1, 2, 4], [3, 5]))
+        self.assertIn(DayStarted(2, [1, 2, 4, 5], True), events)
+
+    def test_find_user(self):
+        self.assertEqual(self.game.find_user("player 4", []), 4)
+        with self.assertRaises(ValueError):
+            self.game.find_user("player", [])
+
+
+if __name__ == "__main__":
+    unittest.main()
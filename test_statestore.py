@@ -0,0 +1,237 @@
+"""Tests for the shared game state store, against both backends"""
+import asyncio
+import copy
+import tempfile
+import threading
+import unittest
+
+from statestore import FileBackend, GameStore, MemoryBackend
+
+KEY = (1, 2)
+
+# Short enough for leases to run out during a test
+LEASE = 0.2
+
+
+class SlowBackend(MemoryBackend):
+    """Holds up each save until told to carry on, so things can happen while a write-back is under way"""
+
+    def __init__(self):
+        super().__init__()
+        self.saving = threading.Event()
+        self.proceed = threading.Event()
+
+    def save(self, writes):
+        self.saving.set()
+        self.proceed.wait(5)
+        return super().save(writes)
+
+
+def host(store, key=KEY):
+    """Records a game getting as far as its first vote"""
+    store.record(key, "host", name="Test game", host=10, host_name="Host")
+    for uid in (11, 12, 13):
+        store.record(key, "join", user=uid, name=f"Player {uid}", tag=f"player{uid}")
+    store.record(key, "start")
+    store.record(key, "phase", phase="VOTE", day=1)
+    store.record(key, "vote", voter=11, target=12)
+
+
+class StoreTests:
+    """Tests run against each backend (mixed into a TestCase that sets up self.backend)"""
+
+    def store(self, node, lease=LEASE):
+        return GameStore(self.backend, node, lease=lease)
+
+    async def test_flush_writes_changed_games(self):
+        a = self.store("a")
+        host(a)
+        await a.flush()
+        version, state = self.backend.load(KEY)
+        self.assertEqual(version, 1)
+        self.assertEqual(state["owner"], "a")
+        self.assertEqual(state["votes"], {"11": 12})
+        self.assertEqual(a.versions[KEY], 1)
+        # Nothing's changed since, so there's nothing to write
+        await a.flush()
+        self.assertEqual(self.backend.load(KEY)[0], 1)
+
+    async def test_stale_write_conflicts_and_loses_the_game(self):
+        a, b = self.store("a"), self.store("b")
+        lost = []
+        a.on_lost = lost.append
+        host(a)
+        await a.flush()
+        state = await b.take_over(KEY, force=True)
+        self.assertEqual(state["votes"], {"11": 12})
+        a.record(KEY, "vote", voter=12, target=11)
+        await a.flush()
+        self.assertEqual(lost, [KEY])
+        self.assertEqual(a.conflicts, 1)
+        self.assertNotIn(KEY, a.states)
+        # b's copy is the one that counts
+        _version, state = self.backend.load(KEY)
+        self.assertEqual(state["owner"], "b")
+        self.assertEqual(state["votes"], {"11": 12})
+
+    async def test_lease_keeps_other_nodes_off(self):
+        a, b = self.store("a"), self.store("b")
+        host(a)
+        await a.flush()
+        self.assertEqual(await b.orphans(), [])
+        self.assertIsNone(await b.take_over(KEY))
+        self.assertNotIn(KEY, b.states)
+
+    async def test_take_over_mid_phase_once_lease_runs_out(self):
+        a, b = self.store("a"), self.store("b")
+        host(a)
+        a.record(KEY, "timer", timer={"deadline": 1234.5})
+        await a.flush()
+        await asyncio.sleep(LEASE * 1.5)
+        self.assertEqual(await b.orphans(), [KEY])
+        state = await b.take_over(KEY)
+        self.assertEqual(state["phase"], "VOTE")
+        self.assertEqual(state["votes"], {"11": 12})
+        self.assertEqual(state["timer"], {"deadline": 1234.5})
+        self.assertNotIn("owner", state)
+        self.assertEqual(self.backend.load(KEY)[1]["owner"], "b")
+        self.assertEqual(await a.orphans(), [])
+
+    async def test_renewal_keeps_the_lease(self):
+        a, b = self.store("a"), self.store("b")
+        host(a)
+        await a.flush()
+        for _ in range(3):
+            await asyncio.sleep(LEASE * 0.6)
+            await a.flush()
+        self.assertIsNone(await b.take_over(KEY))
+
+    async def test_close_releases_leases(self):
+        a, b = self.store("a", lease=60), self.store("b")
+        host(a)
+        await a.flush()
+        await a.close()
+        self.assertEqual(await b.orphans(), [KEY])
+        self.assertIsNotNone(await b.take_over(KEY))
+
+    async def test_claim_after_restart(self):
+        a = self.store("a")
+        host(a)
+        await a.flush()
+        saved = a.states[KEY]
+        a.record(KEY, "clear_votes")
+        await a.flush()
+        # The same node, restarted with an older saved state, carries on from the shared one
+        restarted = self.store("a")
+        state = await restarted.claim(KEY, saved)
+        self.assertEqual(state["votes"], {})
+        self.assertEqual(restarted.versions[KEY], 3)
+
+    async def test_claim_game_the_store_never_saw(self):
+        a = self.store("a")
+        host(a)
+        saved = a.states[KEY]
+        restarted = self.store("a")
+        self.assertEqual(await restarted.claim(KEY, saved), saved)
+        await restarted.flush()
+        self.assertEqual(self.backend.load(KEY)[1]["votes"], {"11": 12})
+
+    async def test_claim_game_taken_over_while_down(self):
+        a, b = self.store("a", lease=60), self.store("b")
+        host(a)
+        await a.flush()
+        saved = a.states[KEY]
+        await a.close()
+        await b.take_over(KEY)
+        self.assertIsNone(await self.store("a").claim(KEY, saved))
+
+    async def test_end_deletes_the_game(self):
+        a, b = self.store("a"), self.store("b")
+        host(a)
+        await a.flush()
+        a.record(KEY, "end")
+        await a.flush()
+        self.assertEqual(self.backend.load(KEY), (0, None))
+        self.assertEqual(a.conflicts, 0)
+        self.assertNotIn(KEY, a.versions)
+        self.assertEqual(await b.orphans(), [])
+
+    async def test_host_again_after_end(self):
+        a = self.store("a")
+        host(a)
+        await a.flush()
+        a.record(KEY, "end")
+        host(a)
+        await a.flush()
+        version, state = self.backend.load(KEY)
+        self.assertEqual(state["owner"], "a")
+        self.assertEqual(a.versions[KEY], version)
+        self.assertEqual(a.conflicts, 0)
+
+    async def test_never_written_game_conflicts_with_a_claimed_one(self):
+        a, b = self.store("a"), self.store("b")
+        lost = []
+        b.on_lost = lost.append
+        host(a)
+        await a.flush()
+        host(b)
+        await b.flush()
+        self.assertEqual(lost, [KEY])
+        self.assertEqual(self.backend.load(KEY)[1]["owner"], "a")
+
+    async def test_release(self):
+        a, b = self.store("a", lease=60), self.store("b")
+        host(a)
+        await a.flush()
+        original = copy.deepcopy(a.states[KEY])
+        a.record(KEY, "clear_votes")
+        await a.release(KEY, original)
+        self.assertNotIn(KEY, a.states)
+        self.assertEqual(await b.orphans(), [KEY])
+        self.assertEqual((await b.take_over(KEY))["votes"], {"11": 12})
+
+
+class MemoryBackendTests(StoreTests, unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.backend = MemoryBackend()
+
+
+class FileBackendTests(StoreTests, unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()  # pylint:disable=consider-using-with
+        self.addCleanup(directory.cleanup)
+        self.backend = FileBackend(directory.name)
+
+    async def test_games_survive_a_new_backend(self):
+        a = self.store("a", lease=60)
+        host(a)
+        await a.flush()
+        await a.close()
+        b = GameStore(FileBackend(self.backend.directory), "b")
+        self.assertEqual(await b.orphans(), [KEY])
+
+
+class WriteBackRaceTests(unittest.IsolatedAsyncioTestCase):
+    async def test_game_ends_during_write_back(self):
+        backend = SlowBackend()
+        a, b = GameStore(backend, "a", lease=LEASE), GameStore(backend, "b", lease=LEASE)
+        host(a)
+        backend.proceed.set()
+        await a.flush()
+        backend.saving.clear()
+        backend.proceed.clear()
+        a.record(KEY, "clear_votes")
+        flush = asyncio.create_task(a.flush())
+        await asyncio.to_thread(backend.saving.wait, 5)
+        a.record(KEY, "end")
+        backend.proceed.set()
+        await flush
+        await a.flush()
+        self.assertEqual(a.conflicts, 0)
+        self.assertEqual(backend.load(KEY), (0, None))
+        await asyncio.sleep(LEASE * 1.5)
+        self.assertEqual(await b.orphans(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
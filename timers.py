@@ -0,0 +1,202 @@
+"""Deadline-based phase timers, shared by every game the bot is running"""
+import asyncio
+import functools
+import heapq
+import itertools
+import logging
+
+log = logging.getLogger(__name__)
+
+# Seconds remaining at which a running timer announces itself (on top of every two minutes)
+ANNOUNCE_MARKS = (60, 30, 15, 10, 5, 4, 3, 2, 1)
+
+
+def next_mark(remaining):
+    """The next number of seconds remaining (strictly below the given amount) worth announcing, or 0 at the end"""
+    marks = [m for m in ANNOUNCE_MARKS if m < remaining]
+    two_minute_mark = (int(-(-remaining // 1)) - 1) // 120 * 120
+    return max(marks + [two_minute_mark, 0])
+
+
+class Timer:
+    """A countdown for a single game"""
+
+    def __init__(self, key, length, on_announce, on_expire, on_cancel):
+        self.key = key
+        self.length = length
+        self.on_announce = on_announce
+        self.on_expire = on_expire
+        self.on_cancel = on_cancel
+        self.deadline = None
+        self.paused_remaining = None
+        self.mark = None
+        # Bumped whenever the timer is rescheduled, so stale heap entries know to ignore themselves
+        self.generation = 0
+
+    @property
+    def paused(self):
+        return self.paused_remaining is not None
+
+
+class TimerScheduler:
+    """Keeps every game's timer in a single heap of absolute deadlines
+
+    Nothing runs between announcements: the scheduler only ever has one callback armed on the event loop, for
+    whichever deadline comes up next.
+    """
+
+    def __init__(self):
+        self.timers = {}
+        self.heap = []
+        self.lateness = 0.0
+        # Called with (key, Timer) whenever a timer is set, paused, resumed or extended, and (key, None) when it stops
+        self.on_change = None
+        # Called with the number of seconds late each announcement or expiry went off
+        self.on_lateness = None
+        # Called with (key, job) to run a timer's callback (as a coroutine function) instead of giving it its own task
+        self.submit = None
+        self._seq = itertools.count()
+        self._loop = None
+        self._handle = None
+        self._handle_when = None
+        self._tasks = set()
+
+    def __len__(self):
+        return len(self.timers)
+
+    @property
+    def loop(self):
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        return self._loop
+
+    def now(self):
+        return self.loop.time()
+
+    def start(self, key, length, on_announce, on_expire, on_cancel=None):
+        """Starts (or restarts) a game's timer
+
+        on_announce is awaited with the number of seconds left at each announcement point, on_expire when time
+        runs out, and on_cancel if the timer gets stopped early.
+        """
+        self.cancel(key)
+        t = Timer(key, length, on_announce, on_expire, on_cancel)
+        self.timers[key] = t
+        self._schedule(t, self.now() + length, length)
+        self._changed(key, t)
+        return t
+
+    def get(self, key):
+        return self.timers.get(key)
+
+    def remaining(self, key):
+        """Seconds left on a game's timer, or None if it doesn't have one running"""
+        t = self.timers.get(key)
+        if t is None:
+            return None
+        if t.paused:
+            return t.paused_remaining
+        return max(t.deadline - self.now(), 0.0)
+
+    def cancel(self, key):
+        """Stops a game's timer without letting it expire; returns whether there was one"""
+        t = self.timers.pop(key, None)
+        if t is None:
+            return False
+        t.generation += 1
+        self._changed(key, None)
+        if t.on_cancel is not None:
+            self._fire(key, t.on_cancel)
+        return True
+
+    def pause(self, key):
+        """Freezes a game's timer, returning the time it had left"""
+        t = self.timers.get(key)
+        if t is None or t.paused:
+            return None
+        t.paused_remaining = max(t.deadline - self.now(), 0.0)
+        t.generation += 1
+        self._changed(key, t)
+        return t.paused_remaining
+
+    def resume(self, key):
+        """Starts a paused timer counting down again, returning the time it has left"""
+        t = self.timers.get(key)
+        if t is None or not t.paused:
+            return None
+        remaining, t.paused_remaining = t.paused_remaining, None
+        self._schedule(t, self.now() + remaining, remaining)
+        self._changed(key, t)
+        return remaining
+
+    def extend(self, key, seconds):
+        """Adds (or with a negative amount, takes away) time from a game's timer, returning the new time left"""
+        t = self.timers.get(key)
+        if t is None:
+            return None
+        if t.paused:
+            t.paused_remaining = max(t.paused_remaining + seconds, 0.0)
+            self._changed(key, t)
+            return t.paused_remaining
+        remaining = max(t.deadline - self.now() + seconds, 0.0)
+        self._schedule(t, self.now() + remaining, remaining)
+        self._changed(key, t)
+        return remaining
+
+    def _changed(self, key, t):
+        if self.on_change is not None:
+            self.on_change(key, t)
+
+    def _schedule(self, t, deadline, remaining):
+        t.generation += 1
+        t.deadline = deadline
+        t.mark = next_mark(remaining) if remaining > 0 else 0
+        heapq.heappush(self.heap, (deadline - t.mark, next(self._seq), t, t.generation))
+        self._arm()
+
+    def _arm(self):
+        # Throw away anything that's been cancelled or rescheduled since it was pushed
+        while self.heap and self.heap[0][3] != self.heap[0][2].generation:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return
+        when = self.heap[0][0]
+        if self._handle is not None:
+            if self._handle_when <= when:
+                return
+            self._handle.cancel()
+        self._handle = self.loop.call_at(when, self._run)
+        self._handle_when = when
+
+    def _run(self):
+        self._handle = None
+        now = self.now()
+        while self.heap and self.heap[0][0] <= now:
+            when, _, t, generation = heapq.heappop(self.heap)
+            if generation != t.generation:
+                continue
+            self.lateness = now - when
+            if self.on_lateness is not None:
+                self.on_lateness(self.lateness)
+            if t.mark == 0:
+                del self.timers[t.key]
+                self._changed(t.key, None)
+                self._fire(t.key, t.on_expire)
+            else:
+                self._fire(t.key, functools.partial(t.on_announce, t.mark))
+                t.mark = next_mark(t.mark)
+                heapq.heappush(self.heap, (t.deadline - t.mark, next(self._seq), t, t.generation))
+        self._arm()
+
+    def _fire(self, key, callback):
+        if self.submit is not None:
+            self.submit(key, callback)
+            return
+        task = self.loop.create_task(callback())
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.error("Timer callback failed", exc_info=task.exception())
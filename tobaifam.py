@@ -2,642 +2,418 @@
 # pylint:disable=missing-function-docstring
 import asyncio
 import functools
+import importlib
+import logging
 import os
-import random
-import re
+import signal
+import time
 
-import discord
 from discord.ext import commands
 
-import mafia
+import guards
 import messages
-from mafia import Abstain, Alarm
-from messages import system_message, yell_at_user
-
-CMD_PREFIX = "="
+import metrics
+import shards
+from actors import BUSY_MESSAGE, mailboxes, serialized
+from guards import require_operator
+from outbox import outboxes, send
+from overload import degraded
+from runtime import (
+    DEFAULT_PROFILE_SECONDS,
+    bot,
+    games,
+    archive,
+    journal,
+    profile_dir,
+    profiler,
+    rate_limits,
+    store,
+    timers,
+    vote_filter,
+)
 
 DISCORD_API_TOKEN_VAR = "ACCESS_TOKEN"
 
-# Declare our bot and API intents
-# TODO: drive TWILIGHT vote via menu/reactions to avoid needing message_content
-di = discord.Intents.default()
-di.message_content = True
-bot = commands.Bot(command_prefix=CMD_PREFIX, intents=di)
-
-#
-# Global state - TODO: move into an object when we make this reentrant
-#
-game = None
-game_active = False
-hosts = []
-players = {}
-
-
-#
-# Assertion helpers
-# TODO: relocate to game abstraction
-#
-def is_host(user):
-    return game and game.active and game.host == user
-
+# The commands, loaded as an extension so they can be reloaded, and the plain modules reloaded along with them
+EXTENSION = "gameplay"
+RELOADED_MODULES = (messages, guards)
 
-def is_player(user):
-    return game and game.active and user in game.players
+# Where to serve metrics (workers under launcher.py each add their worker number to the port); port 0 turns it off
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT_VAR = "TOBAIFAM_METRICS_PORT"
+DEFAULT_METRICS_PORT = 9464
 
+# Give up on restoring games from before a restart after this long
+RESTORE_TIMEOUT = 30.0
 
-def is_signup_host(user):
-    return game and not game.active and game.host == user
+log = logging.getLogger(__name__)
 
+saved_games = None
+status_task = None
+lag_task = None
+profile_task = None
+reload_task = None
+failover_task = None
 
-def is_signup_player(user):
-    return game and not game.active and user in game.players
 
-
-#
-# Decorator-style command assertions - must be placed AFTER the @bot.command decorator
-# All of these assume the first arg to the command is the ctx.
-#
-# More general assertions should sit higher on the list than more specific assertions.
 #
-# TODO: possibly relocate to game abstraction? or own file
+# Events
 #
-# Example:
-# >>> @bot.command(brief="Example command")
-# >>> @require_game_active()
-# >>> @require_host()
-# >>> def example(ctx):
-# ...     pass
-#
-def require_host(yell_msg="You must be host to use this command."):
-    def _decorator(func):
-        @functools.wraps(func)
-        async def _wrapper(*args, **kwargs):
-            ctx = args[0]
-            if not is_host(ctx.author):
-                await yell_at_user(ctx, yell_msg)
-            else:
-                return await func(*args, **kwargs)
-
-        return _wrapper
-
-    return _decorator
-
-
-def require_signup_host(yell_msg="You must be the host of the current signing-up game to use this command."):
-    def _decorator(func):
-        @functools.wraps(func)
-        async def _wrapper(*args, **kwargs):
-            ctx = args[0]
-            if not is_signup_host(ctx.author):
-                await yell_at_user(ctx, yell_msg)
-            else:
-                return await func(*args, **kwargs)
-
-        return _wrapper
-
-    return _decorator
-
-
-def require_player(yell_msg="You must be a player to use this command."):
-    def _decorator(func):
-        @functools.wraps(func)
-        async def _wrapper(*args, **kwargs):
-            ctx = args[0]
-            if not is_player(ctx.author):
-                await yell_at_user(ctx, yell_msg)
-            else:
-                return await func(*args, **kwargs)
-
-        return _wrapper
-
-    return _decorator
 
 
-def require_signup_player(yell_msg="You must be signed up for a game to use this command."):
-    def _decorator(func):
-        @functools.wraps(func)
-        async def _wrapper(*args, **kwargs):
-            ctx = args[0]
-            if not is_signup_player(ctx.author):
-                await yell_at_user(ctx, yell_msg)
-            else:
-                return await func(*args, **kwargs)
-
-        return _wrapper
-
-    return _decorator
-
-
-def require_not_in_game(yell_msg="You're already part of the game!"):
-    def _decorator(func):
-        @functools.wraps(func)
-        async def _wrapper(*args, **kwargs):
-            ctx = args[0]
-            if any(
-                [is_host(ctx.author), is_player(ctx.author), is_signup_host(ctx.author), is_signup_player(ctx.author)]
-            ):
-                await yell_at_user(ctx, yell_msg)
-            else:
-                return await func(*args, **kwargs)
+@bot.event
+async def on_ready():
+    global saved_games, status_task, failover_task
+    print(f"--- {bot.user.name} has connected ---")
+    if status_task is None and shards.WORKER_VAR in os.environ:
+        status_task = asyncio.create_task(report_status())
+    if saved_games is not None:
+        to_restore, saved_games = saved_games, None
+        try:
+            if store is not None:
+                to_restore = await claim_saved_games(to_restore)
+            failed = await asyncio.wait_for(bot.extensions[EXTENSION].restore_games(to_restore), RESTORE_TIMEOUT)
+            if store is not None:
+                for key in failed:
+                    await store.release(key)
+        except asyncio.TimeoutError:
+            log.error("Timed out restoring games after %.0f seconds", RESTORE_TIMEOUT)
+        except Exception:  # pylint:disable=broad-except
+            # Whatever went wrong, the games we did get back still need sharing (and other nodes' games watching)
+            log.exception("Couldn't restore saved games")
+        finally:
+            games.on_change = record_change
+            timers.on_change = journal_timer
+    if store is not None and failover_task is None:
+        store.on_lost = lost_game
+        store.start()
+        failover_task = asyncio.create_task(fail_over())
 
-        return _wrapper
 
-    return _decorator
+@bot.event
+async def on_message(msg):
+    # During voting phase, delete any messages that don't start with =vote
+    if msg.channel.id in games.voting and not vote_filter.allows(msg.content):
+        game = games.get(msg.channel)
+        if msg.author.id != game.host and msg.author != bot.user:
+            vote_filter.reject(msg)
+            return
+    if msg.author.bot:
+        return
+    ctx = await bot.get_context(msg)
+    if ctx.command is None or not serialized(ctx.command):
+        await bot.invoke(ctx)
+        return
+    # Anything that might touch the channel's game waits its turn behind the game's other commands
+    key = games.key_for(msg.channel)
+    if not mailboxes.put(key, functools.partial(bot.invoke, ctx)) and mailboxes.should_notify(key):
+        await messages.yell_at_user(ctx, BUSY_MESSAGE)
 
 
-def require_game_not_active(yell_msg="There's already a game in progress!"):
-    def _decorator(func):
-        @functools.wraps(func)
-        async def _wrapper(*args, **kwargs):
-            ctx = args[0]
-            if game is not None and game.active:
-                await yell_at_user(ctx, yell_msg)
-            else:
-                return await func(*args, **kwargs)
+#
+# Crash recovery
+#
 
-        return _wrapper
 
-    return _decorator
+def record_change(key, op, **fields):
+    journal.record(key, op, **fields)
+    if store is not None:
+        store.record(key, op, **fields)
 
 
-def require_game_active(yell_msg="There's no game in progress!"):
-    def _decorator(func):
-        @functools.wraps(func)
-        async def _wrapper(*args, **kwargs):
-            ctx = args[0]
-            if game is None or not game.active:
-                await yell_at_user(ctx, yell_msg)
-            else:
-                return await func(*args, **kwargs)
+def journal_timer(key, t):
+    if t is None:
+        record_change(key, "timer", timer=None)
+    elif t.paused:
+        record_change(key, "timer", timer={"paused": t.paused_remaining})
+    else:
+        record_change(key, "timer", timer={"deadline": time.time() + timers.remaining(key)})
 
-        return _wrapper
 
-    return _decorator
+#
+# Sharing games with other nodes
+#
 
 
-def require_game_phase(phase, yell_msg="Now's not the time to do that!"):
-    def _decorator(func):
-        @functools.wraps(func)
-        async def _wrapper(*args, **kwargs):
-            ctx = args[0]
-            if game is None or game.phase != phase:
-                await yell_at_user(ctx, yell_msg)
-            else:
-                return await func(*args, **kwargs)
+async def claim_saved_games(saved):
+    """Works out which of the games saved before a restart are still ours, and where they've got to"""
+    claimed = {}
+    for key, state in saved.items():
+        shared = await store.claim(key, state)
+        if shared is None:
+            log.info("Game %s was taken over by another node while we were down", key)
+            journal.record(key, "cancel")
+        else:
+            claimed[key] = shared
+            journal.record(key, "restore", state=shared)
+    return claimed
 
-        return _wrapper
 
-    return _decorator
+async def fail_over():
+    """Every so often, takes over any game in our guilds whose node has stopped running it"""
+    # Games we've tried and failed to rebuild, which we leave to other nodes rather than trying again and again
+    unrestorable = set()
+    while True:
+        try:
+            for key in await store.orphans():
+                if key in games.games or key in unrestorable or bot.get_channel(key[1]) is None:
+                    continue
+                state = await store.take_over(key)
+                if state is None:
+                    continue
+                extension = bot.extensions[EXTENSION]
+                try:
+                    await extension.restore_game(key, state)
+                except Exception:  # pylint:disable=broad-except
+                    log.exception("Couldn't take over game %s", key)
+                    unrestorable.add(key)
+                    # Hand the game back just as we found it, before dropping what we'd rebuilt of it
+                    await store.release(key, state)
+                    await extension.drop_game(key)
+                    continue
+                # Rebuilding the game recorded it from scratch, so put everything else (its history) back
+                record_change(key, "restore", state=state)
+        except Exception:  # pylint:disable=broad-except
+            log.exception("Couldn't check for games to take over")
+        await asyncio.sleep(store.lease / 2)
+
+
+def lost_game(key):
+    mailboxes.put(key, functools.partial(bot.extensions[EXTENSION].drop_game, key), urgent=True)
 
 
 #
-# Commands
+# Metrics
 #
+command_seconds = metrics.registry.histogram(
+    "tobaifam_command_seconds", "Time taken to handle each command", ["command"]
+)
+phase_seconds = metrics.registry.histogram(
+    "tobaifam_phase_seconds", "How long each game phase lasted", ["phase"], buckets=metrics.PHASE_BUCKETS
+)
+timer_lateness_seconds = metrics.registry.histogram(
+    "tobaifam_timer_lateness_seconds", "How late timer announcements and expiries went off"
+)
+loop_lag_seconds = metrics.registry.histogram(
+    "tobaifam_event_loop_lag_seconds", "How late the event loop woke up sleeping tasks"
+)
+metrics.registry.gauge(
+    "tobaifam_games",
+    "Games in progress by phase",
+    ["phase"],
+    collect=lambda: {(p,): n for p, n in games_by_phase().items()},
+)
+metrics.registry.gauge("tobaifam_timers", "Running game timers", collect=lambda: {(): len(timers)})
+metrics.registry.counter(
+    "tobaifam_messages_sent_total",
+    "Messages sent to each channel",
+    ["channel"],
+    collect=lambda: {(o.channel.id,): o.sends for o in outboxes},
+)
+metrics.registry.counter(
+    "tobaifam_rate_limited_total",
+    "Requests to Discord about each channel that came back 429, retried or not (no channel for the rest)",
+    ["channel"],
+    collect=lambda: {("" if channel_id is None else channel_id,): n for channel_id, n in rate_limits.hits.items()},
+)
+metrics.registry.counter(
+    "tobaifam_send_failures_total",
+    "Messages to each channel that couldn't be sent",
+    ["channel"],
+    collect=lambda: {(o.channel.id,): o.failed for o in outboxes},
+)
+outbox_flush_seconds = metrics.registry.histogram(
+    "tobaifam_outbox_flush_seconds", "How long messages waited in their channel's outbox before going out"
+)
+metrics.registry.gauge(
+    "tobaifam_outbox_depth",
+    "Messages waiting to be sent to each channel",
+    ["channel"],
+    collect=lambda: {(o.channel.id,): o.depth for o in outboxes if o.depth},
+)
+metrics.registry.counter(
+    "tobaifam_messages_deleted_total",
+    "Off-topic messages deleted during voting in each channel",
+    ["channel"],
+    collect=lambda: {(channel_id,): n for channel_id, n in vote_filter.deleted.items()},
+)
+mailbox_wait_seconds = metrics.registry.histogram(
+    "tobaifam_mailbox_wait_seconds", "How long commands and timer callbacks waited for their game's earlier ones"
+)
+metrics.registry.gauge(
+    "tobaifam_mailbox_depth",
+    "Commands waiting their turn in each game",
+    ["channel"],
+    collect=lambda: {(m.key[1],): m.depth for m in mailboxes if m.depth},
+)
+metrics.registry.counter(
+    "tobaifam_commands_rejected_total",
+    "Commands turned away because their game's mailbox was full",
+    ["channel"],
+    collect=lambda: {(key[1],): n for key, n in mailboxes.rejected.items()},
+)
+metrics.registry.gauge(
+    "tobaifam_degraded",
+    "Whether the bot is leaving out cosmetic output because the event loop is behind (1) or not (0)",
+    collect=lambda: {(): int(degraded.active)},
+)
+metrics.registry.counter(
+    "tobaifam_degraded_changes_total",
+    "Times the bot has gone into or come out of degraded mode",
+    collect=lambda: {(): degraded.changes},
+)
+metrics.registry.counter(
+    "tobaifam_cosmetic_skipped_total",
+    "Cosmetic messages and pauses left out in degraded mode",
+    ["kind"],
+    collect=lambda: {(kind,): n for kind, n in degraded.skipped.items()},
+)
+metrics.registry.gauge(
+    "tobaifam_shared_games",
+    "Games this node holds the lease on in the shared store",
+    collect=lambda: {(): len(store)} if store is not None else {},
+)
+metrics.registry.counter(
+    "tobaifam_state_conflicts_total",
+    "Games found to have been taken over by another node when writing them back",
+    collect=lambda: {(): store.conflicts} if store is not None else {},
+)
+metrics.registry.gauge(
+    "tobaifam_gateway_latency_seconds",
+    "Time between gateway heartbeats and their acks",
+    collect=lambda: {(): bot.latency},
+)
+
+
+def games_by_phase():
+    phases = {}
+    for game in games:
+        phase = game.phase.name if game.active else "SIGNUP"
+        phases[phase] = phases.get(phase, 0) + 1
+    return phases
+
+
+def record_phase_time(_game, old_phase, seconds):
+    phase_seconds.observe(seconds, old_phase.name)
+
+
+@bot.before_invoke
+async def start_command_timer(ctx):
+    ctx.started_at = time.perf_counter()
+
+
+@bot.after_invoke
+async def record_command_time(ctx):
+    command_seconds.observe(time.perf_counter() - ctx.started_at, ctx.command.qualified_name)
 
 
 @bot.event
-async def on_ready():
-    print(f"--- {bot.user.name} has connected ---")
-
-
-@bot.event
-async def on_message(msg):
-    # During voting phase, delete any messages that don't start with =vote
-    if game and game.phase == game.Phase.VOTE:
-        if msg.author not in (game.host, bot.user):
-            if not msg.content.startswith(f"{CMD_PREFIX}vote") and not msg.content.startswith(f"{CMD_PREFIX}abstain"):
-                await msg.delete()
-                await msg.channel.send(
-                    msg.author.mention
-                    + f"You may only type `{CMD_PREFIX}vote [someone]` or `{CMD_PREFIX}abstain` at this time."
-                )
-                return
-    await bot.process_commands(msg)
-
-
-@bot.command(brief="Create a game as the manual host")
-@require_game_not_active()
-@require_not_in_game()
-async def host(ctx, *, game_name=None):
-    global game
-    if game is None:
-        default_name = False
-        if game_name is None:
-            default_name = True
-            game_name = ctx.author.display_name + "'s game"
-
-        # name, host, players, votes
-        game = mafia.Game(game_name, ctx.author)
-
-        if default_name:
-            await ctx.send("Game created!!!! :slight_smile:")
-        else:
-            await ctx.send(f"Created {game.name}!!!! :slight_smile:")
-        await ctx.send(
-            f"Players, type `{CMD_PREFIX}join` to sign up for this game.\n"
-            + f"(:information_source: **{game.host.display_name}** as the host, type `{CMD_PREFIX}cancel`"
-            + "to cancel the signups.)"
-        )
-    else:
-        await yell_at_user(ctx, f"{game.host.display_name} is already recruiting players for a game.")
-
-
-@bot.command(brief="Sign up for a game")
-@require_game_not_active()
-async def join(ctx):
-    if game is None:
-        await yell_at_user(ctx, "No one is seeking players for a game right now :-(")
-        await ctx.send(f"(If you want to start a new game as the host, type `{CMD_PREFIX}host` to create a new game.)")
-    elif not game.active:
-        game.players.append(ctx.author)
-        await ctx.send(
-            f"{ctx.author.mention} joined {game.name}.\n **Now playing ({len(game.players)}):** "
-            + ", ".join([p.name for p in game.players])
-        )
-        if len(game.players) >= 3:
-            await ctx.send(f"({game.host.mention}, as the host, you can start the game by typing `{CMD_PREFIX}start`.)")
-
-
-@bot.command(brief="Un-sign-up for a game")
-@require_game_not_active()
-@require_signup_player()
-async def unjoin(ctx):
-    if game is None:
-        await yell_at_user(ctx, "There's no game to leave right now!")
-    else:
-        game.players = [p for p in game.players if p != ctx.author]
-        await ctx.send(
-            f"{ctx.author.mention} left the game.\n **Now playing ({len(game.players)}):**"
-            + ", ".join([p.name for p in game.players])
-        )
+async def setup_hook():
+    global lag_task
+    port = int(os.environ.get(METRICS_PORT_VAR, DEFAULT_METRICS_PORT))
+    if port:
+        port += int(os.environ.get(shards.WORKER_VAR, 0))
+        try:
+            await metrics.serve(METRICS_HOST, port)
+        except OSError:
+            log.exception("Couldn't serve metrics on port %d", port)
+    lag_task = asyncio.create_task(metrics.monitor_loop_lag(loop_lag_seconds, on_lag=degraded.observe))
+    games.on_phase_change = record_phase_time
+    timers.on_lateness = timer_lateness_seconds.observe
+    mailboxes.on_wait = mailbox_wait_seconds.observe
+    outboxes.on_flush = outbox_flush_seconds.observe
+    if hasattr(signal, "SIGUSR2"):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR2, profile_on_signal)
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_on_signal)
+    await bot.load_extension(EXTENSION)
 
 
-@bot.command(brief="Cancel game during signups")
-@require_game_not_active()
-@require_signup_host()  # TODO: allow anyone (not just host) to cancel a game after like some amount of time idk
-async def cancel(ctx):
-    global game
-    game = None
-    await ctx.send("Game cancelled. :crying_cat_face:")
+#
+# Profiling
+#
 
 
-@bot.command(brief="Start game when you are the host")
-@require_game_not_active()
-@require_signup_host()
-async def start(ctx):
-    if len(game.players) < 3:
-        await yell_at_user(ctx, "You need at least three players for a Mafia game!")
+def profile_on_signal():
+    global profile_task
+    if profiler.running:
+        log.warning("Ignoring SIGUSR2: there's already a profile running")
         return
-    game.active = True
-    game.day = 0
-    game.phase = game.Phase.TWILIGHT
-    await ctx.send(" ".join(p.mention for p in game.players) + " : The game is starting!\n")
-
-    # Count down
-    for i in range(3, 0, -1):
-        await asyncio.sleep(0.5)
-        await ctx.send(f"{i}...")
-
-    # Print game-starting stuff
-    await asyncio.sleep(0.5)
-    await system_message(ctx, game.name)
-    await asyncio.sleep(0.2)
-    await ctx.send(random.choice(messages.START_MSGS))
-    await enter_night_phase(ctx)
-
-
-@bot.command(brief="Set a timer to end a particular phase")
-@require_game_active()
-@require_host()
-async def timer(ctx, arg):
-    # Cancel any existing timer
-    cancel_timer()
-
-    # Parse time expression (if no units supplied, we assume minutes)
-    time_amt = None
-    if m := re.match(r"^([\d\.]+) *mi?n?u?t?e?s?$", arg):
-        time_amt = float(m.group(1)) * 60
-    elif m := re.match(r"^([\d]+) *s?e?c?o?n?d?s?$", arg):
-        time_amt = float(m.group(1))
-    elif m := re.match(r"^([\d]+)$", arg):
-        time_amt = float(m.group(1)) * 60
-
-    if time_amt is not None:
-        mins = time_amt // 60
-        secs = int(time_amt) % 60
-
-        # phrase time stuff
-        # e.g. "Day is ending in 5 minutes and 48 seconds"
-        time_phrase = "in "
-
-        if mins != 0:
-            if mins == 1:
-                time_phrase += "1 minute"
-            else:
-                time_phrase += f"{mins} minutes"
-
-        if mins != 0 and secs != 0:
-            time_phrase += " and "
-
-        if secs != 0:
-            if secs == 1:
-                time_phrase += "1 second"
-            else:
-                time_phrase += f"{secs} seconds"
-
-        if mins == 0 and secs == 0:
-            time_phrase = "NOW"
-
-        await system_message(ctx, f"{game.phase.value} will end {time_phrase}.", "hourglass")
+    log.info("Profiling for %.0f seconds", DEFAULT_PROFILE_SECONDS)
+    profile_task = asyncio.create_task(profiler.run(DEFAULT_PROFILE_SECONDS, directory=profile_dir()))
 
-        try:
-            await timer_routine(ctx, time_amt)
-        except Alarm as a:
-            # Timer got cancelled early -- so abort!
-            await ctx.send(a.args[0])
-            return
 
-        # Once timer finishes, move to the next phase of gameplay
-        if game.phase == game.Phase.DAY:
-            await enter_voting_phase(ctx)
-        elif game.phase == game.Phase.VOTE:
-            await enter_twilight_phase(ctx)
-        elif game.phase == game.Phase.TWILIGHT:
-            await enter_night_phase(ctx)
-        elif game.phase == game.Phase.NIGHT:
-            await enter_day_phase(ctx, None)
-    else:
-        await yell_at_user(
-            ctx,
-            "Unknown time format. :( Please specify something like '5m' or '30s'.",
-        )
-
-
-async def cast_vote(ctx, voted_user):
-    game.votes[ctx.author] = voted_user
+#
+# Reloading the commands in place
+#
 
-    if voted_user is Abstain:
-        name = "Abstain"
-        mention = "Abstain"
-    else:
-        name = voted_user.display_name
-        mention = voted_user.mention
-
-    majority_count = len(game.players) // 2 + 1
-    await ctx.send(
-        f"{ctx.author.mention} votes for {mention}! "
-        + f"({game.votes_for(voted_user)} votes for {name}, {majority_count} needed for majority)"
-    )
-
-    if game.votes_for(voted_user) >= majority_count:
-        if voted_user is Abstain:
-            await system_message(
-                ctx,
-                "The town votes to abstain!",
-                "neutral_face",
-                messages.VOTE_ABSTAIN_RESPONSES,
-            )
-        else:
-            await system_message(
-                ctx,
-                "Majority reached!",
-                "open_mouth",
-                messages.VOTE_MAJORITY_RESPONSES,
-            )
-        await enter_twilight_phase(ctx)
-
-    elif game.total_votes() == len(game.players):
-        await system_message(
-            ctx,
-            "Everyone voted, but no majority was reached!",
-            "slight_frown",
-            messages.VOTE_NO_DECISION_RESPONSES,
-        )
-        await enter_twilight_phase(ctx)
 
+async def reload_commands():
+    """Swaps in the latest version of the commands and messages, returning how long it took
 
-@bot.command(brief="Cast a vote during a game's voting phase")
-@require_game_active()
-@require_player()
-@require_game_phase(mafia.Game.Phase.VOTE, yell_msg="Please wait until the end of the day to cast your vote!")
-async def vote(ctx, *, arg=None):
-    if arg is None:
-        await yell_at_user(ctx, "Who are you voting for???")
-    else:
-        try:
-            voted_user = game.find_user(arg)
-            await cast_vote(ctx, voted_user)
-        except ValueError as e:
-            await yell_at_user(ctx, e.args[0])
-
-
-@bot.command(brief="Abstain during a game's voting phase")
-@require_game_active()
-@require_player()
-@require_game_phase(mafia.Game.Phase.VOTE, yell_msg="Please wait until the end of the day to cast your vote!")
-async def abstain(ctx):
-    await cast_vote(ctx, Abstain)
-
-
-@bot.command(brief="Eliminate a player manually as the host")
-@require_game_active()
-@require_host()
-async def kill(ctx, *, arg=None):
-    if arg is None:
-        await yell_at_user(ctx, "Who do you want to eliminate?")
-    else:
-        try:
-            eliminated_user = game.find_user(arg)
-            await eliminate_player(ctx, eliminated_user)
-        except ValueError as e:
-            await yell_at_user(ctx, e.args[0])
-
-
-@bot.command(brief="Test functionality")
-async def ping(ctx):
-    await ctx.send(ctx.author.mention + " pong")
-
-
-async def timer_routine(ctx, length):
-    game.timer = length
-    while game.timer > 0:
-        await asyncio.sleep(1)
-        if game.stop_timer:
-            game.stop_timer = False
-            raise Alarm("*(stopped previous timer)*")
-        game.timer -= 1
-        if game.timer == 0:
-            # await system_message(ctx, NORMAL_ALARM_TEXT, 'bell', ALARM_TONES)
-            pass
-        elif game.timer % 120 == 0:
-            await system_message(ctx, f"{timer // 60} minutes left")
-        elif game.timer == 60:
-            await system_message(ctx, "One minute left")
-        elif game.timer == 30:
-            await system_message(ctx, "30 seconds left")
-        elif game.timer == 15:
-            await system_message(ctx, "15 seconds left!")
-        elif game.timer == 10:
-            await system_message(ctx, "10 seconds left!!")
-        elif game.timer <= 5:
-            await system_message(ctx, str(int(game.timer)))
-
-
-def cancel_timer():
-    if game.timer > 0:
-        game.timer = 0
-        game.stop_timer = True
-
-
-async def enter_voting_phase(ctx, say_nothing=False):
-    cancel_timer()
-    game.phase = game.Phase.VOTE
-    if not say_nothing:
-        game.votes = {}
-        await system_message(ctx, messages.NORMAL_VOTING_TEXT, "pencil2", messages.VOTING_TONES)
-        await ctx.send(
-            f"Type something like `{CMD_PREFIX}vote {game.host.display_name}`to vote for another user. "
-            + f"(You can also ping whoever you're voting for after the `{CMD_PREFIX}vote` command.)\n"
-            + f"You can also type `{CMD_PREFIX}abstain` to cast a vote for no one.\n"
-            + "Voting phase ends when everyone has cast a vote, or when a majority is reached.\n"
-            + f"(:information_source: **{game.host.display_name}**, you can type `{CMD_PREFIX}timer [time limit]` "
-            + f"to place a time limit on voting, or `{CMD_PREFIX}day` to extend the day phase more.)"
-        )
+    Games, timers, the gateway connection and everything else in the runtime module carry on as they were. If the new
+    version of the extension won't load, the old one stays in place.
+    """
+    started = time.perf_counter()
+    for module in RELOADED_MODULES:
+        importlib.reload(module)
+    await bot.reload_extension(EXTENSION)
+    return time.perf_counter() - started
 
 
-async def enter_day_phase(ctx, arg):
-    if game.phase == game.Phase.NIGHT:
-        cancel_timer()
-        game.day += 1
-        game.phase = game.Phase.DAY
-        cancel_timer()
-        await system_message(ctx, f"DAY {game.day} BEGINS", "sunny")
-        await ctx.send(f"**Alive ({len(game.players)}):** {', '.join([p.mention for p in game.players])}")
-    elif game.phase == game.Phase.TWILIGHT:
-        await yell_at_user(ctx, "Please wait for the night to start before trying to end the night")
+@bot.command(brief="Reload the game commands and messages without restarting the bot", extras={"serialized": False})
+@require_operator()
+async def reload(ctx):
+    try:
+        seconds = await reload_commands()
+    except Exception as e:  # pylint:disable=broad-except
+        log.exception("Couldn't reload the commands")
+        await messages.yell_at_user(ctx, f"Couldn't reload, so the old version's still running: {e}")
         return
-    else:
-        # can use this to extend day after calling an =vote
-        cancel_timer()
-        game.phase = game.Phase.DAY
-        await system_message(ctx, f"DAY {game.day}***, um, ***CONTINUES", "sunny")
-
-    if arg is None:
-        await ctx.send(
-            f"(:information_source: **{game.host.display_name}**, you can type:\n"
-            + f"- `{CMD_PREFIX}timer X` to move to voting phase in X amount of time (X could be `5m`, `30s`, etc)\n"
-            + f"- `{CMD_PREFIX}votingphase` to immediately end the day and move to voting phase.)\n"
-        )
-    else:
-        await timer(ctx, arg)
+    await send(ctx, f"Reloaded in {seconds * 1000:.0f}ms.")
 
 
-async def enter_twilight_phase(ctx):
-    if game.phase == game.Phase.VOTE:
-        cancel_timer()
-        game.phase = game.Phase.TWILIGHT
-        # RESOLVE VOTES
-        # Calculate who got eliminated
+def reload_on_signal():
+    global reload_task
 
-        majority_count = len(game.players) // 2 + 1
-        eliminated = None
+    async def _reload():
+        try:
+            log.info("Reloaded the commands in %.0fms", await reload_commands() * 1000)
+        except Exception:  # pylint:disable=broad-except
+            log.exception("Couldn't reload the commands")
 
-        voting_results_msg = (
-            f"With **{len(game.players)}** players alive, a majority decision requires **{majority_count}** votes.\n"
-        )
-        for u in game.players:
-            vote_count = game.votes_for(u)
-            if vote_count > 0:
-                voters = [p.display_name for p, v in game.votes.items() if v == u]
-                voting_results_msg += f"**{u.display_name} ({vote_count})**: {', '.join(voters)}\n"
-            if vote_count >= majority_count:
-                eliminated = u
-
-        if game.votes_for(Abstain) > 0:
-            voters = [p.display_name for p, v in game.votes.items() if v == Abstain]
-            voting_results_msg += f"**Abstain ({game.votes_for(Abstain)})**: {', '.join(voters)}\n"
-
-        await system_message(ctx, "RESULTS", "ballot_box", messages.VOTING_END_TONES)
-        await ctx.send(voting_results_msg)
-
-        if eliminated is not None:
-            await eliminate_player(ctx, eliminated)
-        else:
-            await ctx.send("No one is eliminated.")
+    reload_task = asyncio.create_task(_reload())
 
-        await ctx.send(
-            f"(:information_source: **{game.host.display_name}**, say your piece, then type `{CMD_PREFIX}night`"
-            + "to move to night phase.)"
-        )
 
+#
+# Status reports for the launcher
+#
 
-async def enter_night_phase(ctx):
-    if game.phase == game.Phase.DAY:
-        cancel_timer()
-        # undo starting the day
-        game.day -= 1
-        game.phase = game.Phase.NIGHT
-        await system_message(ctx, f"...***uh, ***GOING BACK TO NIGHT {game.day}", "first_quarter_moon_with_face")
-    elif game.phase == game.Phase.VOTE:
-        await yell_at_user(
-            ctx,
-            f"Voting is not over yet! Type '{CMD_PREFIX}timer 0` to end voting and resolve the elimination first.",
-        )
-    elif game.phase == game.Phase.TWILIGHT:
-        cancel_timer()
-        game.phase = game.Phase.NIGHT
-        await system_message(ctx, f"NIGHT {game.day} BEGINS", "first_quarter_moon_with_face")
-
-        if game.day == 0:
-            await ctx.send(
-                f"(:information_source: **{game.host.display_name}**, do whatever you need to, then type "
-                + f"`{CMD_PREFIX}day` to start the first day. You can also specify a time limit, like "
-                + f"`{CMD_PREFIX}day 5min`.)\n"
-            )
-        else:
-            await ctx.send(
-                f"(:information_source: **{game.host.display_name}**, you can type:\n"
-                + f"- `{CMD_PREFIX}timer X` to end the night in a certain amount of time\n"
-                + f"- `{CMD_PREFIX}day` to immediately end the night and move to the next day phase.)\n"
-            )
-    elif game.phase == game.Phase.NIGHT:
-        await yell_at_user(ctx, "Hey! It's already nighttime, you weirdo!")
-
-
-async def eliminate_player(ctx, eliminated):
-    game.players = [p for p in game.players if p != eliminated]
-    game.dead.append(eliminated)
-    death_emoji = random.choice(messages.DEATH_EMOJIS)
-    await ctx.send(f":{death_emoji}: {eliminated.mention} has been eliminated. :{death_emoji}:")
-
-
-@bot.command(brief="Move to day phase in game")
-@require_game_active()
-@require_host()
-async def day(ctx, *, arg=None):
-    await enter_day_phase(ctx, arg)
-
-
-@bot.command(brief="Move to night phase in game")
-@require_game_active()
-@require_host()
-async def night(ctx):
-    await enter_night_phase(ctx)
-
-
-@bot.command(brief="Move to voting phase in game")
-@require_game_active()
-@require_host()
-async def votingphase(ctx):
-    if game.phase == game.Phase.DAY:
-        await enter_voting_phase(ctx)
-    elif game.phase == game.Phase.VOTE:
-        yell_at_user(ctx, "It's already the voting phase, what are you doing?")
-    elif game.phase == game.Phase.TWILIGHT:
-        system_message(ctx, "NEVER MIND, CONTINUE VOTING")
-        await enter_voting_phase(ctx, say_nothing=True)
-    elif game.phase == game.Phase.NIGHT:
-        await yell_at_user(ctx, "Voting already ended for the day!")
+
+def worker_status():
+    outbox_stats = outboxes.stats()
+    return {
+        "worker": int(os.environ[shards.WORKER_VAR]),
+        "pid": os.getpid(),
+        "shards": list(bot.shards) if isinstance(bot, commands.AutoShardedBot) else [0],
+        "latency": bot.latency,
+        "guilds": len(bot.guilds),
+        "games": len(games),
+        "phases": games_by_phase(),
+        "timers": len(timers),
+        "timer_lateness": timers.lateness,
+        "sends": outbox_stats["sends"],
+        "rate_limited": rate_limits.total(),
+        "outbox_depth": outbox_stats["depth"],
+    }
+
+
+async def report_status():
+    while True:
+        try:
+            shards.write_status(journal.directory, worker_status())
+        except OSError:
+            log.exception("Couldn't write worker status")
+        await asyncio.sleep(shards.STATUS_INTERVAL)
 
 
 #
@@ -645,10 +421,17 @@ async def votingphase(ctx):
 #
 
 if __name__ == "__main__":
-
     access_token = os.environ.get(DISCORD_API_TOKEN_VAR, None)
     if access_token is None:
         raise EnvironmentError(
             f"{DISCORD_API_TOKEN_VAR} environment variable not set! Ensure you have a valid Discord API bot token!"
         )
-    bot.run(access_token)
+    saved_games = journal.recover()
+    journal.start()
+    try:
+        bot.run(access_token)
+    finally:
+        if store is not None:
+            asyncio.run(store.close())
+        journal.close()
+        archive.close()
@@ -0,0 +1,74 @@
+"""Keeps voting-phase channels clear of anything that isn't a vote"""
+import asyncio
+import collections
+import logging
+import time
+
+import discord
+
+from outbox import send
+
+log = logging.getLogger(__name__)
+
+# How long to collect offending messages before deleting them in one go
+DELETE_WINDOW = 1.0
+
+# Don't warn the same person about the rules more often than this
+WARNING_COOLDOWN = 30.0
+
+# Discord's limit on the number of messages in a single bulk delete
+BULK_DELETE_LIMIT = 100
+
+
+class VoteFilter:
+    """Batches up deletions of off-topic messages and the warnings that go with them"""
+
+    def __init__(self, allowed_prefixes, warning, window=DELETE_WINDOW, cooldown=WARNING_COOLDOWN):
+        self.allowed_prefixes = tuple(allowed_prefixes)
+        self.warning = warning
+        self.window = window
+        self.cooldown = cooldown
+        self.pending = {}
+        self.warned = {}
+        self.tasks = set()
+        # Number of messages deleted in each channel
+        self.deleted = collections.Counter()
+
+    def allows(self, content):
+        return content.startswith(self.allowed_prefixes)
+
+    def reject(self, msg):
+        """Queues a message to be deleted (and its author warned, if they haven't been lately)"""
+        batch = self.pending.get(msg.channel.id)
+        if batch is None:
+            batch = self.pending[msg.channel.id] = ([], {})
+            task = asyncio.create_task(self._flush(msg.channel))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        batch[0].append(msg)
+        key = (msg.channel.id, msg.author.id)
+        now = time.monotonic()
+        if now - self.warned.get(key, -self.cooldown) >= self.cooldown:
+            self.warned[key] = now
+            batch[1][msg.author.id] = msg.author.mention
+
+    async def _flush(self, channel):
+        await asyncio.sleep(self.window)
+        msgs, mentions = self.pending.pop(channel.id)
+        for i in range(0, len(msgs), BULK_DELETE_LIMIT):
+            chunk = msgs[i : i + BULK_DELETE_LIMIT]
+            try:
+                if len(chunk) == 1:
+                    await chunk[0].delete()
+                else:
+                    await channel.delete_messages(chunk)
+                self.deleted[channel.id] += len(chunk)
+            except discord.HTTPException as e:
+                log.warning("Couldn't delete messages in channel %s: %s", channel.id, e)
+        if mentions:
+            await send(channel, " ".join(mentions.values()) + " " + self.warning)
+        self._forget_old_warnings()
+
+    def _forget_old_warnings(self):
+        cutoff = time.monotonic() - self.cooldown
+        self.warned = {k: t for k, t in self.warned.items() if t > cutoff}